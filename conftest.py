@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+إعدادات الاختبارات المشتركة - تحميل ملف البوت كوحدة لكل ملف اختبار
+"""
+
+import importlib.util
+import os
+
+import pytest
+
+# بدون منصة MetaTrader5 (Linux/CI) يعمل البوت على البديل المحلي mt5_offline
+os.environ.setdefault("TBOT_MT5_BACKEND", "offline")
+
+BOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tbot_v1.2.0.py")
+
+
+@pytest.fixture(scope="module")
+def bot():
+    """تحميل ملف البوت كوحدة (اسم الملف يحتوي على نقاط) - نسخة مستقلة لكل ملف اختبار"""
+    spec = importlib.util.spec_from_file_location("tbot_v1_2_0", BOT_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,485 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+🧪 بديل محلي لمكتبة MetaTrader5 - Offline MT5 Backend
+=====================================================
+يحاكي واجهة MetaTrader5 المستخدمة في البوت بدون منصة (لتشغيل الاختبارات وقياس الأداء على Linux):
+initialize, shutdown, last_error, account_info, symbol_info, symbol_info_tick,
+copy_rates_from_pos, symbols_total, symbols_get, symbol_select
+
+مصادر البيانات:
+- ملفات مسجلة في مجلد TBOT_MT5_OFFLINE_DATA:
+  <SYMBOL>_M1.csv   (time,open,high,low,close,tick_volume,spread,real_volume)
+  <SYMBOL>_ticks.csv (time,bid,ask,last,volume) - اختياري
+  تعاد بالتدريج حسب ساعة افتراضية تبدأ عند التهيئة (TBOT_MT5_OFFLINE_SPEED لتسريع الإعادة)
+- بيانات اصطناعية حتمية لباقي الرموز (نفس الرمز = نفس المسار لنفس البذرة)
+
+حقن التأخير والأعطال:
+- TBOT_MT5_OFFLINE_LATENCY / TBOT_MT5_OFFLINE_JITTER: تأخير كل استدعاء بالثواني
+- TBOT_MT5_OFFLINE_FAILURE_RATE: احتمال فشل أي استدعاء (يعيد None مثل المنصة)
+- disconnect(seconds): محاكاة انقطاع المنصة - جميع الاستدعاءات تفشل حتى انتهاء المدة
+
+الاستخدام: TBOT_MT5_BACKEND=offline python tbot_v1.2.0.py
+"""
+
+import csv
+import math
+import os
+import random
+import threading
+import time
+import zlib
+from collections import namedtuple
+from typing import Dict, Optional
+
+import numpy as np
+
+# ===== ثوابت الأطر الزمنية (نفس قيم MetaTrader5) =====
+TIMEFRAME_M1 = 1
+TIMEFRAME_M2 = 2
+TIMEFRAME_M3 = 3
+TIMEFRAME_M4 = 4
+TIMEFRAME_M5 = 5
+TIMEFRAME_M6 = 6
+TIMEFRAME_M10 = 10
+TIMEFRAME_M12 = 12
+TIMEFRAME_M15 = 15
+TIMEFRAME_M20 = 20
+TIMEFRAME_M30 = 30
+TIMEFRAME_H1 = 16385
+TIMEFRAME_H2 = 16386
+TIMEFRAME_H3 = 16387
+TIMEFRAME_H4 = 16388
+TIMEFRAME_H6 = 16390
+TIMEFRAME_H8 = 16392
+TIMEFRAME_H12 = 16396
+TIMEFRAME_D1 = 16408
+TIMEFRAME_W1 = 32769
+
+_TIMEFRAME_SECONDS = {
+    TIMEFRAME_M1: 60, TIMEFRAME_M2: 120, TIMEFRAME_M3: 180, TIMEFRAME_M4: 240, TIMEFRAME_M5: 300,
+    TIMEFRAME_M6: 360, TIMEFRAME_M10: 600, TIMEFRAME_M12: 720, TIMEFRAME_M15: 900, TIMEFRAME_M20: 1200,
+    TIMEFRAME_M30: 1800, TIMEFRAME_H1: 3600, TIMEFRAME_H2: 7200, TIMEFRAME_H3: 10800, TIMEFRAME_H4: 14400,
+    TIMEFRAME_H6: 21600, TIMEFRAME_H8: 28800, TIMEFRAME_H12: 43200, TIMEFRAME_D1: 86400, TIMEFRAME_W1: 604800,
+}
+
+# ===== رموز نتائج العمليات =====
+RES_S_OK = 1
+RES_E_FAIL = -1
+RES_E_INVALID_PARAMS = -2
+RES_E_NOT_FOUND = -4
+RES_E_INTERNAL_FAIL_INIT = -10005
+RES_E_NO_IPC = -10004
+
+RATES_DTYPE = np.dtype([
+    ('time', '<i8'),
+    ('open', '<f8'),
+    ('high', '<f8'),
+    ('low', '<f8'),
+    ('close', '<f8'),
+    ('tick_volume', '<u8'),
+    ('spread', '<i4'),
+    ('real_volume', '<u8'),
+])
+
+Tick = namedtuple('Tick', 'time bid ask last volume time_msc flags volume_real')
+SymbolInfo = namedtuple('SymbolInfo', 'name description path visible select point digits spread bid ask last '
+                                      'volume_min volume_max volume_step trade_contract_size '
+                                      'currency_base currency_profit currency_margin')
+AccountInfo = namedtuple('AccountInfo', 'login server name company currency balance equity margin margin_free leverage')
+
+# ===== الإعدادات =====
+OFFLINE_DATA_DIR = os.environ.get('TBOT_MT5_OFFLINE_DATA', '')
+OFFLINE_SEED = int(os.environ.get('TBOT_MT5_OFFLINE_SEED', '42'))
+OFFLINE_TICK_INTERVAL = 0.25  # ثوان - تيك اصطناعي جديد كل ربع ثانية
+OFFLINE_REPLAY_WARMUP = 1500  # شموع M1 مكشوفة من الملف عند بدء الإعادة
+
+# (السعر الأساسي، الخانات، حجم العقد، الحجم الأدنى/الخطوة، التذبذب اليومي التقريبي)
+_SYMBOL_SPECS = {
+    'EURUSD': (1.0850, 5, 100000, 0.01, 0.005), 'USDJPY': (151.20, 3, 100000, 0.01, 0.006),
+    'GBPUSD': (1.2710, 5, 100000, 0.01, 0.006), 'AUDUSD': (0.6550, 5, 100000, 0.01, 0.007),
+    'USDCAD': (1.3620, 5, 100000, 0.01, 0.005), 'USDCHF': (0.8840, 5, 100000, 0.01, 0.005),
+    'NZDUSD': (0.6050, 5, 100000, 0.01, 0.007), 'EURGBP': (0.8540, 5, 100000, 0.01, 0.004),
+    'EURJPY': (164.10, 3, 100000, 0.01, 0.007), 'GBPJPY': (192.20, 3, 100000, 0.01, 0.008),
+    'XAUUSD': (2350.0, 2, 100, 0.01, 0.010), 'XAGUSD': (28.50, 3, 5000, 0.01, 0.018),
+    'XPTUSD': (980.0, 2, 50, 0.01, 0.015), 'XPDUSD': (1020.0, 2, 100, 0.01, 0.020),
+    'BTCUSD': (65000.0, 2, 1, 0.01, 0.030), 'ETHUSD': (3400.0, 2, 1, 0.01, 0.035),
+    'BNBUSD': (580.0, 2, 1, 0.01, 0.035), 'XRPUSD': (0.52, 5, 1, 1.0, 0.040),
+    'ADAUSD': (0.45, 5, 1, 1.0, 0.040), 'SOLUSD': (150.0, 2, 1, 0.01, 0.045),
+    'DOTUSD': (7.2, 3, 1, 0.1, 0.040), 'DOGEUSD': (0.15, 5, 1, 1.0, 0.050),
+    'AVAXUSD': (35.0, 2, 1, 0.1, 0.045), 'LINKUSD': (15.0, 3, 1, 0.1, 0.040),
+    'LTCUSD': (85.0, 2, 1, 0.01, 0.035), 'BCHUSD': (480.0, 2, 1, 0.01, 0.035),
+    'AAPL': (190.0, 2, 1, 1.0, 0.015), 'TSLA': (180.0, 2, 1, 1.0, 0.035),
+    'GOOGL': (170.0, 2, 1, 1.0, 0.015), 'MSFT': (420.0, 2, 1, 1.0, 0.013),
+    'AMZN': (185.0, 2, 1, 1.0, 0.018), 'META': (480.0, 2, 1, 1.0, 0.022),
+    'NVDA': (900.0, 2, 1, 1.0, 0.030), 'NFLX': (620.0, 2, 1, 1.0, 0.022),
+    'US30': (39000.0, 1, 1, 0.1, 0.008), 'SPX500': (5200.0, 1, 1, 0.1, 0.008),
+    'NAS100': (18200.0, 1, 1, 0.1, 0.011), 'GER40': (18300.0, 1, 1, 0.1, 0.009),
+    'UK100': (8100.0, 1, 1, 0.1, 0.007),
+}
+
+
+class OfflineBackend:
+    """حالة البديل المحلي: الاتصال، الساعة الافتراضية، البيانات المسجلة، حقن التأخير والأعطال"""
+
+    def __init__(self, data_dir: str = OFFLINE_DATA_DIR, seed: int = OFFLINE_SEED):
+        self.data_dir = data_dir
+        self.seed = seed
+        self.latency = float(os.environ.get('TBOT_MT5_OFFLINE_LATENCY', '0'))
+        self.jitter = float(os.environ.get('TBOT_MT5_OFFLINE_JITTER', '0'))
+        self.failure_rate = float(os.environ.get('TBOT_MT5_OFFLINE_FAILURE_RATE', '0'))
+        self.speed = float(os.environ.get('TBOT_MT5_OFFLINE_SPEED', '1'))
+        self.initialized = False
+        self.down_until = 0.0  # monotonic - نهاية الانقطاع المحاكى
+        self.error = (RES_S_OK, 'Success')
+        self.calls = 0
+        self.failures = 0
+        self._random = random.Random(seed)
+        self._recorded = {}  # {symbol: (m1 rates, ticks or None)}
+        self._replay = {}  # {symbol: (origin data time, offset to wall time)}
+        self._selected = set()
+        self._started_wall = time.time()
+        self._lock = threading.Lock()
+        self._load_recorded()
+
+    # ----- البيانات المسجلة -----
+    def _load_recorded(self):
+        """قراءة ملفات <SYMBOL>_M1.csv و <SYMBOL>_ticks.csv من مجلد البيانات"""
+        if not self.data_dir or not os.path.isdir(self.data_dir):
+            return
+        for name in sorted(os.listdir(self.data_dir)):
+            if not name.endswith('_M1.csv'):
+                continue
+            symbol = name[:-len('_M1.csv')]
+            rates = _read_rates_csv(os.path.join(self.data_dir, name))
+            ticks_path = os.path.join(self.data_dir, f"{symbol}_ticks.csv")
+            ticks = _read_ticks_csv(ticks_path) if os.path.exists(ticks_path) else None
+            if len(rates):
+                self._recorded[symbol] = (rates, ticks)
+
+        # إزاحة بمضاعفات الدقيقة حتى تبدو الشموع والتيكات المعادة حديثة (فحوص الصحة تعتمد على عمر التيك)
+        for symbol, (rates, _) in self._recorded.items():
+            origin = int(rates['time'][min(len(rates), OFFLINE_REPLAY_WARMUP) - 1])
+            offset = int(self._started_wall - origin) // 60 * 60
+            self._replay[symbol] = (origin, offset)
+
+    def _cursor(self, symbol: str) -> float:
+        """وقت البيانات المسجلة المكشوف حتى الآن حسب سرعة الإعادة"""
+        origin, _ = self._replay[symbol]
+        return origin + (time.time() - self._started_wall) * self.speed
+
+    # ----- حقن التأخير والأعطال -----
+    def enter(self) -> bool:
+        """تطبيق التأخير والفشل المحاكى قبل أي استدعاء - False = الاستدعاء يفشل
+        
+        العدادات والخطأ والمولد العشوائي المشترك تحت القفل، والتأخير خارجه
+        """
+        with self._lock:
+            self.calls += 1
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            time.sleep(delay)
+        with self._lock:
+            if time.monotonic() < self.down_until:
+                self.initialized = False
+                return self._fail(RES_E_NO_IPC, 'No IPC connection')
+            if not self.initialized:
+                return self._fail(RES_E_NO_IPC, 'No IPC connection')
+            if self.failure_rate and self._random.random() < self.failure_rate:
+                return self._fail(RES_E_FAIL, 'Injected failure')
+            self.error = (RES_S_OK, 'Success')
+            return True
+
+    def _fail(self, code: int, message: str) -> bool:
+        self.failures += 1
+        self.error = (code, message)
+        return False
+
+    # ----- الرموز -----
+    def known(self, symbol: str) -> bool:
+        return symbol in self._recorded or symbol in _SYMBOL_SPECS
+
+    def symbols(self):
+        return sorted(set(_SYMBOL_SPECS) | set(self._recorded))
+
+    def spec(self, symbol: str):
+        if symbol in _SYMBOL_SPECS:
+            return _SYMBOL_SPECS[symbol]
+        rates, _ = self._recorded[symbol]
+        return (float(rates['close'][0]), 5, 100000, 0.01, 0.01)
+
+    # ----- البيانات -----
+    def rates(self, symbol: str, timeframe: int, start_pos: int, count: int) -> Optional[np.ndarray]:
+        seconds = _TIMEFRAME_SECONDS.get(timeframe)
+        if seconds is None or count <= 0 or start_pos < 0:
+            return None
+        if symbol in self._recorded:
+            return self._recorded_rates(symbol, seconds, start_pos, count)
+        return self._synthetic_rates(symbol, seconds, start_pos, count)
+
+    def _recorded_rates(self, symbol: str, seconds: int, start_pos: int, count: int) -> np.ndarray:
+        """الشموع المكشوفة حتى المؤشر مزاحة لوقت حديث ثم مجمعة للإطار المطلوب"""
+        m1, _ = self._recorded[symbol]
+        revealed = m1[:np.searchsorted(m1['time'], self._cursor(symbol), side='right')].copy()
+        revealed['time'] += self._replay[symbol][1]
+        bars = _aggregate(revealed, seconds) if seconds != 60 else revealed
+        end = len(bars) - start_pos
+        return bars[max(0, end - count):max(0, end)].copy()
+
+    def _synthetic_rates(self, symbol: str, seconds: int, start_pos: int, count: int) -> np.ndarray:
+        """شموع اصطناعية حتمية: كل شمعة تُبنى من عينات مسار السعر داخلها"""
+        now = time.time()
+        current_open = int(now // seconds) * seconds
+        opens = current_open - seconds * np.arange(start_pos + count - 1, start_pos - 1, -1, dtype=np.int64)
+        samples = min(seconds // 60, 30) + 1
+        offsets = np.linspace(0, seconds - 1, samples)
+        times = opens[:, None] + offsets[None, :]
+        times = np.minimum(times, now)  # الشمعة الجارية تتوقف عند الآن
+        path = self._synthetic_price(symbol, times)
+        digits = self.spec(symbol)[1]
+
+        bars = np.zeros(count, dtype=RATES_DTYPE)
+        bars['time'] = opens
+        bars['open'] = np.round(path[:, 0], digits)
+        bars['high'] = np.round(path.max(axis=1), digits)
+        bars['low'] = np.round(path.min(axis=1), digits)
+        bars['close'] = np.round(path[:, -1], digits)
+        bars['tick_volume'] = 10 + (_hash_unit(opens, self._symbol_seed(symbol)) * seconds).astype(np.uint64)
+        bars['spread'] = self._spread_points(symbol)
+        return bars
+
+    def _symbol_seed(self, symbol: str) -> int:
+        return zlib.crc32(symbol.encode()) ^ self.seed
+
+    def _synthetic_price(self, symbol: str, times) -> np.ndarray:
+        """مسار سعر حتمي لأي وقت: موجات بفترات مختلفة + ضوضاء بالثانية"""
+        base, _, _, _, daily_vol = self.spec(symbol)
+        seed = self._symbol_seed(symbol)
+        phases = [(seed >> shift & 0xFF) / 255 * 2 * math.pi for shift in (0, 8, 16, 24)]
+        t = np.asarray(times, dtype=np.float64)
+        log_move = (
+            2.0 * daily_vol * np.sin(2 * math.pi * t / (7 * 86400) + phases[0])
+            + daily_vol * np.sin(2 * math.pi * t / 86400 + phases[1])
+            + 0.4 * daily_vol * np.sin(2 * math.pi * t / 14400 + phases[2])
+            + 0.15 * daily_vol * np.sin(2 * math.pi * t / 900 + phases[3])
+            + 0.05 * daily_vol * (_hash_unit(np.floor(t).astype(np.int64), seed) - 0.5)
+        )
+        return base * np.exp(log_move)
+
+    def _spread_points(self, symbol: str) -> int:
+        return {5: 12, 3: 15, 2: 30, 1: 20}.get(self.spec(symbol)[1], 10)
+
+    def tick(self, symbol: str) -> Tick:
+        if symbol in self._recorded:
+            return self._recorded_tick(symbol)
+        now = math.floor(time.time() / OFFLINE_TICK_INTERVAL) * OFFLINE_TICK_INTERVAL
+        _, digits, _, _, _ = self.spec(symbol)
+        mid = float(self._synthetic_price(symbol, [now])[0])
+        half_spread = self._spread_points(symbol) * 10 ** -digits / 2
+        bid = round(mid - half_spread, digits)
+        ask = round(mid + half_spread, digits)
+        return Tick(int(now), bid, ask, bid, 1, int(now * 1000), 6, 1.0)
+
+    def _recorded_tick(self, symbol: str) -> Tick:
+        m1, ticks = self._recorded[symbol]
+        cursor = self._cursor(symbol)
+        offset = self._replay[symbol][1]
+        if ticks is not None:
+            index = max(0, np.searchsorted(ticks['time'], cursor, side='right') - 1)
+            row = ticks[index]
+            tick_time = float(row['time']) + offset
+            return Tick(int(tick_time), float(row['bid']), float(row['ask']), float(row['last']),
+                        int(row['volume']), int(tick_time * 1000), 6, float(row['volume']))
+        index = max(0, np.searchsorted(m1['time'], cursor, side='right') - 1)
+        row = m1[index]
+        digits = self.spec(symbol)[1]
+        half_spread = int(row['spread']) * 10 ** -digits / 2
+        close = float(row['close'])
+        tick_time = int(row['time']) + offset
+        return Tick(tick_time, round(close - half_spread, digits), round(close + half_spread, digits), close,
+                    1, tick_time * 1000, 6, 1.0)
+
+    def symbol_info(self, symbol: str) -> SymbolInfo:
+        base, digits, contract_size, volume_step, _ = self.spec(symbol)
+        tick = self.tick(symbol)
+        currency_base, currency_profit = (symbol[:3], symbol[3:6]) if len(symbol) == 6 else (symbol, 'USD')
+        return SymbolInfo(
+            name=symbol, description=f"{symbol} (offline)", path=f"Offline\\{symbol}",
+            visible=symbol in self._selected, select=symbol in self._selected,
+            point=10 ** -digits, digits=digits, spread=self._spread_points(symbol),
+            bid=tick.bid, ask=tick.ask, last=tick.last,
+            volume_min=volume_step, volume_max=100.0 if volume_step < 1 else 10000.0, volume_step=volume_step,
+            trade_contract_size=float(contract_size),
+            currency_base=currency_base, currency_profit=currency_profit, currency_margin=currency_base,
+        )
+
+
+def _hash_unit(values, seed: int) -> np.ndarray:
+    """قيمة شبه عشوائية حتمية في [0, 1) لكل عدد صحيح"""
+    x = (np.asarray(values, dtype=np.int64).astype(np.uint64) ^ np.uint64(seed & 0xFFFFFFFF))
+    x = (x * np.uint64(0x9E3779B97F4A7C15)) & np.uint64(0xFFFFFFFFFFFFFFFF)
+    x ^= x >> np.uint64(31)
+    x = (x * np.uint64(0xBF58476D1CE4E5B9)) & np.uint64(0xFFFFFFFFFFFFFFFF)
+    x ^= x >> np.uint64(29)
+    return (x >> np.uint64(11)).astype(np.float64) / float(1 << 53)
+
+
+def _aggregate(rates: np.ndarray, seconds: int) -> np.ndarray:
+    """تجميع شموع M1 إلى إطار أكبر"""
+    if len(rates) == 0:
+        return rates.copy()
+    buckets = rates['time'] // seconds * seconds
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    bars = np.zeros(len(starts), dtype=RATES_DTYPE)
+    bars['time'] = buckets[starts]
+    bars['open'] = rates['open'][starts]
+    bars['high'] = np.maximum.reduceat(rates['high'], starts)
+    bars['low'] = np.minimum.reduceat(rates['low'], starts)
+    bars['close'] = rates['close'][np.r_[starts[1:] - 1, len(rates) - 1]]
+    bars['tick_volume'] = np.add.reduceat(rates['tick_volume'], starts)
+    bars['spread'] = rates['spread'][starts]
+    bars['real_volume'] = np.add.reduceat(rates['real_volume'], starts)
+    return bars
+
+
+def _read_rates_csv(path: str) -> np.ndarray:
+    with open(path, newline='') as f:
+        rows = list(csv.DictReader(f))
+    rates = np.zeros(len(rows), dtype=RATES_DTYPE)
+    for i, row in enumerate(rows):
+        rates[i] = (int(float(row['time'])), float(row['open']), float(row['high']), float(row['low']),
+                    float(row['close']), int(float(row.get('tick_volume') or 0)), int(float(row.get('spread') or 0)),
+                    int(float(row.get('real_volume') or 0)))
+    return np.sort(rates, order='time')
+
+
+def _read_ticks_csv(path: str) -> np.ndarray:
+    dtype = np.dtype([('time', '<f8'), ('bid', '<f8'), ('ask', '<f8'), ('last', '<f8'), ('volume', '<f8')])
+    with open(path, newline='') as f:
+        rows = list(csv.DictReader(f))
+    ticks = np.zeros(len(rows), dtype=dtype)
+    for i, row in enumerate(rows):
+        bid, ask = float(row['bid']), float(row['ask'])
+        ticks[i] = (float(row['time']), bid, ask, float(row.get('last') or bid), float(row.get('volume') or 0))
+    return np.sort(ticks, order='time')
+
+
+_backend = OfflineBackend()
+
+
+# ===== التحكم في البديل (للاختبارات وقياس الأداء) =====
+def configure(latency: float = None, jitter: float = None, failure_rate: float = None, speed: float = None,
+              data_dir: str = None, seed: int = None):
+    """تغيير إعدادات البديل أثناء التشغيل (تغيير البيانات أو البذرة يعيد إنشاء الحالة)"""
+    global _backend
+    if data_dir is not None or seed is not None:
+        _backend = OfflineBackend(data_dir if data_dir is not None else _backend.data_dir,
+                                  seed if seed is not None else _backend.seed)
+    if latency is not None:
+        _backend.latency = latency
+    if jitter is not None:
+        _backend.jitter = jitter
+    if failure_rate is not None:
+        _backend.failure_rate = failure_rate
+    if speed is not None:
+        _backend.speed = speed
+
+
+def disconnect(seconds: float = float('inf')):
+    """محاكاة انقطاع المنصة لمدة محددة - تفشل initialize حتى انتهاء المدة"""
+    _backend.down_until = time.monotonic() + seconds
+    _backend.initialized = False
+
+
+def reconnect():
+    """إنهاء الانقطاع المحاكى (يلزم استدعاء initialize بعدها كما في المنصة)"""
+    _backend.down_until = 0.0
+
+
+def stats() -> Dict:
+    return {'calls': _backend.calls, 'failures': _backend.failures, 'initialized': _backend.initialized,
+            'recorded_symbols': sorted(_backend._recorded)}
+
+
+# ===== واجهة MetaTrader5 =====
+def initialize(*args, **kwargs) -> bool:
+    with _backend._lock:
+        _backend.calls += 1
+        if time.monotonic() < _backend.down_until:
+            _backend._fail(RES_E_INTERNAL_FAIL_INIT, 'Terminal: Authorization failed')
+            return False
+        _backend.initialized = True
+        _backend.error = (RES_S_OK, 'Success')
+        return True
+
+
+def shutdown():
+    _backend.initialized = False
+    return True
+
+
+def last_error():
+    return _backend.error
+
+
+def version():
+    return (500, 4000, '01 Jan 2025')
+
+
+def account_info() -> Optional[AccountInfo]:
+    if not _backend.enter():
+        return None
+    return AccountInfo(login=10000001, server='Offline-Demo', name='Offline', company='Offline Backend',
+                       currency='USD', balance=10000.0, equity=10000.0, margin=0.0, margin_free=10000.0, leverage=100)
+
+
+def symbols_total() -> int:
+    if not _backend.enter():
+        return 0
+    return len(_backend.symbols())
+
+
+def symbols_get(group: str = None):
+    if not _backend.enter():
+        return None
+    return tuple(_backend.symbol_info(symbol) for symbol in _backend.symbols())
+
+
+def symbol_select(symbol: str, enable: bool = True) -> bool:
+    if not _backend.enter() or not _backend.known(symbol):
+        return False
+    if enable:
+        _backend._selected.add(symbol)
+    else:
+        _backend._selected.discard(symbol)
+    return True
+
+
+def symbol_info(symbol: str) -> Optional[SymbolInfo]:
+    if not _backend.enter():
+        return None
+    if not _backend.known(symbol):
+        _backend.error = (RES_E_NOT_FOUND, 'Symbol not found')
+        return None
+    return _backend.symbol_info(symbol)
+
+
+def symbol_info_tick(symbol: str) -> Optional[Tick]:
+    if not _backend.enter():
+        return None
+    if not _backend.known(symbol):
+        _backend.error = (RES_E_NOT_FOUND, 'Symbol not found')
+        return None
+    return _backend.tick(symbol)
+
+
+def copy_rates_from_pos(symbol: str, timeframe: int, start_pos: int, count: int) -> Optional[np.ndarray]:
+    if not _backend.enter():
+        return None
+    if not _backend.known(symbol):
+        _backend.error = (RES_E_NOT_FOUND, 'Symbol not found')
+        return None
+    rates = _backend.rates(symbol, timeframe, int(start_pos), int(count))
+    if rates is None:
+        _backend.error = (RES_E_INVALID_PARAMS, 'Invalid params')
+    return rates
@@ -35,16 +35,28 @@ apihelper.CONNECT_TIMEOUT = 60
 apihelper.READ_TIMEOUT = 60
 import pandas as pd
 import numpy as np
-import MetaTrader5 as mt5
+from numpy.lib.stride_tricks import sliding_window_view
+# خلفية MT5: المنصة الحقيقية أو البديل المحلي للاختبار وقياس الأداء (TBOT_MT5_BACKEND=offline)
+if os.environ.get('TBOT_MT5_BACKEND', '').lower() == 'offline':
+    import mt5_offline as mt5
+else:
+    import MetaTrader5 as mt5
 import google.generativeai as genai
 from datetime import datetime, timedelta
 from telebot import types
 from logging.handlers import RotatingFileHandler
 from dataclasses import dataclass
 from typing import Dict, List, Optional, Any, Tuple
+from collections import namedtuple, deque, defaultdict, OrderedDict
+from functools import lru_cache
+import math
+import bisect
+import random
+import itertools
+import queue
 import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait as wait_futures, TimeoutError as FuturesTimeoutError
 import time
-import ta
 from PIL import Image, ImageDraw, ImageFont
 import warnings
 
@@ -113,46 +125,189 @@ except ImportError:
 from dataclasses import dataclass
 
 # كاش البيانات لتقليل الاستدعاءات المتكررة
-price_data_cache = {}
 CACHE_DURATION = 15  # ثوان - مدة صلاحية الكاش
+PRICE_CACHE_MAX_SIZE = 1000  # أقصى عدد رموز في الكاش
+PRICE_CACHE_MAX_STALE = 120  # ثوان بعد انتهاء الصلاحية يمكن خلالها إرجاع القيمة القديمة مع تحديث في الخلفية
+PRICE_CACHE_REFRESH_WORKERS = 2  # خيوط ثابتة لتحديثات الخلفية بدلاً من خيط لكل رمز
 
-@dataclass
+@dataclass(frozen=True)
 class CachedPriceData:
     data: dict
-    timestamp: datetime
+    timestamp: float  # time.monotonic() وقت الحفظ
+
+class PriceCache:
+    """كاش أسعار LRU آمن للخيوط: صلاحية بساعة monotonic، حجم محدود، وتحديث الخلفية على خيوط ثابتة"""
+    
+    def __init__(self, ttl: float = CACHE_DURATION, max_size: int = PRICE_CACHE_MAX_SIZE,
+                 max_stale: float = PRICE_CACHE_MAX_STALE, refresh_workers: int = PRICE_CACHE_REFRESH_WORKERS):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.max_stale = max_stale
+        # العناصر غير قابلة للتعديل - الكتابة وتحديث ترتيب الاستخدام تحت القفل
+        self._entries = OrderedDict()  # {symbol: CachedPriceData} بترتيب آخر استخدام
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._refresh_executor = ThreadPoolExecutor(max_workers=refresh_workers, thread_name_prefix="PriceRefresh")
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    def age(self, symbol: str) -> Optional[float]:
+        entry = self._entries.get(symbol)
+        return time.monotonic() - entry.timestamp if entry else None
+    
+    def is_valid(self, symbol: str) -> bool:
+        age = self.age(symbol)
+        return age is not None and age < self.ttl
+    
+    def _touch(self, symbol: str) -> Optional[CachedPriceData]:
+        """العنصر مع نقله لنهاية ترتيب الاستخدام (الأحدث استخداماً يخرج أخيراً)"""
+        with self._lock:
+            entry = self._entries.get(symbol)
+            if entry is not None:
+                self._entries.move_to_end(symbol)
+            return entry
+    
+    def get(self, symbol: str) -> Optional[dict]:
+        """البيانات إذا كانت ضمن مدة الصلاحية فقط"""
+        entry = self._touch(symbol)
+        if entry is not None and time.monotonic() - entry.timestamp < self.ttl:
+            return entry.data
+        return None
+    
+    def get_or_revalidate(self, symbol: str, refresh) -> Optional[dict]:
+        """البيانات الصالحة، أو القديمة فوراً مع تحديث واحد في الخلفية عبر refresh(symbol)"""
+        entry = self._touch(symbol)
+        if entry is None:
+            return None
+        age = time.monotonic() - entry.timestamp
+        if age < self.ttl:
+            return entry.data
+        if age > self.ttl + self.max_stale:
+            return None
+        self._start_refresh(symbol, refresh)
+        return entry.data
+    
+    def set(self, symbol: str, data: dict):
+        self.set_many({symbol: data})
+    
+    def set_many(self, items: Dict[str, dict]):
+        """حفظ عدة رموز بنفس الطابع الزمني مع إخراج الأقدم استخداماً عند تجاوز الحجم"""
+        now = time.monotonic()
+        with self._lock:
+            for symbol, data in items.items():
+                self._entries[symbol] = CachedPriceData(data, now)
+                self._entries.move_to_end(symbol)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+    
+    def _start_refresh(self, symbol: str, refresh):
+        """تحديث واحد لكل رمز في طابور الخيوط الثابتة (الرموز الجارية تحديثها لا تضاف مرة أخرى)"""
+        with self._lock:
+            if symbol in self._refreshing:
+                return
+            self._refreshing.add(symbol)
+        try:
+            self._refresh_executor.submit(self._run_refresh, symbol, refresh)
+        except RuntimeError:
+            # المنفذ أغلق عند الإيقاف
+            with self._lock:
+                self._refreshing.discard(symbol)
     
+    def _run_refresh(self, symbol: str, refresh):
+        try:
+            data = refresh(symbol)
+            if data:
+                self.set(symbol, data)
+        except Exception as e:
+            logger.error(f"[ERROR] خطأ في تحديث الكاش في الخلفية لـ {symbol}: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(symbol)
+
+# إنشاء مثيل كاش الأسعار
+price_cache = PriceCache()
+
 def is_cache_valid(symbol: str) -> bool:
     """التحقق من صلاحية البيانات المخزنة مؤقتاً"""
-    if symbol not in price_data_cache:
-        return False
-    
-    cached_item = price_data_cache[symbol]
-    time_diff = datetime.now() - cached_item.timestamp
-    return time_diff.total_seconds() < CACHE_DURATION
+    return price_cache.is_valid(symbol)
 
 def get_cached_price_data(symbol: str) -> Optional[dict]:
     """جلب البيانات من الكاش إذا كانت صالحة"""
-    if is_cache_valid(symbol):
-        return price_data_cache[symbol].data
-    return None
+    return price_cache.get(symbol)
 
 def cache_price_data(symbol: str, data: dict):
     """حفظ البيانات في الكاش"""
-    price_data_cache[symbol] = CachedPriceData(data, datetime.now())
+    price_cache.set(symbol, data)
+
+def cache_price_data_bulk(items: Dict[str, dict]):
+    """حفظ بيانات عدة رموز في الكاش دفعة واحدة بنفس الطابع الزمني"""
+    price_cache.set_many(items)
 
-# معدل الاستدعاءات للحماية من الإفراط
-last_api_calls = {}
-MIN_CALL_INTERVAL = 5  # ثوان بين الاستدعاءات لنفس الرمز
+# دمج الطلبات المتزامنة لنفس الرمز بدلاً من رفضها
+SINGLE_FLIGHT_TIMEOUT = 30  # ثوان - أقصى انتظار لنتيجة جلب جارٍ
 
-def can_make_api_call(symbol: str) -> bool:
-    """التحقق من إمكانية استدعاء API لرمز معين"""
-    now = time.time()
-    last_call = last_api_calls.get(symbol, 0)
-    return (now - last_call) >= MIN_CALL_INTERVAL
+class _Flight:
+    """جلب جارٍ لمفتاح واحد ينتظره المنضمون"""
+    __slots__ = ('event', 'result')
+    
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+
+class SingleFlight:
+    """الطلبات المتزامنة لنفس المفتاح تنضم للجلب الجاري وتتشارك نتيجته (استدعاء واحد للمصدر)"""
+    
+    def __init__(self, wait_timeout: float = SINGLE_FLIGHT_TIMEOUT):
+        self.wait_timeout = wait_timeout
+        self.calls = 0  # عمليات جلب فعلية
+        self.coalesced = 0  # طلبات انضمت لجلب جارٍ
+        self._flights = {}  # {key: _Flight}
+        self._lock = threading.Lock()
+    
+    def do(self, key, fn):
+        """تنفيذ fn(key) مرة واحدة لجميع الطلبات المتزامنة على key"""
+        return self.do_many([key], lambda keys: {key: fn(key)}).get(key)
+    
+    def do_many(self, keys, fn) -> Dict:
+        """تنفيذ fn(keys) للمفاتيح غير الجارية والانضمام للجاري منها - يعيد {key: result} للنتائج المتوفرة"""
+        leaders, followers = {}, {}
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                flight = self._flights.get(key)
+                if flight is None:
+                    leaders[key] = self._flights[key] = _Flight()
+                else:
+                    followers[key] = flight
+            if leaders:
+                self.calls += 1
+            self.coalesced += len(followers)
+        
+        results = {}
+        if leaders:
+            try:
+                fetched = fn(list(leaders)) or {}
+                for key, flight in leaders.items():
+                    flight.result = fetched.get(key)
+            except Exception as e:
+                logger.error(f"[ERROR] خطأ في الجلب المشترك لـ {list(leaders)}: {e}")
+            finally:
+                with self._lock:
+                    for key in leaders:
+                        self._flights.pop(key, None)
+                for flight in leaders.values():
+                    flight.event.set()
+            results.update({key: flight.result for key, flight in leaders.items()})
+        
+        for key, flight in followers.items():
+            logger.debug(f"[SINGLE_FLIGHT] انضمام لجلب جارٍ لـ {key}")
+            if flight.event.wait(self.wait_timeout):
+                results[key] = flight.result
+        
+        return {key: result for key, result in results.items() if result is not None}
 
-def record_api_call(symbol: str):
-    """تسجيل وقت آخر استدعاء للـ API"""
-    last_api_calls[symbol] = time.time()
+# إنشاء مثيل دمج طلبات الأسعار
+price_fetch_flight = SingleFlight()
 
 # تهيئة البوت
 bot = telebot.TeleBot(BOT_TOKEN)
@@ -342,398 +497,2490 @@ NOTIFICATION_FREQUENCIES = {
     '15s': {'name': '15 ثانية 🔥', 'seconds': 15},  # التردد الوحيد المدعوم
 }
 
-# ===== كلاس إدارة MT5 =====
-class MT5Manager:
-    """مدير الاتصال مع MetaTrader5"""
+# ===== بث التيكات اللحظي (Push) =====
+TICK_STREAM_INTERVAL = 1.0  # ثوان بين دورات جمع التيكات
+TICK_BUFFER_SIZE = 512  # عدد التيكات المحفوظة لكل رمز
+TICK_STREAM_MAX_AGE = 5  # ثوان - إذا توقف الخيط أطول من ذلك نعود للجلب المباشر
+
+TICK_DTYPE = np.dtype([
+    ('time', 'f8'),
+    ('bid', 'f8'),
+    ('ask', 'f8'),
+    ('last', 'f8'),
+    ('volume', 'f8'),
+    ('time_msc', 'i8'),
+    ('received', 'f8'),
+])
+
+StreamedTick = namedtuple('StreamedTick', ['time', 'bid', 'ask', 'last', 'volume'])
+
+class TickRingBuffer:
+    """حلقة تيكات ثابتة الحجم لرمز واحد مدعومة بمصفوفة NumPy (كاتب واحد وقراء بدون أقفال)"""
     
-    def __init__(self):
-        self.connected = False
-        self.connection_lock = threading.Lock()  # حماية من race conditions
-        self.last_connection_attempt = 0
-        self.connection_retry_delay = 5  # 5 ثوان بين محاولات الاتصال
-        self.max_reconnection_attempts = 3
-        self.initialize_mt5()
+    def __init__(self, capacity: int = TICK_BUFFER_SIZE):
+        self.capacity = capacity
+        self._data = np.zeros(capacity, dtype=TICK_DTYPE)
+        self._count = 0  # إجمالي التيكات المكتوبة - يزداد فقط بعد اكتمال الكتابة
     
-    def initialize_mt5(self):
-        """تهيئة الاتصال مع MT5 مع آلية إعادة المحاولة"""
-        with self.connection_lock:
-            # منع محاولات الاتصال المتكررة
-            current_time = time.time()
-            if current_time - self.last_connection_attempt < self.connection_retry_delay:
-                logger.debug("[DEBUG] محاولة اتصال سابقة حديثة - انتظار...")
-                return self.connected
-            
-            self.last_connection_attempt = current_time
-            
-            try:
-                # إغلاق الاتصال السابق إذا كان موجوداً
-                try:
-                    mt5.shutdown()
-                except:
-                    pass
-                
-                # محاولة الاتصال
-                if not mt5.initialize():
-                    logger.error("[ERROR] فشل في تهيئة MT5")
-                    self.connected = False
-                    return False
-                
-                # التحقق من الاتصال
-                account_info = mt5.account_info()
-                if account_info is None:
-                    logger.error("[ERROR] فشل في الحصول على معلومات الحساب")
-                    mt5.shutdown()
-                    self.connected = False
-                    return False
-                
-                # اختبار جلب بيانات تجريبية للتأكد من الاتصال
-                test_tick = mt5.symbol_info_tick("EURUSD")
-                if test_tick is None:
-                    logger.warning("[WARNING] فشل في اختبار جلب البيانات")
-                    # لا نغلق الاتصال هنا لأن بعض الحسابات قد لا تدعم EURUSD
-                
-                self.connected = True
-                logger.info("[OK] تم الاتصال بـ MetaTrader5 بنجاح!")
-                logger.info(f"[DATA] معلومات الحساب: {account_info.login} - {account_info.server}")
-                
-                # طباعة رسالة النجاح في التيرمينال
-                print("\n" + "="*60)
-                print("🎉 تم الاتصال بـ MetaTrader5 بنجاح!")
-                print(f"📊 رقم الحساب: {account_info.login}")
-                print(f"🏦 الخادم: {account_info.server}")
-                print(f"💰 الرصيد: {account_info.balance}")
-                print(f"💎 العملة: {account_info.currency}")
-                print("="*60 + "\n")
-                
-                return True
-                
-            except Exception as e:
-                logger.error(f"[ERROR] خطأ في تهيئة MT5: {e}")
-                self.connected = False
-                try:
-                    mt5.shutdown()
-                except:
-                    pass
-                return False
+    def __len__(self) -> int:
+        return min(self._count, self.capacity)
     
-    def check_real_connection(self) -> bool:
-        """التحقق من حالة الاتصال الحقيقية مع MT5 مع آلية إعادة الاتصال"""
-        with self.connection_lock:
-            try:
-                # محاولة جلب معلومات الحساب
-                account_info = mt5.account_info()
-                if account_info is None:
-                    logger.warning("[WARNING] لا يمكن الحصول على معلومات الحساب - محاولة إعادة الاتصال...")
-                    self.connected = False
-                    return self._attempt_reconnection()
-                
-                # محاولة جلب معلومات رمز معروف (مع رموز بديلة)
-                test_symbols = ["EURUSD", "GBPUSD", "USDJPY", "GOLD", "XAUUSD"]
-                symbol_found = False
-                
-                for symbol in test_symbols:
-                    symbol_info = mt5.symbol_info(symbol)
-                    if symbol_info is not None:
-                        symbol_found = True
-                        break
-                
-                if not symbol_found:
-                    logger.warning("[WARNING] لا يمكن الحصول على معلومات أي رمز - الاتصال ضعيف")
-                    self.connected = False
-                    return self._attempt_reconnection()
-                
-                # محاولة جلب تيك حديث لأحد الرموز المتاحة
-                tick = None
-                for symbol in test_symbols:
-                    tick = mt5.symbol_info_tick(symbol)
-                    if tick is not None:
-                        break
-                
-                if tick is None:
-                    logger.warning("[WARNING] لا يمكن الحصول على البيانات اللحظية - الاتصال معطل")
-                    self.connected = False
-                    return self._attempt_reconnection()
-                
-                # التحقق من أن البيانات حديثة (مع مرونة أكبر لبعض الأسواق)
-                try:
-                    tick_time = datetime.fromtimestamp(tick.time)
-                    time_diff = datetime.now() - tick_time
-                    
-                    # 15 دقيقة بدلاً من 5 للمرونة أكثر
-                    if time_diff.total_seconds() > 900:
-                        logger.warning(f"[WARNING] البيانات قديمة جداً (عمر: {time_diff}) - الاتصال غير فعال")
-                        self.connected = False
-                        return self._attempt_reconnection()
-                except:
-                    # إذا فشل في قراءة وقت التيك، لا نعتبر هذا خطأ كريتيكال
-                    pass
-                
-                # كل شيء طبيعي
-                if not self.connected:
-                    logger.info("[OK] تم استعادة الاتصال مع MT5")
-                    self.connected = True
-                    
-                return True
-                
-            except Exception as e:
-                logger.error(f"[ERROR] خطأ في التحقق من الاتصال الحقيقي: {e}")
-                self.connected = False
-                return self._attempt_reconnection()
+    def append(self, tick, received: float):
+        """إضافة تيك جديد (يُستدعى من خيط الجمع فقط)"""
+        index = self._count % self.capacity
+        self._data[index] = (
+            tick.time, tick.bid, tick.ask, tick.last, tick.volume,
+            getattr(tick, 'time_msc', int(tick.time * 1000)), received
+        )
+        # نشر التيك للقراء بعد كتابته بالكامل
+        self._count += 1
+    
+    def touch(self, received: float):
+        """تحديث وقت استلام آخر تيك عند عدم تغيره (دلالة على أن البث حي)"""
+        if self._count:
+            self._data['received'][(self._count - 1) % self.capacity] = received
+    
+    def latest(self) -> Optional[np.void]:
+        """آخر تيك مكتوب أو None"""
+        count = self._count
+        if count == 0:
+            return None
+        return self._data[(count - 1) % self.capacity].copy()
+    
+    def snapshot(self, n: int = None) -> np.ndarray:
+        """نسخة مرتبة زمنياً من آخر n تيك"""
+        count = self._count
+        size = min(count, self.capacity)
+        n = size if n is None else min(n, size)
+        if n == 0:
+            return np.zeros(0, dtype=TICK_DTYPE)
+        indices = np.arange(count - n, count) % self.capacity
+        return self._data[indices].copy()
+
+class TickStreamCollector:
+    """خيط مخصص يجمع التيكات من MT5 للرموز المشتركة ويكتبها في حلقات لكل رمز"""
+    
+    def __init__(self, manager, interval: float = TICK_STREAM_INTERVAL, capacity: int = TICK_BUFFER_SIZE):
+        self.manager = manager
+        self.interval = interval
+        self.capacity = capacity
+        self.buffers = {}  # {symbol: TickRingBuffer}
+        self._symbols = ()
+        self._subscription_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+    
+    def subscribe(self, symbols):
+        """إضافة رموز إلى مجموعة البث"""
+        with self._subscription_lock:
+            for symbol in symbols:
+                if symbol not in self.buffers:
+                    self.buffers[symbol] = TickRingBuffer(self.capacity)
+            # استبدال المجموعة كاملة حتى يقرأها خيط الجمع بدون قفل
+            self._symbols = tuple(dict.fromkeys(self._symbols + tuple(symbols)))
+    
+    def start(self):
+        """بدء خيط جمع التيكات"""
+        if self.is_running():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="TickCollectorThread")
+        self._thread.start()
+        logger.info(f"[STREAM] بدء بث التيكات لـ {len(self._symbols)} رمز كل {self.interval} ثانية")
+    
+    def stop(self):
+        """إيقاف خيط جمع التيكات"""
+        self._stop_event.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=self.interval * 2)
+    
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+    
+    def symbols(self) -> Tuple[str, ...]:
+        return self._symbols
     
-    def _attempt_reconnection(self) -> bool:
-        """محاولة إعادة الاتصال التلقائية"""
-        logger.info("[RECONNECT] محاولة إعادة الاتصال التلقائية...")
+    def latest_tick(self, symbol: str, max_age: float = TICK_STREAM_MAX_AGE) -> Optional[StreamedTick]:
+        """آخر تيك للرمز من الذاكرة - بدون استدعاء MT5 أو انتظار قفل"""
+        buffer = self.buffers.get(symbol)
+        if buffer is None:
+            return None
         
-        for attempt in range(self.max_reconnection_attempts):
-            logger.info(f"[RECONNECT] محاولة رقم {attempt + 1} من {self.max_reconnection_attempts}")
-            
-            if self.initialize_mt5():
-                logger.info("[OK] تم إعادة الاتصال بنجاح!")
-                return True
-            
-            if attempt < self.max_reconnection_attempts - 1:
-                wait_time = (attempt + 1) * 2  # انتظار متزايد
-                logger.info(f"[RECONNECT] انتظار {wait_time} ثانية قبل المحاولة التالية...")
-                time.sleep(wait_time)
+        row = buffer.latest()
+        if row is None or time.time() - row['received'] > max_age:
+            return None
         
-        logger.error("[ERROR] فشل في إعادة الاتصال بعد عدة محاولات")
-        return False
+        return StreamedTick(float(row['time']), float(row['bid']), float(row['ask']),
+                            float(row['last']), float(row['volume']))
     
-    def validate_connection_health(self) -> bool:
-        """فحص شامل لصحة الاتصال مع MT5"""
-        try:
-            if not self.connected:
-                return False
-            
-            # اختبارات متعددة للتأكد من صحة الاتصال
-            tests = []
-            
-            # اختبار 1: معلومات الحساب
-            try:
-                account_info = mt5.account_info()
-                tests.append(account_info is not None)
-            except:
-                tests.append(False)
-            
-            # اختبار 2: عدد الرموز المتاحة
+    def _run(self):
+        """حلقة الجمع الرئيسية"""
+        while not self._stop_event.is_set():
+            started = time.time()
             try:
-                symbols_total = mt5.symbols_total()
-                tests.append(symbols_total > 0)
-            except:
-                tests.append(False)
+                if self.manager.connected:
+                    self._collect_once()
+            except Exception as e:
+                logger.error(f"[ERROR] خطأ في خيط بث التيكات: {e}")
             
-            # اختبار 3: جلب بيانات تجريبية
+            elapsed = time.time() - started
+            self._stop_event.wait(max(0.0, self.interval - elapsed))
+    
+    @staticmethod
+    def _read_ticks(symbols) -> Dict:
+        """قراءة تيكات الرموز - تعمل على خيط MT5"""
+        ticks = {}
+        for symbol in symbols:
             try:
-                test_symbols = ["EURUSD", "GBPUSD", "USDJPY"]
-                for test_symbol in test_symbols:
-                    tick = mt5.symbol_info_tick(test_symbol)
-                    if tick is not None:
-                        tests.append(True)
-                        break
-                else:
-                    tests.append(False)
-            except:
-                tests.append(False)
-            
-            # يجب أن تنجح معظم الاختبارات
-            success_rate = sum(tests) / len(tests)
-            health_ok = success_rate >= 0.6  # 60% نجاح كحد أدنى
-            
-            if not health_ok:
-                logger.warning(f"[WARNING] صحة اتصال MT5 ضعيفة - نسبة النجاح: {success_rate:.1%}")
-                self.connected = False
+                ticks[symbol] = mt5.symbol_info_tick(symbol)
+            except Exception as e:
+                logger.debug(f"[STREAM] فشل جلب تيك {symbol}: {e}")
+        return ticks
+    
+    def _collect_once(self):
+        """جلب تيكات جميع الرموز المشتركة في تمريرة واحدة"""
+        ticks = self.manager.io.call(self._read_ticks, self._symbols, priority=MT5_PRIORITY_STREAM)
+        
+        received = time.time()
+        for symbol, tick in ticks.items():
+            if tick is None or tick.bid <= 0 or tick.ask <= 0:
+                continue
             
-            return health_ok
+            buffer = self.buffers[symbol]
+            latest = buffer.latest()
+            tick_msc = getattr(tick, 'time_msc', int(tick.time * 1000))
+            if latest is not None and latest['time_msc'] == tick_msc and latest['bid'] == tick.bid and latest['ask'] == tick.ask:
+                buffer.touch(received)
+                continue
             
-        except Exception as e:
-            logger.error(f"[ERROR] خطأ في فحص صحة الاتصال: {e}")
-            self.connected = False
-            return False
+            buffer.append(tick, received)
+            self.manager.health.record_tick(tick.time, fresh=True)
+            self.manager.archive.record_tick(symbol, tick)
+
+# ===== مخزن الشموع التراكمي =====
+BAR_STORE_CAPACITY = 500  # عدد الشموع المحفوظة لكل رمز وإطار زمني
+BAR_STORE_MIN_REFRESH = 5  # ثوان - أقل فترة بين تحديثين لنفس الرمز والإطار
+
+RATES_DTYPE = np.dtype([
+    ('time', 'i8'),
+    ('open', 'f8'),
+    ('high', 'f8'),
+    ('low', 'f8'),
+    ('close', 'f8'),
+    ('tick_volume', 'u8'),
+    ('spread', 'i4'),
+    ('real_volume', 'u8'),
+])
+
+TIMEFRAME_SECONDS = {
+    mt5.TIMEFRAME_M1: 60,
+    mt5.TIMEFRAME_M5: 300,
+    mt5.TIMEFRAME_M15: 900,
+    mt5.TIMEFRAME_M30: 1800,
+    mt5.TIMEFRAME_H1: 3600,
+    mt5.TIMEFRAME_H4: 14400,
+    mt5.TIMEFRAME_D1: 86400,
+}
+
+def rates_to_array(rates) -> np.ndarray:
+    """تحويل نتيجة copy_rates من MT5 إلى مصفوفة بالنوع الموحد RATES_DTYPE"""
+    rates = np.asarray(rates)
+    array = np.zeros(len(rates), dtype=RATES_DTYPE)
+    for field in RATES_DTYPE.names:
+        array[field] = rates[field]
+    return array
+
+def rates_to_dataframe(rates: np.ndarray) -> pd.DataFrame:
+    """تحويل مصفوفة شموع إلى DataFrame بنفس شكل get_market_data"""
+    df = pd.DataFrame(rates)
+    df['time'] = pd.to_datetime(df['time'], unit='s')
+    df.set_index('time', inplace=True)
+    df.columns = ['open', 'high', 'low', 'close', 'tick_volume', 'spread', 'real_volume']
+    return df
+
+class BarSeries:
+    """سلسلة شموع لرمز وإطار زمني واحد في مصفوفة NumPy محجوزة مسبقاً"""
     
-    def graceful_shutdown(self):
-        """إغلاق آمن لاتصال MT5"""
-        try:
-            with self.connection_lock:
-                if self.connected:
-                    logger.info("[SYSTEM] إغلاق اتصال MT5...")
-                    mt5.shutdown()
-                    self.connected = False
-                    logger.info("[OK] تم إغلاق اتصال MT5 بأمان")
-        except Exception as e:
-            logger.error(f"[ERROR] خطأ في إغلاق MT5: {e}")
+    def __init__(self, capacity: int = BAR_STORE_CAPACITY):
+        self.capacity = capacity
+        # ضعف السعة حتى يكون الإزاحة عند الامتلاء نادرة (تكلفة ثابتة موزعة)
+        self._data = np.zeros(capacity * 2, dtype=RATES_DTYPE)
+        self._start = 0
+        self._end = 0
+        self.lock = threading.Lock()
+        self.last_sync = 0.0  # وقت آخر مزامنة مع MT5 (monotonic)
+        self.exhausted = False  # المنصة أعادت أقل من السعة - لا يوجد تاريخ أقدم لطلبه
     
-    def get_connection_status_detailed(self) -> Dict:
-        """الحصول على تفاصيل حالة الاتصال"""
+    def __len__(self) -> int:
+        return self._end - self._start
+    
+    @property
+    def last_time(self) -> Optional[int]:
+        """وقت فتح آخر شمعة محفوظة (الشمعة الجارية)"""
+        if self._end == self._start:
+            return None
+        return int(self._data['time'][self._end - 1])
+    
+    def view(self, count: int = None) -> np.ndarray:
+        """آخر count شمعة بدون نسخ"""
+        start = self._start if count is None else max(self._start, self._end - count)
+        return self._data[start:self._end]
+    
+    def replace(self, rates: np.ndarray):
+        """استبدال السلسلة كاملة (تحميل أولي أو بعد فجوة)"""
+        self.exhausted = len(rates) < self.capacity
+        rates = rates[-self.capacity:]
+        self._data[:len(rates)] = rates
+        self._start = 0
+        self._end = len(rates)
+    
+    def merge(self, rates: np.ndarray) -> int:
+        """دمج شموع جديدة: تحديث الشمعة الجارية في مكانها وإضافة الأحدث فقط"""
+        last_time = self.last_time
+        appended = 0
+        for row in rates:
+            row_time = int(row['time'])
+            if last_time is not None and row_time < last_time:
+                continue
+            if last_time is not None and row_time == last_time:
+                self._data[self._end - 1] = row
+                continue
+            if self._end == len(self._data):
+                self._compact()
+            self._data[self._end] = row
+            self._end += 1
+            last_time = row_time
+            appended += 1
+        
+        if len(self) > self.capacity:
+            self._start = self._end - self.capacity
+        return appended
+    
+    def _compact(self):
+        """نقل آخر capacity شمعة إلى بداية المصفوفة"""
+        keep = self._data[self._end - self.capacity:self._end].copy()
+        self._data[:self.capacity] = keep
+        self._start = 0
+        self._end = self.capacity
+
+class BarStore:
+    """مخزن شموع لكل (رمز، إطار زمني) يجلب فقط الشموع الأحدث من آخر شمعة محفوظة"""
+    
+    def __init__(self, manager, capacity: int = BAR_STORE_CAPACITY, min_refresh: float = BAR_STORE_MIN_REFRESH,
+                 capacities: Dict[int, int] = None):
+        self.manager = manager
+        self.capacity = capacity
+        self.capacities = capacities or {}  # سعة خاصة لبعض الأطر الزمنية {timeframe: capacity}
+        self.min_refresh = min_refresh
+        self._series = {}  # {(symbol, timeframe): BarSeries}
+        self._series_lock = threading.Lock()
+    
+    def _get_series(self, symbol: str, timeframe: int) -> BarSeries:
+        key = (symbol, timeframe)
+        series = self._series.get(key)
+        if series is None:
+            with self._series_lock:
+                capacity = self.capacities.get(timeframe, self.capacity)
+                series = self._series.setdefault(key, BarSeries(capacity))
+        return series
+    
+    def get_bars(self, symbol: str, timeframe: int, count: int = 100) -> Optional[np.ndarray]:
+        """آخر count شمعة (نسخة) بعد مزامنة تراكمية مع MT5"""
+        series = self._get_series(symbol, timeframe)
+        with series.lock:
+            self._sync(series, symbol, timeframe, count)
+            if len(series) == 0:
+                return None
+            return series.view(count).copy()
+    
+    def get_frame(self, symbol: str, timeframe: int, count: int = 100) -> Optional[pd.DataFrame]:
+        """آخر count شمعة كـ DataFrame بنفس شكل get_market_data"""
+        bars = self.get_bars(symbol, timeframe, count)
+        if bars is None or len(bars) == 0:
+            return None
+        return rates_to_dataframe(bars)
+    
+    def last_bar_time(self, symbol: str, timeframe: int) -> Optional[int]:
+        """وقت آخر شمعة محفوظة بدون أي مزامنة"""
+        series = self._series.get((symbol, timeframe))
+        return series.last_time if series else None
+    
+    def _sync(self, series: BarSeries, symbol: str, timeframe: int, count: int):
+        """مزامنة السلسلة: تحميل كامل أول مرة ثم جلب الشموع الجديدة فقط"""
+        if not self.manager.connected:
+            return
+        
+        now = time.monotonic()
+        # تاريخ المنصة الأقصر من المطلوب لا يعاد تحميله كاملاً - الشموع الأحدث فقط
+        filled = series.exhausted or len(series) >= min(count, series.capacity)
+        if filled and now - series.last_sync < self.min_refresh:
+            return
+        
         try:
-            real_status = self.check_real_connection()
-            
-            status_info = {
-                'connected': real_status,
-                'status_text': '🟢 متصل ونشط' if real_status else '🔴 منقطع أو معطل',
-                'last_check': datetime.now().strftime('%H:%M:%S'),
-                'account_info': None,
-                'data_freshness': None
-            }
+            if not filled:
+                # تحميل أولي (أو توسيع السلسلة)
+                rates = self.manager.io.call(mt5.copy_rates_from_pos, symbol, timeframe, 0, series.capacity)
+                if rates is None or len(rates) == 0:
+                    logger.warning(f"[WARNING] لا توجد بيانات للرمز {symbol}")
+                    return
+                series.replace(rates_to_array(rates))
+                series.last_sync = now
+                self._record(symbol, timeframe, series.view())
+                logger.debug(f"[BARS] تحميل أولي {len(series)} شمعة لـ {symbol}/{timeframe}")
+                return
             
-            if real_status:
-                try:
-                    account_info = mt5.account_info()
-                    if account_info:
-                        status_info['account_info'] = {
-                            'login': account_info.login,
-                            'server': account_info.server,
-                            'balance': account_info.balance,
-                            'currency': account_info.currency
-                        }
-                    
-                    # فحص حداثة البيانات
-                    tick = mt5.symbol_info_tick("EURUSD")
-                    if tick:
-                        tick_time = datetime.fromtimestamp(tick.time)
-                        age_seconds = (datetime.now() - tick_time).total_seconds()
-                        status_info['data_freshness'] = f"{age_seconds:.0f} ثانية"
-                        
-                except Exception as e:
-                    logger.error(f"خطأ في جلب تفاصيل الحالة: {e}")
+            # عدد الشموع المحتمل إغلاقها منذ آخر مزامنة + الشمعة الجارية
+            bar_seconds = TIMEFRAME_SECONDS.get(timeframe, 60)
+            missing = int((now - series.last_sync) // bar_seconds) + 2
+            rates = self.manager.io.call(mt5.copy_rates_from_pos, symbol, timeframe, 0, min(missing, series.capacity))
+            if rates is None or len(rates) == 0:
+                return
             
-            return status_info
+            rates = rates_to_array(rates)
+            if int(rates['time'][0]) > series.last_time:
+                # فجوة (مثلاً بعد انقطاع طويل) - إعادة تحميل كاملة
+                rates = self.manager.io.call(mt5.copy_rates_from_pos, symbol, timeframe, 0, series.capacity)
+                if rates is None or len(rates) == 0:
+                    return
+                series.replace(rates_to_array(rates))
+                self._record(symbol, timeframe, series.view())
+            else:
+                appended = series.merge(rates)
+                if appended:
+                    logger.debug(f"[BARS] {appended} شمعة جديدة لـ {symbol}/{timeframe}")
+                    self._record(symbol, timeframe, rates)
+            series.last_sync = now
             
         except Exception as e:
-            logger.error(f"[ERROR] خطأ في جلب حالة الاتصال التفصيلية: {e}")
-            return {
-                'connected': False,
-                'status_text': '❌ خطأ في الفحص',
-                'last_check': datetime.now().strftime('%H:%M:%S'),
-                'error': str(e)
-            }
+            logger.error(f"[ERROR] خطأ في مزامنة الشموع لـ {symbol}: {e}")
     
-    def get_live_price(self, symbol: str) -> Optional[Dict]:
-        """جلب السعر اللحظي الحقيقي - MT5 هو المصدر الأساسي الأولي مع نظام كاش"""
-        
-        if not symbol or symbol in ['notification', 'null', '', None]:
-            logger.warning(f"[WARNING] رمز غير صالح في get_live_price: {symbol}")
+    def _record(self, symbol: str, timeframe: int, rates: np.ndarray):
+        """تمرير شموع M1 للأرشيف (الشموع المغلقة فقط تحفظ)"""
+        if timeframe == mt5.TIMEFRAME_M1:
+            self.manager.archive.record_bars(symbol, rates)
+
+# ===== كاش الأطر الزمنية المشتقة من شموع M1 =====
+MTF_M1_CAPACITY = 1500  # أكثر من يوم كامل من شموع M1 لإعادة بناء شمعة D1 الجارية
+MTF_DERIVED_TIMEFRAMES = (
+    mt5.TIMEFRAME_M5,
+    mt5.TIMEFRAME_M15,
+    mt5.TIMEFRAME_M30,
+    mt5.TIMEFRAME_H1,
+    mt5.TIMEFRAME_H4,
+    mt5.TIMEFRAME_D1,
+)
+MTF_CONTEXT_TIMEFRAMES = {
+    mt5.TIMEFRAME_H1: 'H1',
+    mt5.TIMEFRAME_H4: 'H4',
+    mt5.TIMEFRAME_D1: 'D1',
+}
+
+def aggregate_bars(bars: np.ndarray, seconds: int) -> np.ndarray:
+    """تجميع شموع أصغر (مرتبة زمنياً) إلى شموع إطار أكبر مدته seconds ثانية"""
+    if len(bars) == 0:
+        return np.zeros(0, dtype=RATES_DTYPE)
+    
+    buckets = bars['time'] - bars['time'] % seconds
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(bars)] - 1
+    
+    result = np.zeros(len(starts), dtype=RATES_DTYPE)
+    result['time'] = buckets[starts]
+    result['open'] = bars['open'][starts]
+    result['high'] = np.maximum.reduceat(bars['high'], starts)
+    result['low'] = np.minimum.reduceat(bars['low'], starts)
+    result['close'] = bars['close'][ends]
+    result['tick_volume'] = np.add.reduceat(bars['tick_volume'], starts)
+    result['spread'] = bars['spread'][ends]
+    result['real_volume'] = np.add.reduceat(bars['real_volume'], starts)
+    return result
+
+class MultiTimeframeBarCache:
+    """شموع جميع الأطر الزمنية من تغذية M1 واحدة: تحميل أولي لكل إطار مرة واحدة ثم تجميع تراكمي من M1"""
+    
+    def __init__(self, manager, capacity: int = BAR_STORE_CAPACITY):
+        self.manager = manager
+        self.capacity = capacity
+        self._series = {}  # {(symbol, timeframe): BarSeries}
+        self._series_lock = threading.Lock()
+    
+    def supports(self, timeframe: int) -> bool:
+        return timeframe == mt5.TIMEFRAME_M1 or timeframe in MTF_DERIVED_TIMEFRAMES
+    
+    def _get_series(self, symbol: str, timeframe: int) -> BarSeries:
+        key = (symbol, timeframe)
+        series = self._series.get(key)
+        if series is None:
+            with self._series_lock:
+                series = self._series.setdefault(key, BarSeries(self.capacity))
+        return series
+    
+    def get_bars(self, symbol: str, timeframe: int, count: int = 100) -> Optional[np.ndarray]:
+        """آخر count شمعة (نسخة) لأي إطار مدعوم بدون استدعاءات إضافية للمنصة بعد التحميل الأولي"""
+        if timeframe == mt5.TIMEFRAME_M1:
+            return self.manager.bar_store.get_bars(symbol, mt5.TIMEFRAME_M1, count)
+        if timeframe not in MTF_DERIVED_TIMEFRAMES:
             return None
         
-        # التحقق من الكاش أولاً
-        cached_data = get_cached_price_data(symbol)
-        if cached_data:
-            logger.debug(f"[CACHE] استخدام بيانات مخزنة مؤقتاً لـ {symbol}")
-            return cached_data
-        
-        # التحقق من معدل الاستدعاءات
-        if not can_make_api_call(symbol):
-            logger.debug(f"[RATE_LIMIT] تجاهل الاستدعاء لـ {symbol} - تحديد معدل الاستدعاءات")
+        m1 = self.manager.bar_store.get_bars(symbol, mt5.TIMEFRAME_M1, MTF_M1_CAPACITY)
+        series = self._get_series(symbol, timeframe)
+        with series.lock:
+            self._update(series, symbol, timeframe, m1)
+            if len(series) == 0:
+                return None
+            return series.view(count).copy()
+    
+    def get_frame(self, symbol: str, timeframe: int, count: int = 100) -> Optional[pd.DataFrame]:
+        """آخر count شمعة كـ DataFrame بنفس شكل get_market_data"""
+        bars = self.get_bars(symbol, timeframe, count)
+        if bars is None or len(bars) == 0:
             return None
+        return rates_to_dataframe(bars)
+    
+    def _update(self, series: BarSeries, symbol: str, timeframe: int, m1: Optional[np.ndarray]):
+        """إعادة بناء الشمعة الجارية (وما بعدها) من شموع M1 التي تغطيها"""
+        covered = m1 is not None and len(m1) > 0
+        if len(series) == 0 or (covered and int(m1['time'][0]) > series.last_time):
+            # لا توجد سلسلة أو شموع M1 لا تغطي الشمعة الجارية (بداية أو انقطاع طويل) - تحميل من المنصة
+            self._seed(series, symbol, timeframe)
+        
+        if not covered or len(series) == 0 or int(m1['time'][0]) > series.last_time:
+            return
         
-        # تسجيل وقت الاستدعاء
-        record_api_call(symbol)
-        
-        # 🔍 التحقق من حالة الاتصال الحقيقية أولاً (بدون thread lock لتجنب deadlock)
-        real_connection_status = self.connected
-        
-        # إذا كان الاتصال منقطعاً، نحاول التحقق والإعادة
-        if not real_connection_status:
-            real_connection_status = self.check_real_connection()
-        
-        # ✅ المصدر الأساسي الأولي: MetaTrader5
-        if real_connection_status:
-            try:
-                # جلب آخر تيك للرمز من MT5 (البيانات الأكثر دقة)
-                with self.connection_lock:
-                    tick = mt5.symbol_info_tick(symbol)
-                
-                if tick is not None and hasattr(tick, 'bid') and hasattr(tick, 'ask') and tick.bid > 0 and tick.ask > 0:
-                    # التحقق من أن البيانات حديثة (ليست قديمة)
-                    tick_time = datetime.fromtimestamp(tick.time)
-                    time_diff = datetime.now() - tick_time
-                    
-                    # زيادة مرونة وقت البيانات إلى 15 دقيقة
-                    if time_diff.total_seconds() > 900:
-                        logger.warning(f"[WARNING] بيانات MT5 قديمة للرمز {symbol} (عمر البيانات: {time_diff})")
-                        # لا نغير حالة الاتصال فوراً، قد تكون مشكلة مؤقتة في الرمز
-                    else:
-                        logger.debug(f"[OK] تم جلب البيانات الحديثة من MT5 للرمز {symbol}")
-                        data = {
-                            'symbol': symbol,
-                            'bid': tick.bid,
-                            'ask': tick.ask,
-                            'last': tick.last,
-                            'volume': tick.volume,
-                            'time': tick_time,
-                            'spread': tick.ask - tick.bid,
-                            'source': 'MetaTrader5 (مصدر أساسي)',
-                            'data_age': time_diff.total_seconds()
-                        }
-                        # حفظ في الكاش
-                        cache_price_data(symbol, data)
-                        return data
-                else:
-                    logger.warning(f"[WARNING] لا توجد بيانات صحيحة من MT5 لـ {symbol}")
-                    # لا نغير حالة الاتصال فوراً، قد يكون الرمز غير متاح فقط
-                    
-            except Exception as e:
-                logger.warning(f"[WARNING] فشل جلب البيانات من MT5 لـ {symbol}: {e}")
-                # تحديد ما إذا كان هذا خطأ اتصال أم خطأ في الرمز
-                if "connection" in str(e).lower() or "terminal" in str(e).lower():
-                    self.connected = False
-        else:
-            logger.debug(f"[DEBUG] MT5 غير متصل حقيقياً - سيتم استخدام مصدر بديل لـ {symbol}")
-        
-        # 🔄 مصدر بديل فقط: Yahoo Finance (للرموز غير المتوفرة في MT5)
+        tail = m1[m1['time'] >= series.last_time]
+        appended = series.merge(aggregate_bars(tail, TIMEFRAME_SECONDS[timeframe]))
+        if appended:
+            logger.debug(f"[BARS] {appended} شمعة مشتقة جديدة لـ {symbol}/{timeframe}")
+    
+    def _seed(self, series: BarSeries, symbol: str, timeframe: int):
+        """تحميل أولي لتاريخ الإطار الأكبر من MT5 (مرة واحدة لكل رمز وإطار)"""
+        if not self.manager.connected:
+            return
         try:
-            import yfinance as yf
-            
-            # تحويل رموز MT5 إلى رموز Yahoo Finance
-            yahoo_symbol = self._convert_to_yahoo_symbol(symbol)
-            if yahoo_symbol:
-                logger.info(f"[RUNNING] محاولة جلب البيانات من Yahoo Finance لـ {symbol}")
-                ticker = yf.Ticker(yahoo_symbol)
-                data = ticker.history(period="1d", interval="1m")
-                
-                if not data.empty:
-                    latest = data.iloc[-1]
-                    current_time = datetime.now()
-                    
-                    logger.debug(f"[OK] تم جلب البيانات من Yahoo Finance للرمز {symbol}")
-                    data = {
-                        'symbol': symbol,
-                        'bid': latest['Close'] * 0.9995,  # تقدير سعر الشراء
-                        'ask': latest['Close'] * 1.0005,  # تقدير سعر البيع
-                        'last': latest['Close'],
-                        'volume': latest['Volume'],
-                        'time': current_time,
-                        'spread': latest['Close'] * 0.001,
-                        'source': 'Yahoo Finance (مصدر بديل)'
-                    }
-                    # حفظ في الكاش
-                    cache_price_data(symbol, data)
-                    return data
-                    
+            rates = self.manager.io.call(mt5.copy_rates_from_pos, symbol, timeframe, 0, self.capacity)
+            if rates is None or len(rates) == 0:
+                logger.warning(f"[WARNING] لا توجد بيانات للرمز {symbol}")
+                return
+            series.replace(rates_to_array(rates))
+            logger.debug(f"[BARS] تحميل أولي {len(series)} شمعة لـ {symbol}/{timeframe}")
         except Exception as e:
-            logger.error(f"[ERROR] خطأ في جلب البيانات من Yahoo Finance لـ {symbol}: {e}")
-        
-        logger.error(f"[ERROR] فشل في جلب البيانات من جميع المصادر للرمز {symbol}")
-        return None
+            logger.error(f"[ERROR] خطأ في التحميل الأولي للشموع لـ {symbol}: {e}")
+
+# ===== أرشيف التيكات والشموع (ملفات عمودية لكل رمز ويوم) =====
+MARKET_ARCHIVE_ENABLED = os.environ.get('TBOT_MARKET_ARCHIVE', '0') == '1'  # التسجيل اختياري
+MARKET_ARCHIVE_DIR = os.path.join(DATA_DIR, "market_archive")
+MARKET_ARCHIVE_FLUSH_ROWS = 512  # صفوف في الذاكرة قبل الكتابة المجمعة
+MARKET_ARCHIVE_FLUSH_INTERVAL = 10  # ثوان - أقصى تأخير للكتابة
+
+# أعمدة بنوع ثابت: الأوقات والأسعار فروق عن الصف السابق (الأسعار بوحدة نقطة الرمز)
+ARCHIVE_TICK_COLUMNS = {
+    'time': np.dtype('<i4'),  # فرق time_msc بالمللي ثانية
+    'bid': np.dtype('<i4'),  # فرق bid بالنقاط
+    'spread': np.dtype('<i4'),  # ask - bid بالنقاط
+    'last': np.dtype('<i4'),  # فرق last بالنقاط
+    'volume': np.dtype('<f4'),
+}
+ARCHIVE_BAR_COLUMNS = {
+    'time': np.dtype('<i4'),  # فرق وقت الفتح بالثواني
+    'close': np.dtype('<i4'),  # فرق الإغلاق بالنقاط
+    'open': np.dtype('<i4'),  # open - close بالنقاط
+    'high': np.dtype('<i4'),  # high - close
+    'low': np.dtype('<i4'),  # low - close
+    'tick_volume': np.dtype('<u4'),
+    'spread': np.dtype('<i4'),
+    'real_volume': np.dtype('<u4'),
+}
+ARCHIVE_TICK_DTYPE = np.dtype([
+    ('time_msc', 'i8'),
+    ('bid', 'f8'),
+    ('ask', 'f8'),
+    ('last', 'f8'),
+    ('volume', 'f8'),
+])
+
+class _ArchiveDay:
+    """ملفات يوم واحد لرمز ونوع (ticks أو bars_m1): عمود لكل ملف + meta.json بالأساس والعدد"""
     
-    def _convert_to_yahoo_symbol(self, mt5_symbol: str) -> Optional[str]:
-        """تحويل رموز MT5 إلى رموز Yahoo Finance"""
-        conversion_map = {
-            # العملات الرقمية
-            'BTCUSD': 'BTC-USD',
-            'ETHUSD': 'ETH-USD',
-            'LTCUSD': 'LTC-USD',
-            'BCHUSD': 'BCH-USD',
-            
-            # أزواج العملات (Forex)
-            'EURUSD': 'EURUSD=X',
-            'GBPUSD': 'GBPUSD=X',
-            'USDJPY': 'USDJPY=X',
-            'AUDUSD': 'AUDUSD=X',
-            'USDCAD': 'USDCAD=X',
-            'USDCHF': 'USDCHF=X',
-            'NZDUSD': 'NZDUSD=X',
-            'EURJPY': 'EURJPY=X',
-            'EURGBP': 'EURGBP=X',
+    def __init__(self, path: str, kind: str, columns: Dict[str, np.dtype], point: float):
+        self.path = path
+        self.kind = kind
+        self.columns = columns
+        self.meta_path = os.path.join(path, f"{kind}.meta.json")
+        self.pending = []  # صفوف مرمزة بانتظار الكتابة
+        os.makedirs(path, exist_ok=True)
+        
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                self.meta = json.load(f)
+            self._truncate_to_count()
+        else:
+            self.meta = {'point': point, 'count': 0, 'base': None, 'last': None}
+    
+    def column_path(self, column: str) -> str:
+        return os.path.join(self.path, f"{self.kind}.{column}.bin")
+    
+    def _truncate_to_count(self):
+        """حذف صفوف كتبت بدون تحديث meta (إغلاق مفاجئ أثناء الكتابة)"""
+        for column, dtype in self.columns.items():
+            path = self.column_path(column)
+            size = self.meta['count'] * dtype.itemsize
+            if os.path.exists(path) and os.path.getsize(path) > size:
+                os.truncate(path, size)
+    
+    def flush(self):
+        """كتابة الصفوف المعلقة دفعة واحدة لكل عمود ثم تحديث meta"""
+        if not self.pending:
+            return
+        rows = self.pending
+        self.pending = []
+        for index, (column, dtype) in enumerate(self.columns.items()):
+            values = np.fromiter((row[index] for row in rows), dtype=dtype, count=len(rows))
+            with open(self.column_path(column), 'ab') as f:
+                values.tofile(f)
+        self.meta['count'] += len(rows)
+        temp_path = self.meta_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f)
+        os.replace(temp_path, self.meta_path)
+
+class MarketArchive:
+    """مسجل اختياري للتيكات وشموع M1 المغلقة مع قراءة عبر np.memmap بدون تحميل الملفات في الذاكرة"""
+    
+    TICKS = 'ticks'
+    BARS = 'bars_m1'
+    
+    def __init__(self, root: str = MARKET_ARCHIVE_DIR, enabled: bool = MARKET_ARCHIVE_ENABLED,
+                 point_of=None, flush_rows: int = MARKET_ARCHIVE_FLUSH_ROWS,
+                 flush_interval: float = MARKET_ARCHIVE_FLUSH_INTERVAL):
+        self.root = root
+        self.enabled = enabled
+        self.point_of = point_of or (lambda symbol: 0.00001)
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self._days = {}  # {(symbol, kind): _ArchiveDay} - اليوم الحالي فقط لكل رمز ونوع
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self.recorded_ticks = 0
+        self.recorded_bars = 0
+    
+    @staticmethod
+    def _day_of(timestamp: float) -> str:
+        return time.strftime('%Y-%m-%d', time.gmtime(timestamp))
+    
+    def _open_day(self, symbol: str, kind: str, day: str) -> _ArchiveDay:
+        """ملفات اليوم للرمز - تغيير اليوم يكتب ملفات اليوم السابق ويغلقها"""
+        current = self._days.get((symbol, kind))
+        path = os.path.join(self.root, symbol, day)
+        if current is not None and current.path == path:
+            return current
+        if current is not None:
+            current.flush()
+        columns = ARCHIVE_TICK_COLUMNS if kind == self.TICKS else ARCHIVE_BAR_COLUMNS
+        current = _ArchiveDay(path, kind, columns, self.point_of(symbol))
+        self._days[(symbol, kind)] = current
+        return current
+    
+    def record_tick(self, symbol: str, tick):
+        """إضافة تيك (كائن symbol_info_tick) - التيكات المكررة أو الأقدم تتجاهل"""
+        if not self.enabled or tick is None:
+            return
+        time_msc = int(getattr(tick, 'time_msc', 0) or tick.time * 1000)
+        with self._lock:
+            archive_day = self._open_day(symbol, self.TICKS, self._day_of(time_msc / 1000))
+            point = archive_day.meta['point']
+            current = [time_msc, round(tick.bid / point), round((tick.ask - tick.bid) / point),
+                       round(tick.last / point), float(tick.volume)]
+            last = archive_day.meta['last']
+            if last is not None and time_msc <= last[0]:
+                return
+            if archive_day.meta['base'] is None:
+                archive_day.meta['base'] = current
+                last = current
+            archive_day.pending.append((time_msc - last[0], current[1] - last[1], current[2],
+                                        current[3] - last[3], current[4]))
+            archive_day.meta['last'] = current
+            self.recorded_ticks += 1
+            self._maybe_flush(archive_day)
+    
+    def record_bars(self, symbol: str, rates: np.ndarray):
+        """إضافة شموع M1 المغلقة فقط (الشمعة الأخيرة جارية وتتجاهل)"""
+        if not self.enabled or rates is None or len(rates) < 2:
+            return
+        with self._lock:
+            for row in rates[:-1]:
+                bar_time = int(row['time'])
+                archive_day = self._open_day(symbol, self.BARS, self._day_of(bar_time))
+                point = archive_day.meta['point']
+                last = archive_day.meta['last']
+                if last is not None and bar_time <= last[0]:
+                    continue
+                close = round(float(row['close']) / point)
+                current = [bar_time, close]
+                if archive_day.meta['base'] is None:
+                    archive_day.meta['base'] = current
+                    last = current
+                archive_day.pending.append((
+                    bar_time - last[0], close - last[1],
+                    round(float(row['open']) / point) - close,
+                    round(float(row['high']) / point) - close,
+                    round(float(row['low']) / point) - close,
+                    int(row['tick_volume']), int(row['spread']), int(row['real_volume'])
+                ))
+                archive_day.meta['last'] = current
+                self.recorded_bars += 1
+                self._maybe_flush(archive_day)
+    
+    def _maybe_flush(self, archive_day: _ArchiveDay):
+        if len(archive_day.pending) >= self.flush_rows:
+            archive_day.flush()
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self._flush_all()
+    
+    def _flush_all(self):
+        for archive_day in self._days.values():
+            try:
+                archive_day.flush()
+            except Exception as e:
+                logger.error(f"[ERROR] فشل كتابة الأرشيف في {archive_day.path}: {e}")
+        self._last_flush = time.monotonic()
+    
+    def flush(self):
+        """كتابة جميع الصفوف المعلقة (عند الإيقاف أو قبل القراءة)"""
+        with self._lock:
+            self._flush_all()
+    
+    # ----- القراءة -----
+    def days(self, symbol: str, kind: str = TICKS) -> List[str]:
+        """الأيام المتوفرة للرمز مرتبة"""
+        symbol_dir = os.path.join(self.root, symbol)
+        if not os.path.isdir(symbol_dir):
+            return []
+        return sorted(day for day in os.listdir(symbol_dir)
+                      if os.path.exists(os.path.join(symbol_dir, day, f"{kind}.meta.json")))
+    
+    def read(self, symbol: str, day: str, kind: str = TICKS) -> np.ndarray:
+        """فك ترميز يوم واحد من ملفات memmap (الصفوف المكتوبة فقط)"""
+        path = os.path.join(self.root, symbol, day)
+        meta_path = os.path.join(path, f"{kind}.meta.json")
+        if not os.path.exists(meta_path):
+            return np.zeros(0, dtype=ARCHIVE_TICK_DTYPE if kind == self.TICKS else RATES_DTYPE)
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        
+        count = meta['count']
+        columns = ARCHIVE_TICK_COLUMNS if kind == self.TICKS else ARCHIVE_BAR_COLUMNS
+        raw = {}
+        for column, dtype in columns.items():
+            column_path = os.path.join(path, f"{kind}.{column}.bin")
+            raw[column] = (np.memmap(column_path, dtype=dtype, mode='r', shape=(count,))
+                           if count else np.zeros(0, dtype=dtype))
+        
+        point = meta['point']
+        digits = max(0, -int(math.floor(math.log10(point) + 1e-9)))
+        base = meta['base'] or [0, 0, 0, 0, 0]
+        if kind == self.TICKS:
+            result = np.zeros(count, dtype=ARCHIVE_TICK_DTYPE)
+            result['time_msc'] = base[0] + np.cumsum(raw['time'], dtype=np.int64)
+            bid = base[1] + np.cumsum(raw['bid'], dtype=np.int64)
+            result['bid'] = np.round(bid * point, digits)
+            result['ask'] = np.round((bid + raw['spread']) * point, digits)
+            result['last'] = np.round((base[3] + np.cumsum(raw['last'], dtype=np.int64)) * point, digits)
+            result['volume'] = raw['volume']
+            return result
+        
+        result = np.zeros(count, dtype=RATES_DTYPE)
+        result['time'] = base[0] + np.cumsum(raw['time'], dtype=np.int64)
+        close = base[1] + np.cumsum(raw['close'], dtype=np.int64)
+        result['close'] = np.round(close * point, digits)
+        result['open'] = np.round((close + raw['open']) * point, digits)
+        result['high'] = np.round((close + raw['high']) * point, digits)
+        result['low'] = np.round((close + raw['low']) * point, digits)
+        result['tick_volume'] = raw['tick_volume']
+        result['spread'] = raw['spread']
+        result['real_volume'] = raw['real_volume']
+        return result
+    
+    def iter_days(self, symbol: str, kind: str = TICKS, start: str = None, end: str = None):
+        """مسح فترة طويلة يوماً بيوم (ذاكرة بحجم يوم واحد) - التواريخ بصيغة YYYY-MM-DD شاملة"""
+        for day in self.days(symbol, kind):
+            if (start and day < start) or (end and day > end):
+                continue
+            yield day, self.read(symbol, day, kind)
+
+# ===== محرك المؤشرات المتدرج (O(1) لكل شمعة) =====
+class _RollingWindow:
+    """نافذة متدرجة لآخر window-1 قيمة مثبتة مع مجموع ومجموع مربعات (متوسط وانحراف معياري)"""
+    
+    RESYNC_EVERY = 1000  # إعادة حساب المجاميع دورياً لمنع تراكم أخطاء الفاصلة العائمة
+    
+    def __init__(self, window: int):
+        self.window = window
+        self.values = deque()
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.nan_count = 0
+        self.ref = None  # قيمة مرجعية تطرح من كل عنصر لتقليل فقدان الدقة في التباين
+        self.pushes = 0
+    
+    def _sums_with(self, x: float):
+        if self.ref is None and x == x:
+            self.ref = x
+        if len(self.values) < self.window - 1 or self.nan_count or x != x:
+            return None
+        dx = x - self.ref
+        return self.total + dx, self.total_sq + dx * dx
+    
+    def mean(self, x: float) -> float:
+        sums = self._sums_with(x)
+        if sums is None:
+            return float('nan')
+        return self.ref + sums[0] / self.window
+    
+    def std(self, x: float) -> float:
+        """الانحراف المعياري للمجتمع (ddof=0) مثل مكتبة ta"""
+        sums = self._sums_with(x)
+        if sums is None:
+            return float('nan')
+        mean_dx = sums[0] / self.window
+        return math.sqrt(max(sums[1] / self.window - mean_dx * mean_dx, 0.0))
+    
+    def push(self, x: float):
+        if self.ref is None and x == x:
+            self.ref = x
+        self.values.append(x)
+        self._add(x, 1)
+        if len(self.values) > self.window - 1:
+            self._add(self.values.popleft(), -1)
+        
+        self.pushes += 1
+        if self.pushes % self.RESYNC_EVERY == 0:
+            self.total = self.total_sq = 0.0
+            self.nan_count = 0
+            for value in self.values:
+                self._add(value, 1)
+    
+    def _add(self, x: float, sign: int):
+        if x != x:
+            self.nan_count += sign
+            return
+        dx = x - self.ref
+        self.total += sign * dx
+        self.total_sq += sign * dx * dx
+
+class _RollingExtreme:
+    """أعلى/أدنى قيمة لنافذة متدرجة باستخدام deque أحادي الاتجاه"""
+    
+    def __init__(self, window: int, is_max: bool):
+        self.window = window
+        self.is_max = is_max
+        self.items = deque()  # (index, value) مرتبة أحادياً
+        self.index = 0
+    
+    def value(self, x: float) -> float:
+        if self.index < self.window - 1:
+            return float('nan')
+        if not self.items:
+            return x
+        front = self.items[0][1]
+        return max(front, x) if self.is_max else min(front, x)
+    
+    def push(self, x: float):
+        while self.items and (self.items[-1][1] <= x if self.is_max else self.items[-1][1] >= x):
+            self.items.pop()
+        self.items.append((self.index, x))
+        self.index += 1
+        while self.items[0][0] < self.index - (self.window - 1):
+            self.items.popleft()
+
+class _Ema:
+    """متوسط أسي بنفس معادلة pandas ewm(adjust=False)"""
+    
+    def __init__(self, alpha: float, min_periods: int):
+        self.alpha = alpha
+        self.min_periods = min_periods
+        self.current = None
+        self.count = 0
+    
+    def _next(self, x: float) -> float:
+        if self.current is None:
+            return x
+        return (1 - self.alpha) * self.current + self.alpha * x
+    
+    def value(self, x: float) -> float:
+        if self.count + 1 < self.min_periods:
+            return float('nan')
+        return self._next(x)
+    
+    def push(self, x: float):
+        self.current = self._next(x)
+        self.count += 1
+
+class StreamingIndicatorState:
+    """حالة جميع المؤشرات لرمز وإطار زمني واحد - كل شمعة جديدة أو تيك بتكلفة ثابتة"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+    
+    def reset(self):
+        """تصفير جميع المؤشرات (بدون استبدال القفل)"""
+        self.sma = {window: _RollingWindow(window) for window in (10, 20, 50)}
+        self.rsi_up = _Ema(1 / 14, 14)
+        self.rsi_down = _Ema(1 / 14, 14)
+        self.ema_fast = _Ema(2 / (12 + 1), 12)
+        self.ema_slow = _Ema(2 / (26 + 1), 26)
+        self.macd_signal = _Ema(2 / (9 + 1), 9)
+        self.stoch_low = _RollingExtreme(14, is_max=False)
+        self.stoch_high = _RollingExtreme(14, is_max=True)
+        self.stoch_k = _RollingWindow(3)
+        self.avg_volume = _RollingWindow(20)
+        self.resistance = _RollingExtreme(20, is_max=True)
+        self.support = _RollingExtreme(20, is_max=False)
+        self.prev_close = None
+        self.last_time = None  # وقت آخر شمعة مغلقة تم تثبيتها
+        self.bars = 0
+    
+    def update(self, bar, closed: bool) -> Dict:
+        """حساب القيم مع هذه الشمعة، وتثبيتها في الحالة إذا كانت مغلقة"""
+        close = float(bar['close'])
+        high = float(bar['high'])
+        low = float(bar['low'])
+        volume = float(bar['tick_volume'])
+        nan = float('nan')
+        
+        values = {
+            'close': close,
+            'prev_close': self.prev_close,
+            'volume': volume,
+            'bars': self.bars + 1,
+        }
+        
+        # المتوسطات المتحركة البسيطة
+        for window, sma in self.sma.items():
+            values[f'ma_{window}'] = sma.mean(close)
+        
+        # RSI بتنعيم Wilder (أول فرق يعتبر صفراً كما في ta)
+        diff = 0.0 if self.prev_close is None else close - self.prev_close
+        up, down = max(diff, 0.0), max(-diff, 0.0)
+        ema_up = self.rsi_up.value(up)
+        ema_down = self.rsi_down.value(down)
+        if ema_down != ema_down:
+            values['rsi'] = nan
+        elif ema_down == 0:
+            values['rsi'] = 100.0
+        else:
+            values['rsi'] = 100 - 100 / (1 + ema_up / ema_down)
+        
+        # MACD
+        fast = self.ema_fast.value(close)
+        slow = self.ema_slow.value(close)
+        macd = fast - slow
+        signal = self.macd_signal.value(macd) if macd == macd else nan
+        values['macd'] = macd
+        values['macd_signal'] = signal
+        values['macd_histogram'] = macd - signal
+        
+        # Stochastic
+        lowest = self.stoch_low.value(low)
+        highest = self.stoch_high.value(high)
+        if highest != highest or lowest != lowest or highest == lowest:
+            stoch_k = nan
+        else:
+            stoch_k = 100 * (close - lowest) / (highest - lowest)
+        values['stoch_k'] = stoch_k
+        values['stoch_d'] = self.stoch_k.mean(stoch_k)
+        
+        # Bollinger (20، انحرافان معياريان)
+        middle = self.sma[20].mean(close)
+        deviation = self.sma[20].std(close)
+        values['bb_middle'] = middle
+        values['bb_upper'] = middle + 2 * deviation
+        values['bb_lower'] = middle - 2 * deviation
+        
+        # الحجم والدعم والمقاومة
+        values['avg_volume'] = self.avg_volume.mean(volume)
+        values['resistance'] = self.resistance.value(high)
+        values['support'] = self.support.value(low)
+        
+        if closed:
+            for sma in self.sma.values():
+                sma.push(close)
+            self.rsi_up.push(up)
+            self.rsi_down.push(down)
+            self.ema_fast.push(close)
+            self.ema_slow.push(close)
+            if macd == macd:
+                self.macd_signal.push(macd)
+            self.stoch_low.push(low)
+            self.stoch_high.push(high)
+            self.stoch_k.push(stoch_k)
+            self.avg_volume.push(volume)
+            self.resistance.push(high)
+            self.support.push(low)
+            self.prev_close = close
+            self.last_time = int(bar['time'])
+            self.bars += 1
+        
+        return values
+    
+    def peek(self, bar) -> Dict:
+        """القيم مع الشمعة الجارية فوق الحالة المثبتة بدون تعديلها - O(1) لكل تيك"""
+        with self.lock:
+            return self.update(bar, closed=False)
+
+class StreamingIndicatorEngine:
+    """محرك مؤشرات متدرج يحتفظ بحالة لكل (رمز، إطار زمني) ويستهلك الشموع الجديدة فقط"""
+    
+    def __init__(self):
+        self._states = {}  # {(symbol, timeframe): StreamingIndicatorState}
+        self._states_lock = threading.Lock()
+    
+    def reset(self, symbol: str, timeframe: int):
+        """حذف الحالة لإعادة بنائها من الشموع في الاستدعاء التالي"""
+        with self._states_lock:
+            self._states.pop((symbol, timeframe), None)
+    
+    def state(self, symbol: str, timeframe: int) -> StreamingIndicatorState:
+        """حالة الرمز والإطار (تنشأ فارغة عند أول طلب)"""
+        key = (symbol, timeframe)
+        with self._states_lock:
+            state = self._states.get(key)
+            if state is None:
+                state = self._states[key] = StreamingIndicatorState()
+            return state
+    
+    @staticmethod
+    def _commit_closed(state: StreamingIndicatorState, symbol: str, timeframe: int, bars: np.ndarray):
+        """تثبيت الشموع المغلقة الجديدة فقط (كل الصفوف عدا الأخير) - يستدعى تحت قفل الحالة"""
+        closed = bars[:-1]
+        forming = bars[-1]
+        
+        if state.last_time is not None:
+            new_closed = closed[closed['time'] > state.last_time]
+            gap = len(new_closed) > 0 and state.last_time not in closed['time']
+            if int(forming['time']) <= state.last_time or gap:
+                # فجوة أو تراجع في البيانات - إعادة بناء الحالة من جديد
+                logger.debug(f"[INDICATORS] إعادة بناء حالة المؤشرات لـ {symbol}/{timeframe}")
+                state.reset()
+                new_closed = closed
+        else:
+            new_closed = closed
+        
+        for bar in new_closed:
+            state.update(bar, closed=True)
+    
+    def has_state(self, symbol: str, timeframe: int) -> bool:
+        """هل توجد حالة متدرجة مبنية لهذا الرمز والإطار"""
+        with self._states_lock:
+            state = self._states.get((symbol, timeframe))
+        return state is not None and state.last_time is not None
+    
+    def update_from_bars(self, symbol: str, timeframe: int, bars: np.ndarray) -> Optional[Dict]:
+        """تثبيت الشموع المغلقة الجديدة ثم حساب القيم مع الشمعة الجارية (آخر صف)"""
+        if bars is None or len(bars) == 0:
+            return None
+        
+        state = self.state(symbol, timeframe)
+        with state.lock:
+            self._commit_closed(state, symbol, timeframe, bars)
+            return state.update(bars[-1], closed=False)
+
+# ===== حساب المؤشرات المتجه لعدة رموز =====
+@lru_cache(maxsize=16)
+def _ema_weight_matrix(alpha: float, length: int) -> np.ndarray:
+    """مصفوفة أوزان (length, length) بحيث X @ W تعطي سلسلة EMA (adjust=False) كاملة لكل صف"""
+    k = np.arange(length)[:, None]
+    t = np.arange(length)[None, :]
+    weights = np.where(k <= t, alpha * (1 - alpha) ** (t - k), 0.0)
+    weights[0, :] = (1 - alpha) ** t[0]
+    return weights
+
+def _ema_last(values: np.ndarray, alpha: float) -> np.ndarray:
+    """آخر قيمة EMA لكل صف كضرب مصفوفة بمتجه واحد"""
+    return values @ _ema_weight_matrix(alpha, values.shape[1])[:, -1]
+
+def compute_indicator_matrix(close: np.ndarray, high: np.ndarray, low: np.ndarray, volume: np.ndarray) -> Dict[str, np.ndarray]:
+    """حساب القيم الخام لجميع المؤشرات لمصفوفات (n_symbols, n_bars) في تمريرة واحدة على المحور 1"""
+    n_bars = close.shape[1]
+    values = {}
+    
+    # المتوسطات المتحركة
+    for window in (10, 20, 50):
+        values[f'ma_{window}'] = close[:, -window:].mean(axis=1)
+    
+    # RSI بتنعيم Wilder (أول فرق صفر كما في ta)
+    diff = np.diff(close, axis=1, prepend=close[:, :1])
+    ema_up = _ema_last(np.clip(diff, 0, None), 1 / 14)
+    ema_down = _ema_last(np.clip(-diff, 0, None), 1 / 14)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        values['rsi'] = np.where(ema_down == 0, 100.0, 100 - 100 / (1 + ema_up / ema_down))
+    
+    # MACD: سلسلتا EMA كاملتان ثم إشارة EMA على الجزء الصالح من MACD
+    macd_series = close @ _ema_weight_matrix(2 / 13, n_bars) - close @ _ema_weight_matrix(2 / 27, n_bars)
+    values['macd'] = macd_series[:, -1]
+    values['macd_signal'] = _ema_last(macd_series[:, 25:], 2 / 10)
+    values['macd_histogram'] = values['macd'] - values['macd_signal']
+    
+    # Stochastic: %K لآخر 3 شموع ثم %D كمتوسطها
+    lowest = sliding_window_view(low, 14, axis=1)[:, -3:, :].min(axis=2)
+    highest = sliding_window_view(high, 14, axis=1)[:, -3:, :].max(axis=2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        stoch_k = np.where(highest == lowest, np.nan, 100 * (close[:, -3:] - lowest) / (highest - lowest))
+    values['stoch_k'] = stoch_k[:, -1]
+    values['stoch_d'] = stoch_k.mean(axis=1)
+    
+    # Bollinger
+    last_20 = close[:, -20:]
+    values['bb_middle'] = last_20.mean(axis=1)
+    deviation = last_20.std(axis=1, ddof=0)
+    values['bb_upper'] = values['bb_middle'] + 2 * deviation
+    values['bb_lower'] = values['bb_middle'] - 2 * deviation
+    
+    # الحجم والدعم والمقاومة
+    values['avg_volume'] = volume[:, -20:].mean(axis=1)
+    values['resistance'] = high[:, -20:].max(axis=1)
+    values['support'] = low[:, -20:].min(axis=1)
+    
+    values['close'] = close[:, -1]
+    values['prev_close'] = close[:, -2]
+    values['volume'] = volume[:, -1]
+    return values
+
+# ===== كاش نتائج المؤشرات الفنية =====
+INDICATOR_CACHE_SIZE = 256  # أقصى عدد من نتائج المؤشرات المحفوظة
+
+class IndicatorCache:
+    """كاش LRU لحالة المؤشرات المثبتة بمفتاح (رمز، إطار زمني، وقت آخر شمعة مغلقة) - الشمعة الجارية تطبق فوقها في كل استدعاء"""
+    
+    def __init__(self, max_size: int = INDICATOR_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()  # {(symbol, timeframe, closed_bar_time): StreamingIndicatorState}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, symbol: str, timeframe: int, bar_time: int) -> Optional[Dict]:
+        """النتيجة المحفوظة لنفس الشمعة أو None"""
+        key = (symbol, timeframe, bar_time)
+        with self._lock:
+            technical_data = self._entries.get(key)
+            if technical_data is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return technical_data
+    
+    def put(self, symbol: str, timeframe: int, bar_time: int, technical_data: Dict):
+        """حفظ النتيجة وحذف نتائج الشموع الأقدم لنفس الرمز والإطار"""
+        with self._lock:
+            stale = [key for key in self._entries
+                     if key[0] == symbol and key[1] == timeframe and key[2] != bar_time]
+            for key in stale:
+                del self._entries[key]
+            self._entries[(symbol, timeframe, bar_time)] = technical_data
+            self._entries.move_to_end((symbol, timeframe, bar_time))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+    
+    def invalidate(self, symbol: str = None):
+        """مسح نتائج رمز معين أو الكاش بالكامل"""
+        with self._lock:
+            if symbol is None:
+                self._entries.clear()
+                return
+            for key in [key for key in self._entries if key[0] == symbol]:
+                del self._entries[key]
+    
+    def stats(self) -> Dict:
+        """إحصائيات الكاش (الإصابات والإخفاقات والحجم)"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits / total * 100) if total else 0.0,
+                'size': len(self._entries),
+                'max_size': self.max_size
+            }
+
+# ===== مصدر Yahoo Finance البديل =====
+YAHOO_BASE_URL = os.environ.get('TBOT_YAHOO_BASE_URL', 'https://query1.finance.yahoo.com')
+YAHOO_CACHE_TTL = 30  # ثوان - صلاحية إطار الدقيقة المحفوظ لكل رمز
+YAHOO_REFRESH_INTERVAL = 20  # ثوان بين دورات التحديث في الخلفية
+YAHOO_ACTIVE_WINDOW = 300  # ثوان - الرموز المطلوبة خلال هذه المدة تحدث في الخلفية
+YAHOO_REQUEST_TIMEOUT = 10  # ثوان - مهلة الطلب المجمع
+YAHOO_PROBE_SYMBOL = 'EURUSD=X'
+
+class YahooFallbackProvider:
+    """مصدر Yahoo Finance البديل: طلب واحد لعدة رموز مع كاش لإطارات الدقيقة وتحديث في الخلفية"""
+    
+    def __init__(self, symbol_converter, base_url: str = YAHOO_BASE_URL, ttl: float = YAHOO_CACHE_TTL,
+                 refresh_interval: float = YAHOO_REFRESH_INTERVAL, http=None):
+        self.symbol_converter = symbol_converter  # تحويل رمز MT5 إلى رمز Yahoo
+        self.base_url = base_url.rstrip('/')
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        self.http = http or session
+        self.requests_made = 0
+        self._frames = {}  # {yahoo_symbol: (fetched_at, DataFrame)}
+        self._requested = {}  # {yahoo_symbol: آخر وقت طلب}
+        self._lock = threading.Lock()
+        self._fetch_lock = threading.Lock()  # طلب HTTP واحد في نفس الوقت
+        self._stop_event = threading.Event()
+        self._thread = None
+    
+    def get_prices(self, symbols) -> Dict[str, Dict]:
+        """أسعار عدة رموز MT5 - الرموز غير المحفوظة تجلب في طلب مجمع واحد"""
+        mapping = {}
+        for symbol in dict.fromkeys(symbols):
+            yahoo_symbol = self.symbol_converter(symbol)
+            if yahoo_symbol:
+                mapping[symbol] = yahoo_symbol
+        if not mapping:
+            return {}
+        
+        now = time.monotonic()
+        with self._lock:
+            for yahoo_symbol in mapping.values():
+                self._requested[yahoo_symbol] = now
+        
+        self._refresh(list(dict.fromkeys(mapping.values())), self.ttl)
+        self._ensure_refresher()
+        
+        results = {}
+        for symbol, yahoo_symbol in mapping.items():
+            data = self._build_price_data(symbol, yahoo_symbol)
+            if data:
+                results[symbol] = data
+        return results
+    
+    def get_price(self, symbol: str) -> Optional[Dict]:
+        return self.get_prices([symbol]).get(symbol)
+    
+    def probe(self) -> bool:
+        """فحص خفيف لتوفر الخدمة (يستخدمه موجه المصادر)"""
+        return bool(self._fetch_spark([YAHOO_PROBE_SYMBOL]))
+    
+    def stop(self):
+        """إيقاف خيط التحديث في الخلفية"""
+        self._stop_event.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=YAHOO_REQUEST_TIMEOUT)
+    
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+    
+    def _age(self, yahoo_symbol: str, now: float) -> float:
+        entry = self._frames.get(yahoo_symbol)
+        return now - entry[0] if entry else float('inf')
+    
+    def _refresh(self, yahoo_symbols: List[str], max_age: float):
+        """جلب الرموز التي تجاوز عمرها max_age في طلب مجمع (ثم yfinance للمتبقي)"""
+        if not any(self._age(yahoo_symbol, time.monotonic()) >= max_age for yahoo_symbol in yahoo_symbols):
+            return
+        
+        with self._fetch_lock:
+            # إعادة الفحص بعد القفل - ربما جلبها خيط آخر
+            now = time.monotonic()
+            stale = [yahoo_symbol for yahoo_symbol in yahoo_symbols if self._age(yahoo_symbol, now) >= max_age]
+            if not stale:
+                return
+            
+            logger.info(f"[RUNNING] جلب {len(stale)} رمز من Yahoo Finance في طلب واحد")
+            frames = self._fetch_spark(stale)
+            remaining = [yahoo_symbol for yahoo_symbol in stale if yahoo_symbol not in frames]
+            if remaining:
+                frames.update(self._fetch_yfinance(remaining))
+            
+            fetched_at = time.monotonic()
+            with self._lock:
+                for yahoo_symbol, frame in frames.items():
+                    self._frames[yahoo_symbol] = (fetched_at, frame)
+    
+    def _fetch_spark(self, yahoo_symbols: List[str]) -> Dict[str, pd.DataFrame]:
+        """طلب HTTP واحد لإطارات الدقيقة لعدة رموز (نقطة spark)"""
+        try:
+            self.requests_made += 1
+            response = self.http.get(
+                f"{self.base_url}/v7/finance/spark",
+                params={'symbols': ','.join(yahoo_symbols), 'range': '1d', 'interval': '1m'},
+                headers={'User-Agent': 'Mozilla/5.0'},
+                timeout=YAHOO_REQUEST_TIMEOUT
+            )
+            response.raise_for_status()
+            payload = response.json()
+        except Exception as e:
+            logger.warning(f"[WARNING] فشل الطلب المجمع من Yahoo Finance ({len(yahoo_symbols)} رمز): {e}")
+            return {}
+        
+        frames = {}
+        for item in (payload.get('spark') or {}).get('result') or []:
+            try:
+                result = item['response'][0]
+                quote = result['indicators']['quote'][0]
+                closes = quote.get('close') or []
+                volumes = quote.get('volume') or [0] * len(closes)
+                frame = pd.DataFrame(
+                    {'Close': closes, 'Volume': volumes},
+                    index=pd.to_datetime(result.get('timestamp') or [], unit='s')
+                ).dropna(subset=['Close']).fillna(0)
+            except (KeyError, IndexError, TypeError, ValueError) as e:
+                logger.debug(f"[DEBUG] استجابة Yahoo غير صالحة للرمز {item.get('symbol')}: {e}")
+                continue
+            if not frame.empty:
+                frames[item['symbol']] = frame
+        return frames
+    
+    def _fetch_yfinance(self, yahoo_symbols: List[str]) -> Dict[str, pd.DataFrame]:
+        """مسار ثانوي عبر yfinance (استيراد كسول) بتحميل مجمع واحد"""
+        try:
+            import yfinance as yf
+        except ImportError:
+            return {}
+        
+        try:
+            data = yf.download(tickers=yahoo_symbols, period="1d", interval="1m", group_by='ticker',
+                               progress=False, threads=False, auto_adjust=False)
+        except Exception as e:
+            logger.warning(f"[WARNING] فشل التحميل المجمع من yfinance: {e}")
+            return {}
+        
+        frames = {}
+        if data is None or data.empty:
+            return frames
+        for yahoo_symbol in yahoo_symbols:
+            try:
+                frame = data[yahoo_symbol] if isinstance(data.columns, pd.MultiIndex) else data
+                frame = frame[['Close', 'Volume']].dropna(subset=['Close'])
+            except KeyError:
+                continue
+            if not frame.empty:
+                frames[yahoo_symbol] = frame
+        return frames
+    
+    def _build_price_data(self, symbol: str, yahoo_symbol: str) -> Optional[Dict]:
+        """تحويل آخر صف من إطار الدقيقة إلى قاموس بيانات السعر"""
+        entry = self._frames.get(yahoo_symbol)
+        if entry is None:
+            return None
+        fetched_at, frame = entry
+        latest = frame.iloc[-1]
+        close = float(latest['Close'])
+        
+        return {
+            'symbol': symbol,
+            'bid': close * 0.9995,  # تقدير سعر الشراء
+            'ask': close * 1.0005,  # تقدير سعر البيع
+            'last': close,
+            'volume': float(latest['Volume']),
+            'time': datetime.now(),
+            'spread': close * 0.001,
+            'source': 'Yahoo Finance (مصدر بديل)',
+            'data_age': time.monotonic() - fetched_at
+        }
+    
+    def _ensure_refresher(self):
+        """تشغيل خيط التحديث عند أول استخدام فقط (لا خيط أثناء عمل MT5 بشكل طبيعي)"""
+        if self.is_running() or self._stop_event.is_set():
+            return
+        with self._lock:
+            if self.is_running():
+                return
+            self._thread = threading.Thread(target=self._run, daemon=True, name="YahooRefreshThread")
+            self._thread.start()
+        logger.info("[RUNNING] بدء تحديث أسعار Yahoo Finance في الخلفية")
+    
+    def _run(self):
+        """تحديث الرموز المطلوبة مؤخراً - ينتهي الخيط عندما لا يطلب أي رمز"""
+        while not self._stop_event.wait(self.refresh_interval):
+            now = time.monotonic()
+            with self._lock:
+                for yahoo_symbol in [ys for ys, requested in self._requested.items() if now - requested > YAHOO_ACTIVE_WINDOW]:
+                    del self._requested[yahoo_symbol]
+                    self._frames.pop(yahoo_symbol, None)
+                active = list(self._requested)
+            
+            if not active:
+                logger.info("[OK] إيقاف تحديث Yahoo Finance - لا توجد رموز مطلوبة")
+                return
+            
+            try:
+                self._refresh(active, self.refresh_interval / 2)
+            except Exception as e:
+                logger.error(f"[ERROR] خطأ في تحديث Yahoo Finance في الخلفية: {e}")
+
+# ===== موجه مصادر الأسعار مع قواطع الدائرة =====
+ROUTER_WINDOW = 50  # عدد آخر الاستدعاءات المحفوظة لكل مصدر
+ROUTER_FAILURE_THRESHOLD = 3  # إخفاقات متتالية تفتح القاطع
+ROUTER_ERROR_RATE_THRESHOLD = 0.5  # نسبة أخطاء تفتح القاطع (مع عدد عينات كاف)
+ROUTER_MIN_SAMPLES = 10
+ROUTER_OPEN_COOLDOWN = 30  # ثوان قبل أول محاولة فحص لمصدر مقطوع
+ROUTER_PROBE_INTERVAL = 5  # ثوان بين دورات خيط الفحص
+ROUTER_LATENCY_TOLERANCE = 0.5  # ثوان - المصادر ضمن هذا الفارق ترتب حسب الجودة
+LAST_KNOWN_GOOD_MAX_AGE = 600  # ثوان - أقصى عمر لآخر سعر جيد معروف
+
+class PriceSource:
+    """مصدر أسعار مع زمن استجابة ونسبة أخطاء متدرجة وقاطع دائرة"""
+    
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+    
+    def __init__(self, name: str, fetch, probe=None, rank: int = 0):
+        self.name = name
+        self.fetch = fetch  # fetch(symbols) -> Dict أو None إذا لم يكن المصدر مناسباً للرموز (استثناء = فشل)
+        self.probe = probe  # probe() -> bool لفحص المصدر في الخلفية
+        self.rank = rank  # الأقل = جودة بيانات أعلى
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.consecutive_failures = 0
+        self._samples = deque(maxlen=ROUTER_WINDOW)  # (latency, ok)
+        self._lock = threading.Lock()
+    
+    @property
+    def avg_latency(self) -> float:
+        samples = self._samples
+        return sum(latency for latency, _ in samples) / len(samples) if samples else 0.0
+    
+    @property
+    def error_rate(self) -> float:
+        samples = self._samples
+        return sum(1 for _, ok in samples if not ok) / len(samples) if samples else 0.0
+    
+    def record(self, latency: float, ok: bool):
+        """تسجيل نتيجة استدعاء وفتح القاطع عند تكرار الفشل"""
+        with self._lock:
+            self._samples.append((latency, ok))
+            if ok:
+                self.consecutive_failures = 0
+                return
+            self.consecutive_failures += 1
+            if self.state == self.CLOSED and (
+                self.consecutive_failures >= ROUTER_FAILURE_THRESHOLD
+                or (len(self._samples) >= ROUTER_MIN_SAMPLES and self.error_rate >= ROUTER_ERROR_RATE_THRESHOLD)
+            ):
+                self._open()
+    
+    def _open(self):
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        logger.warning(f"[CIRCUIT] فتح قاطع المصدر {self.name} (أخطاء متتالية: {self.consecutive_failures}, نسبة الأخطاء: {self.error_rate:.0%})")
+    
+    def run_probe(self) -> bool:
+        """فحص نصف مفتوح: النجاح يغلق القاطع والفشل يعيد فتحه"""
+        with self._lock:
+            if self.state != self.OPEN or time.monotonic() - self.opened_at < ROUTER_OPEN_COOLDOWN:
+                return False
+            self.state = self.HALF_OPEN
+        
+        started = time.monotonic()
+        try:
+            ok = bool(self.probe()) if self.probe else True
+        except Exception as e:
+            logger.debug(f"[DEBUG] فشل فحص المصدر {self.name}: {e}")
+            ok = False
+        
+        with self._lock:
+            if ok:
+                self._samples.clear()
+                self._samples.append((time.monotonic() - started, True))
+                self.consecutive_failures = 0
+                self.state = self.CLOSED
+                logger.info(f"[CIRCUIT] إغلاق قاطع المصدر {self.name} - عاد للعمل")
+            else:
+                self._open()
+        return ok
+    
+    def stats(self) -> Dict:
+        return {
+            'state': self.state,
+            'avg_latency': self.avg_latency,
+            'error_rate': self.error_rate,
+            'consecutive_failures': self.consecutive_failures,
+            'samples': len(self._samples)
+        }
+
+class PriceSourceRouter:
+    """توجيه طلبات الأسعار لأسرع مصدر سليم مع آخر سعر جيد معروف كملاذ أخير"""
+    
+    def __init__(self, sources: List[PriceSource], last_known_good_max_age: float = LAST_KNOWN_GOOD_MAX_AGE):
+        self.sources = sources
+        self.last_known_good_max_age = last_known_good_max_age
+        self._last_known_good = {}  # {symbol: (stored_at, data)}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+    
+    def ordered_sources(self) -> List[PriceSource]:
+        """المصادر المغلقة القاطع مرتبة حسب زمن الاستجابة ثم الجودة"""
+        healthy = [source for source in self.sources if source.state == PriceSource.CLOSED]
+        return sorted(healthy, key=lambda source: (int(source.avg_latency / ROUTER_LATENCY_TOLERANCE), source.rank))
+    
+    def fetch(self, symbols: List[str]) -> Dict[str, Dict]:
+        """جلب الأسعار عبر المصادر بالترتيب حتى تكتمل الرموز"""
+        results = {}
+        remaining = list(dict.fromkeys(symbols))
+        
+        for source in self.ordered_sources():
+            if not remaining:
+                break
+            started = time.monotonic()
+            try:
+                data = source.fetch(remaining)
+            except Exception as e:
+                logger.warning(f"[WARNING] فشل المصدر {source.name} لـ {len(remaining)} رمز: {e}")
+                source.record(time.monotonic() - started, False)
+                continue
+            if data is None:
+                continue  # المصدر لا يدعم هذه الرموز
+            source.record(time.monotonic() - started, True)
+            results.update(data)
+            remaining = [symbol for symbol in remaining if symbol not in data]
+        
+        now = time.monotonic()
+        with self._lock:
+            for symbol, data in results.items():
+                self._last_known_good[symbol] = (now, data)
+            
+            # آخر سعر جيد معروف للرموز المتبقية (بنفس مصدره الأصلي)
+            for symbol in remaining:
+                entry = self._last_known_good.get(symbol)
+                if entry is None or now - entry[0] > self.last_known_good_max_age:
+                    continue
+                data = dict(entry[1])
+                data['data_age'] = data.get('data_age', 0) + (now - entry[0])
+                data['last_known_good'] = True
+                results[symbol] = data
+                logger.warning(f"[WARNING] استخدام آخر سعر جيد معروف لـ {symbol} (عمر: {now - entry[0]:.0f} ثانية)")
+        
+        if any(source.state != PriceSource.CLOSED for source in self.sources):
+            self._ensure_prober()
+        return results
+    
+    def stats(self) -> Dict[str, Dict]:
+        return {source.name: source.stats() for source in self.sources}
+    
+    def stop(self):
+        """إيقاف خيط الفحص في الخلفية"""
+        self._stop_event.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=ROUTER_PROBE_INTERVAL * 2)
+    
+    def _ensure_prober(self):
+        if self._stop_event.is_set() or (self._thread and self._thread.is_alive()):
+            return
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, daemon=True, name="PriceProbeThread")
+            self._thread.start()
+    
+    def _run(self):
+        """فحص المصادر المقطوعة في الخلفية - ينتهي الخيط عند سلامة جميع المصادر"""
+        while not self._stop_event.wait(ROUTER_PROBE_INTERVAL):
+            open_sources = [source for source in self.sources if source.state != PriceSource.CLOSED]
+            if not open_sources:
+                return
+            for source in open_sources:
+                try:
+                    source.run_probe()
+                except Exception as e:
+                    logger.error(f"[ERROR] خطأ في فحص المصدر {source.name}: {e}")
+
+# ===== خيط MT5 المخصص مع طابور طلبات بأولويات =====
+MT5_PRIORITY_INTERACTIVE = 0  # طلبات المستخدمين (خيوط TeleBot)
+MT5_PRIORITY_STREAM = 1  # خيط بث التيكات
+MT5_PRIORITY_MONITORING = 2  # دفعات حلقة المراقبة
+MT5_PRIORITY_MAINTENANCE = 3  # فحص الاتصال وإعادة التهيئة
+MT5_REQUEST_TIMEOUT = 10  # ثوان - المهلة الافتراضية لطلب MT5
+MT5_CONNECT_TIMEOUT = 90  # ثوان - مهلة تهيئة الاتصال (تشغيل المنصة قد يطول)
+
+_mt5_thread_priority = threading.local()
+
+def set_thread_mt5_priority(priority: int):
+    """تحديد أولوية طلبات MT5 الصادرة من الخيط الحالي"""
+    _mt5_thread_priority.value = priority
+
+def get_thread_mt5_priority() -> int:
+    return getattr(_mt5_thread_priority, 'value', MT5_PRIORITY_INTERACTIVE)
+
+class _MT5Request:
+    """طلب في طابور خيط MT5"""
+    __slots__ = ('fn', 'args', 'future', 'deadline')
+    
+    def __init__(self, fn, args, deadline: float):
+        self.fn = fn
+        self.args = args
+        self.future = Future()
+        self.deadline = deadline
+
+MT5_CONNECTION_ERROR_CODE = -10000  # أخطاء IPC والاتصال بالمنصة في MT5 رموزها -10000 وما دون
+
+def _mt5_job_succeeded(result) -> bool:
+    """نتيجة الطلب لمراقبة الصحة: False من الطلب نفسه أو خطأ اتصال في المنصة = فشل
+    
+    النتيجة الفارغة فشل فقط إذا أبلغت المنصة عن خطأ - رمز غير مدرج أو سوق بلا تيك ليس فشلاً في الاتصال
+    """
+    if result is False:
+        return False
+    try:
+        code = mt5.last_error()[0]
+    except Exception:
+        code = None
+    if code is not None and code <= MT5_CONNECTION_ERROR_CODE:
+        return False
+    if isinstance(result, dict):
+        empty = all(value is None for value in result.values())
+    else:
+        empty = result is None or (hasattr(result, "__len__") and len(result) == 0)
+    return not empty or code in (mt5.RES_S_OK, mt5.RES_E_NOT_FOUND)
+
+class MT5IOWorker:
+    """خيط واحد يملك اتصال المنصة وينفذ الطلبات من طابور أولويات - المستدعون ينتظرون Future بمهلة"""
+    
+    def __init__(self):
+        self._queue = queue.PriorityQueue()
+        self._sequence = itertools.count()  # ترتيب ثابت للطلبات بنفس الأولوية
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.observer = None  # observer(ok, latency) بعد كل طلب منفذ - ok حسب نتيجة المنصة وليس غياب الاستثناء
+        self.served = 0
+        self.expired = 0
+    
+    def submit(self, fn, *args, priority: int = None, timeout: float = MT5_REQUEST_TIMEOUT) -> Future:
+        """إضافة طلب للطابور وإرجاع Future"""
+        if priority is None:
+            priority = get_thread_mt5_priority()
+        request = _MT5Request(fn, args, time.monotonic() + timeout)
+        self._ensure_started()
+        self._queue.put((priority, next(self._sequence), request))
+        return request.future
+    
+    def call(self, fn, *args, priority: int = None, timeout: float = MT5_REQUEST_TIMEOUT):
+        """تنفيذ fn(*args) على خيط MT5 وانتظار النتيجة حتى المهلة"""
+        if threading.current_thread() is self._thread:
+            return fn(*args)  # استدعاء متداخل من داخل خيط MT5
+        
+        future = self.submit(fn, *args, priority=priority, timeout=timeout)
+        try:
+            return future.result(timeout=timeout)
+        except FuturesTimeoutError:
+            future.cancel()
+            raise TimeoutError(f"انتهت مهلة طلب MT5 ({getattr(fn, '__name__', fn)}) بعد {timeout} ثانية")
+    
+    def pending(self) -> int:
+        return self._queue.qsize()
+    
+    def stop(self):
+        """إيقاف الخيط بعد الطلبات الحالية"""
+        if self._thread and self._thread.is_alive():
+            self._queue.put((float('inf'), next(self._sequence), None))
+            self._thread.join(timeout=MT5_REQUEST_TIMEOUT)
+    
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True, name="MT5IOThread")
+                self._thread.start()
+    
+    def _run(self):
+        """حلقة تنفيذ الطلبات - الطلبات المنتهية مهلتها أو الملغاة لا تنفذ"""
+        while True:
+            _, _, request = self._queue.get()
+            if request is None:
+                return
+            
+            future = request.future
+            if not future.set_running_or_notify_cancel():
+                self.expired += 1
+                continue
+            if time.monotonic() > request.deadline:
+                self.expired += 1
+                future.set_exception(TimeoutError("انتهت مهلة طلب MT5 قبل تنفيذه"))
+                continue
+            
+            started = time.monotonic()
+            try:
+                result = request.fn(*request.args)
+                ok = _mt5_job_succeeded(result)
+                future.set_result(result)
+            except BaseException as e:
+                future.set_exception(e)
+                ok = False
+            self.served += 1
+            
+            if self.observer:
+                try:
+                    self.observer(ok, time.monotonic() - started)
+                except Exception:
+                    pass
+
+# ===== مراقبة صحة اتصال MT5 من الحركة الفعلية =====
+HEALTH_QUIET_AFTER = 30  # ثوان بدون تيك جديد قبل اللجوء لفحص صريح
+HEALTH_WINDOW = 50  # عدد آخر نتائج الاستدعاءات المحفوظة
+HEALTH_MIN_SAMPLES = 5
+HEALTH_ERROR_RATE_LIMIT = 0.5  # نسبة أخطاء تجعل الاتصال غير حي
+HEALTH_STALE_TICK_AGE = 900  # ثوان - تيك أقدم من ذلك يعني بيانات متوقفة
+HEALTH_SNAPSHOT_INTERVAL = 1.0  # ثوان - أقصى عمر للقطة المنشورة
+
+class MT5HealthMonitor:
+    """صحة الاتصال من وصول التيكات ونتائج الاستدعاءات الملاحظة أصلاً، مع لقطة محفوظة للواجهة"""
+    
+    def __init__(self):
+        self._outcomes = deque(maxlen=HEALTH_WINDOW)  # True/False لكل استدعاء
+        self.last_success = 0.0  # monotonic
+        self.last_failure = 0.0
+        self.last_tick_seen = 0.0  # monotonic - وقت وصول آخر تيك جديد
+        self.last_tick_time = None  # وقت آخر تيك من المنصة (epoch)
+        self.last_probe = 0.0
+        self.last_probe_ok = None
+        self.account = None
+        self._snapshot = None
+        self._snapshot_at = 0.0
+        self._lock = threading.Lock()
+    
+    def record_call(self, ok: bool, latency: float):
+        """نتيجة استدعاء على خيط MT5 (استثناء أو نتيجة فارغة أو خطأ منصة = فشل)"""
+        now = time.monotonic()
+        with self._lock:
+            self._outcomes.append(ok)
+            if ok:
+                self.last_success = now
+            else:
+                self.last_failure = now
+    
+    def record_tick(self, tick_time: float, fresh: bool = False):
+        """وصول تيك من المنصة - يحسب وصولاً جديداً فقط إذا تقدم وقته (أو أكد المستدعي أنه جديد)
+        
+        المنصة المتوقفة تعيد آخر تيك محفوظ لديها، فتكرار نفس التيك لا يعني أن الاتصال حي
+        """
+        if self.last_tick_time is None or tick_time > self.last_tick_time:
+            self.last_tick_time = tick_time
+            fresh = True
+        if fresh:
+            self.last_tick_seen = time.monotonic()
+    
+    def record_probe(self, ok: bool):
+        self.last_probe = time.monotonic()
+        self.last_probe_ok = ok
+        self._snapshot = None
+    
+    def record_account(self, account_info):
+        if account_info is None:
+            return
+        self.account = {
+            'login': account_info.login,
+            'server': account_info.server,
+            'balance': account_info.balance,
+            'currency': account_info.currency
+        }
+    
+    @property
+    def error_rate(self) -> float:
+        outcomes = self._outcomes
+        return sum(1 for ok in outcomes if not ok) / len(outcomes) if outcomes else 0.0
+    
+    def is_quiet(self) -> bool:
+        """لا تيكات جديدة مؤخراً - الحركة لا تكفي للحكم (نجاح الاستدعاءات وحده لا يثبت أن البيانات تصل)"""
+        return time.monotonic() - self.last_tick_seen > HEALTH_QUIET_AFTER
+    
+    def tick_age(self) -> Optional[float]:
+        return time.time() - self.last_tick_time if self.last_tick_time else None
+    
+    def is_live(self) -> bool:
+        """الاتصال حي بناءً على الحركة الملاحظة فقط (بدون أي استدعاء للمنصة)"""
+        if self.is_quiet():
+            return False
+        if len(self._outcomes) >= HEALTH_MIN_SAMPLES and self.error_rate >= HEALTH_ERROR_RATE_LIMIT:
+            return False
+        tick_age = self.tick_age()
+        return tick_age is None or tick_age <= HEALTH_STALE_TICK_AGE
+    
+    def snapshot(self) -> Dict:
+        """لقطة الصحة المنشورة (تحدث مرة كل ثانية على الأكثر)"""
+        now = time.monotonic()
+        snapshot = self._snapshot
+        if snapshot is not None and now - self._snapshot_at < HEALTH_SNAPSHOT_INTERVAL:
+            return snapshot
+        
+        snapshot = {
+            'live': self.is_live(),
+            'quiet': self.is_quiet(),
+            'error_rate': self.error_rate,
+            'samples': len(self._outcomes),
+            'last_success_age': now - self.last_success if self.last_success else None,
+            'tick_age': self.tick_age(),
+            'last_probe_ok': self.last_probe_ok,
+            'account': self.account
+        }
+        self._snapshot = snapshot
+        self._snapshot_at = now
+        return snapshot
+
+# ===== مشرف الاتصال مع MT5 (إعادة الاتصال في الخلفية) =====
+SUPERVISOR_CHECK_INTERVAL = 30  # ثوان بين فحوص الاتصال في الحالة الطبيعية
+SUPERVISOR_DEGRADED_RECHECK = 5  # ثوان - إعادة الفحص السريع في حالة التدهور
+SUPERVISOR_DEGRADED_LIMIT = 2  # فحوص فاشلة متتالية قبل بدء إعادة الاتصال
+SUPERVISOR_DOWN_AFTER = 3  # محاولات إعادة اتصال فاشلة قبل اعتبار الاتصال معطلاً
+SUPERVISOR_BACKOFF_BASE = 2  # ثوان - أول فترة انتظار بين المحاولات
+SUPERVISOR_BACKOFF_MAX = 120  # ثوان - أقصى فترة انتظار بين المحاولات
+
+class ConnectionSupervisor:
+    """آلة حالات الاتصال: فحص دوري وإعادة اتصال في خيط خلفي مع تراجع أسي عشوائي - المستدعون يقرؤون الحالة فوراً
+    
+    كل انتقال حالة (والمحاولات والتأخير) تحت قفل واحد لأن البلاغات تأتي من خيوط المستدعين أثناء عمل خيط المشرف
+    """
+    
+    CONNECTED = 'CONNECTED'
+    DEGRADED = 'DEGRADED'
+    RECONNECTING = 'RECONNECTING'
+    DOWN = 'DOWN'
+    
+    def __init__(self, manager, connected: bool):
+        self.manager = manager
+        self.state = self.CONNECTED if connected else self.RECONNECTING
+        self.since = time.time()
+        self.attempts = 0  # محاولات إعادة الاتصال الفاشلة المتتالية
+        self.failed_checks = 0  # فحوص فاشلة متتالية
+        self.last_error = None
+        self._next_delay = 0.0
+        self._lock = threading.RLock()
+        self._wake = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+    
+    def is_available(self) -> bool:
+        """هل يمكن إرسال طلبات للمنصة الآن (متصل أو متدهور)"""
+        return self.state in (self.CONNECTED, self.DEGRADED)
+    
+    def start(self):
+        """بدء خيط المشرف"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="MT5SupervisorThread")
+        self._thread.start()
+        logger.info(f"[RECONNECT] بدء مشرف اتصال MT5 - الحالة: {self.state}")
+    
+    def stop(self):
+        """إيقاف خيط المشرف"""
+        self._stop_event.set()
+        self._wake.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout=MT5_REQUEST_TIMEOUT)
+    
+    def report_failure(self, reason: str):
+        """إبلاغ عن خطأ اتصال من أي خيط - فحص فوري في الخلفية بدون انتظار"""
+        with self._lock:
+            self.last_error = reason
+            if self.state == self.CONNECTED:
+                self._set_state(self.DEGRADED)
+        self._wake.set()
+    
+    def request_reconnect(self, reason: str):
+        """طلب إعادة اتصال في الخلفية (لا يفعل شيئاً إذا كانت جارية)"""
+        with self._lock:
+            self.last_error = reason
+            if self.state in (self.CONNECTED, self.DEGRADED):
+                self._begin_reconnect()
+            elif self.state == self.DOWN:
+                self._next_delay = 0.0
+        self._wake.set()
+    
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                'state': self.state,
+                'since': datetime.fromtimestamp(self.since),
+                'attempts': self.attempts,
+                'last_error': self.last_error
+            }
+    
+    def _set_state(self, state: str):
+        with self._lock:
+            if state == self.state:
+                return
+            logger.info(f"[RECONNECT] حالة اتصال MT5: {self.state} -> {state}")
+            self.state = state
+            self.since = time.time()
+            self.manager.connected = state in (self.CONNECTED, self.DEGRADED)
+    
+    def _begin_reconnect(self):
+        with self._lock:
+            self.attempts = 0
+            self._next_delay = 0.0
+            self._set_state(self.RECONNECTING)
+    
+    def _backoff(self) -> float:
+        """تراجع أسي مع تشويش كامل"""
+        ceiling = min(SUPERVISOR_BACKOFF_MAX, SUPERVISOR_BACKOFF_BASE * (2 ** self.attempts))
+        return random.uniform(SUPERVISOR_BACKOFF_BASE, ceiling)
+    
+    def _run(self):
+        while not self._stop_event.is_set():
+            with self._lock:
+                if self.state == self.CONNECTED:
+                    wait = SUPERVISOR_CHECK_INTERVAL
+                elif self.state == self.DEGRADED:
+                    wait = SUPERVISOR_DEGRADED_RECHECK
+                else:
+                    wait = self._next_delay
+            
+            self._wake.wait(wait)
+            self._wake.clear()
+            if self._stop_event.is_set():
+                return
+            
+            try:
+                if self.is_available():
+                    self._check()
+                else:
+                    self._reconnect_once()
+            except Exception as e:
+                logger.error(f"[ERROR] خطأ في مشرف اتصال MT5: {e}")
+    
+    def _check(self):
+        """تقييم الاتصال من الحركة الملاحظة - فحص صريح على خيط MT5 عند الهدوء أو كثرة الأخطاء أو بعد بلاغ فشل"""
+        if self.state == self.CONNECTED and self.manager.health.is_live():
+            healthy = True
+        else:
+            try:
+                healthy = self.manager.io.call(self.manager._probe_connection_job, priority=MT5_PRIORITY_MAINTENANCE)
+            except Exception as e:
+                with self._lock:
+                    self.last_error = str(e)
+                healthy = False
+            self.manager.health.record_probe(healthy)
+        
+        with self._lock:
+            if not self.is_available():
+                return  # طلب مستدعٍ إعادة الاتصال أثناء الفحص - لا نعيد الحالة إلى متصل
+            
+            if healthy:
+                self.failed_checks = 0
+                self._set_state(self.CONNECTED)
+                return
+            
+            self.failed_checks += 1
+            if self.failed_checks >= SUPERVISOR_DEGRADED_LIMIT:
+                logger.warning("[WARNING] فشل فحص اتصال MT5 المتكرر - بدء إعادة الاتصال في الخلفية")
+                self.failed_checks = 0
+                self._begin_reconnect()
+            else:
+                self._set_state(self.DEGRADED)
+    
+    def _reconnect_once(self):
+        """محاولة إعادة اتصال واحدة ثم جدولة التالية بتراجع أسي"""
+        logger.info(f"[RECONNECT] محاولة إعادة الاتصال رقم {self.attempts + 1}")
+        try:
+            connected = self.manager.io.call(self.manager._initialize_mt5_job, priority=MT5_PRIORITY_MAINTENANCE,
+                                             timeout=MT5_CONNECT_TIMEOUT)
+        except Exception as e:
+            with self._lock:
+                self.last_error = str(e)
+            connected = False
+        
+        with self._lock:
+            if connected:
+                logger.info("[OK] تم إعادة الاتصال بنجاح!")
+                self.attempts = 0
+                self.failed_checks = 0
+                self._set_state(self.CONNECTED)
+                return
+            
+            self.attempts += 1
+            self._next_delay = self._backoff()
+            self._set_state(self.DOWN if self.attempts >= SUPERVISOR_DOWN_AFTER else self.RECONNECTING)
+            logger.info(f"[RECONNECT] المحاولة التالية خلال {self._next_delay:.1f} ثانية")
+
+# ===== سجل مواصفات الرموز (الدقة والنقطة وأحجام العقود) =====
+SYMBOL_METADATA_TTL = 6 * 3600  # ثوان - مواصفات الرموز نادراً ما تتغير
+SYMBOL_METADATA_LOAD_TIMEOUT = 30  # ثوان - مهلة تحميل جميع الرموز دفعة واحدة
+SYMBOL_METADATA_MISSING_TTL = 1800  # ثوان - رمز لا يدرجه الوسيط لا يعاد طلبه قبل هذه المدة
+
+# قيم افتراضية حسب نوع الرمز عند عدم توفر المنصة: (digits, contract_size, volume_min, volume_step)
+_SYMBOL_TYPE_DEFAULTS = {
+    'forex': (5, 100000.0, 0.01, 0.01),
+    'metal': (2, 100.0, 0.01, 0.01),
+    'crypto': (2, 1.0, 0.01, 0.01),
+    'stock': (2, 1.0, 1.0, 1.0),
+    'index': (1, 1.0, 0.1, 0.1),
+}
+_SYMBOL_DIGITS_OVERRIDES = {'XAGUSD': 3, 'XRPUSD': 4, 'ADAUSD': 4, 'DOGEUSD': 5, 'DOTUSD': 3, 'LINKUSD': 3}
+
+def _default_symbol_metadata(symbol: str) -> Dict:
+    """مواصفات تقريبية من نوع الرمز (أزواج الين بثلاث خانات)"""
+    symbol_type = ALL_SYMBOLS.get(symbol, {}).get('type', 'forex')
+    digits, contract_size, volume_min, volume_step = _SYMBOL_TYPE_DEFAULTS.get(symbol_type, _SYMBOL_TYPE_DEFAULTS['forex'])
+    if symbol_type == 'forex' and 'JPY' in symbol:
+        digits = 3
+    digits = _SYMBOL_DIGITS_OVERRIDES.get(symbol, digits)
+    return {
+        'symbol': symbol,
+        'description': ALL_SYMBOLS.get(symbol, {}).get('name', symbol),
+        'point': 10 ** -digits,
+        'digits': digits,
+        'spread': None,
+        'volume_min': volume_min,
+        'volume_max': 100.0,
+        'volume_step': volume_step,
+        'contract_size': contract_size,
+        'currency_base': None,
+        'currency_profit': None,
+        'margin_currency': None,
+        'source': 'default'
+    }
+
+def _symbol_info_to_dict(info) -> Dict:
+    """تحويل كائن symbol_info من المنصة إلى قاموس"""
+    return {
+        'symbol': info.name,
+        'description': info.description,
+        'point': info.point,
+        'digits': info.digits,
+        'spread': info.spread,
+        'volume_min': info.volume_min,
+        'volume_max': info.volume_max,
+        'volume_step': info.volume_step,
+        'contract_size': info.trade_contract_size,
+        'currency_base': info.currency_base,
+        'currency_profit': info.currency_profit,
+        'margin_currency': info.currency_margin,
+        'source': 'mt5'
+    }
+
+class SymbolMetadataRegistry:
+    """مواصفات جميع الرموز في الذاكرة - تحمل مرة عند البدء وتحدث بكسل في الخلفية عند انتهاء صلاحيتها"""
+    
+    def __init__(self, manager, ttl: float = SYMBOL_METADATA_TTL):
+        self.manager = manager
+        self.ttl = ttl
+        self._entries = {}  # {symbol: (metadata, loaded_at monotonic)}
+        self._missing = {}  # {symbol: checked_at monotonic} رموز غير مدرجة لدى الوسيط
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.refreshes = 0
+    
+    def load(self, symbols=None) -> int:
+        """تحميل مواصفات الرموز بطلب واحد على خيط MT5 - يعيد عدد الرموز المحملة من المنصة"""
+        symbols = list(symbols if symbols is not None else ALL_SYMBOLS)
+        if not self.manager.connected or not symbols:
+            return 0
+        try:
+            loaded = self.manager.io.call(self._load_job, symbols, priority=MT5_PRIORITY_MAINTENANCE,
+                                          timeout=SYMBOL_METADATA_LOAD_TIMEOUT)
+        except Exception as e:
+            logger.warning(f"[WARNING] فشل تحميل مواصفات الرموز: {e}")
+            return 0
+        self._store(loaded)
+        self.loads += 1
+        count = sum(1 for metadata in loaded.values() if metadata is not None)
+        logger.info(f"[SYMBOLS] تم تحميل مواصفات {count}/{len(symbols)} رمز من MT5")
+        return count
+    
+    def _load_job(self, symbols) -> Dict[str, Optional[Dict]]:
+        """قراءة symbol_info لعدة رموز - يعمل فقط على خيط MT5
+        
+        None = الرمز غير مدرج لدى الوسيط؛ الرمز الذي فشلت قراءته بخطأ اتصال لا يعاد
+        """
+        loaded = {}
+        for symbol in symbols:
+            info = mt5.symbol_info(symbol)
+            if info is not None:
+                loaded[symbol] = _symbol_info_to_dict(info)
+            elif mt5.last_error()[0] > MT5_CONNECTION_ERROR_CODE:
+                loaded[symbol] = None
+        return loaded
+    
+    def _store(self, loaded: Dict[str, Optional[Dict]]):
+        """حفظ المواصفات المحملة وتسجيل الرموز التي أكدت المنصة أنها غير مدرجة"""
+        now = time.monotonic()
+        with self._lock:
+            for symbol, metadata in loaded.items():
+                if metadata is None:
+                    self._missing[symbol] = now
+                else:
+                    self._entries[symbol] = (metadata, now)
+                    self._missing.pop(symbol, None)
+    
+    def get(self, symbol: str) -> Dict:
+        """المواصفات من الذاكرة فوراً (أو الافتراضية) - المنتهية تعاد وتحدث في الخلفية"""
+        entry = self._entries.get(symbol)
+        if entry is None:
+            checked_at = self._missing.get(symbol)
+            if checked_at is None or time.monotonic() - checked_at > SYMBOL_METADATA_MISSING_TTL:
+                self._refresh_async(symbol)
+            return _default_symbol_metadata(symbol)
+        metadata, loaded_at = entry
+        if time.monotonic() - loaded_at > self.ttl:
+            self._refresh_async(symbol)
+        return metadata
+    
+    def _refresh_async(self, symbol: str):
+        """تحديث رمز واحد على خيط MT5 بدون انتظار النتيجة"""
+        if not self.manager.connected:
+            return
+        with self._lock:
+            if symbol in self._refreshing:
+                return
+            self._refreshing.add(symbol)
+        
+        def done(future):
+            with self._lock:
+                self._refreshing.discard(symbol)
+            if future.cancelled() or future.exception() is not None:
+                return
+            self._store(future.result())
+            self.refreshes += 1
+        
+        try:
+            future = self.manager.io.submit(self._load_job, [symbol], priority=MT5_PRIORITY_MAINTENANCE)
+        except Exception:
+            with self._lock:
+                self._refreshing.discard(symbol)
+            return
+        future.add_done_callback(done)
+    
+    def invalidate(self, symbol: str = None):
+        """إجبار إعادة التحميل عند الطلب التالي"""
+        with self._lock:
+            if symbol is None:
+                self._entries.clear()
+                self._missing.clear()
+            else:
+                self._entries.pop(symbol, None)
+                self._missing.pop(symbol, None)
+    
+    def point(self, symbol: str) -> float:
+        return self.get(symbol)['point'] or 10 ** -self.digits(symbol)
+    
+    def digits(self, symbol: str) -> int:
+        return int(self.get(symbol)['digits'])
+    
+    def to_points(self, symbol: str, distance: float) -> float:
+        """تحويل فرق سعري إلى نقاط حسب نقطة الرمز"""
+        return abs(distance) / self.point(symbol)
+    
+    def pip_size(self, symbol: str) -> float:
+        """حجم النقطة المعروضة: عشر نقاط المنصة لأزواج العملات بخمس أو ثلاث خانات، وإلا نقطة المنصة"""
+        point = self.point(symbol)
+        if ALL_SYMBOLS.get(symbol, {}).get('type', 'forex') == 'forex' and self.digits(symbol) in (3, 5):
+            return point * 10
+        return point
+    
+    def to_pips(self, symbol: str, distance: float) -> float:
+        """تحويل فرق سعري إلى نقاط معروضة (pips) كما في رسائل البوت السابقة لأزواج العملات"""
+        return abs(distance) / self.pip_size(symbol)
+    
+    def lot_value(self, symbol: str, price: float) -> float:
+        """القيمة الاسمية للوت واحد بعملة الحساب (الدولار) لتحويل المبلغ إلى لوتات"""
+        metadata = self.get(symbol)
+        contract_size = metadata['contract_size'] or 1.0
+        base = metadata['currency_base']
+        if base is None and ALL_SYMBOLS.get(symbol, {}).get('type', 'forex') == 'forex':
+            base = symbol[:3]
+        if base == 'USD':
+            return contract_size  # USDJPY/USDCHF: اللوت = حجم العقد بالدولار مباشرة
+        # الدولار عملة التسعير (وتقريب لأزواج التقاطع): حجم العقد × السعر
+        return contract_size * price
+    
+    def format_price(self, symbol: str, value: float, thousands: bool = False) -> str:
+        """تنسيق السعر بعدد خانات الرمز"""
+        digits = self.digits(symbol)
+        return f"{value:,.{digits}f}" if thousands else f"{value:.{digits}f}"
+    
+    def normalize_volume(self, symbol: str, volume: float) -> float:
+        """تقريب الحجم لأقرب خطوة مسموحة ضمن الحدين الأدنى والأعلى"""
+        metadata = self.get(symbol)
+        step = metadata['volume_step'] or 0.01
+        volume = math.floor(volume / step + 1e-9) * step
+        volume = max(metadata['volume_min'], min(metadata['volume_max'], volume))
+        return round(volume, max(0, -int(math.floor(math.log10(step)))))
+
+# ===== كلاس إدارة MT5 =====
+class MT5Manager:
+    """مدير الاتصال مع MetaTrader5"""
+    
+    def __init__(self):
+        self.connected = False
+        self.io = MT5IOWorker()  # جميع استدعاءات MT5 تمر عبر خيط واحد
+        self.health = MT5HealthMonitor()
+        self.io.observer = self.health.record_call
+        self.last_connection_attempt = 0
+        self.connection_retry_delay = 5  # 5 ثوان بين محاولات الاتصال
+        self.tick_stream = TickStreamCollector(self)
+        self.bar_store = BarStore(self, capacities={mt5.TIMEFRAME_M1: MTF_M1_CAPACITY})
+        self.bar_cache = MultiTimeframeBarCache(self)
+        self.indicator_engine = StreamingIndicatorEngine()
+        self.indicator_cache = IndicatorCache()
+        self.symbols = SymbolMetadataRegistry(self)
+        self.archive = MarketArchive(point_of=self.symbols.point)
+        self.yahoo_fallback = YahooFallbackProvider(self._convert_to_yahoo_symbol)
+        self.price_router = PriceSourceRouter([
+            PriceSource('mt5', self._fetch_mt5_prices, probe=self.check_real_connection, rank=0),
+            PriceSource('yahoo', self._fetch_yahoo_prices, probe=self.yahoo_fallback.probe, rank=1),
+        ])
+        self.initialize_mt5()
+        self.supervisor = ConnectionSupervisor(self, self.connected)
+    
+    def initialize_mt5(self):
+        """تهيئة الاتصال مع MT5 مع آلية إعادة المحاولة (تنفذ على خيط MT5)"""
+        # منع محاولات الاتصال المتكررة
+        current_time = time.time()
+        if current_time - self.last_connection_attempt < self.connection_retry_delay:
+            logger.debug("[DEBUG] محاولة اتصال سابقة حديثة - انتظار...")
+            return self.connected
+        
+        self.last_connection_attempt = current_time
+        
+        try:
+            return self.io.call(self._initialize_mt5_job, priority=MT5_PRIORITY_MAINTENANCE, timeout=MT5_CONNECT_TIMEOUT)
+        except Exception as e:
+            logger.error(f"[ERROR] خطأ في تهيئة MT5: {e}")
+            self.connected = False
+            return False
+    
+    def _initialize_mt5_job(self) -> bool:
+        """تهيئة الاتصال - تعمل فقط على خيط MT5"""
+        try:
+            # إغلاق الاتصال السابق إذا كان موجوداً
+            try:
+                mt5.shutdown()
+            except:
+                pass
+            
+            # محاولة الاتصال
+            if not mt5.initialize():
+                logger.error("[ERROR] فشل في تهيئة MT5")
+                self.connected = False
+                return False
+            
+            # التحقق من الاتصال
+            account_info = mt5.account_info()
+            if account_info is None:
+                logger.error("[ERROR] فشل في الحصول على معلومات الحساب")
+                mt5.shutdown()
+                self.connected = False
+                return False
+            self.health.record_account(account_info)
+            
+            # اختبار جلب بيانات تجريبية للتأكد من الاتصال
+            test_tick = mt5.symbol_info_tick("EURUSD")
+            if test_tick is None:
+                logger.warning("[WARNING] فشل في اختبار جلب البيانات")
+                # لا نغلق الاتصال هنا لأن بعض الحسابات قد لا تدعم EURUSD
+            
+            self.connected = True
+            logger.info("[OK] تم الاتصال بـ MetaTrader5 بنجاح!")
+            logger.info(f"[DATA] معلومات الحساب: {account_info.login} - {account_info.server}")
+            
+            # طباعة رسالة النجاح في التيرمينال
+            print("\n" + "="*60)
+            print("🎉 تم الاتصال بـ MetaTrader5 بنجاح!")
+            print(f"📊 رقم الحساب: {account_info.login}")
+            print(f"🏦 الخادم: {account_info.server}")
+            print(f"💰 الرصيد: {account_info.balance}")
+            print(f"💎 العملة: {account_info.currency}")
+            print("="*60 + "\n")
+            
+            return True
+            
+        except Exception as e:
+            logger.error(f"[ERROR] خطأ في تهيئة MT5: {e}")
+            self.connected = False
+            try:
+                mt5.shutdown()
+            except:
+                pass
+            return False
+    
+    def check_real_connection(self) -> bool:
+        """حالة الاتصال الحالية من المشرف فوراً - إعادة الاتصال تتم في الخلفية وليس في خيط المستدعي"""
+        if self.supervisor.is_available():
+            return True
+        self.supervisor.request_reconnect("طلب من مستدعٍ أثناء الانقطاع")
+        return False
+    
+    def _probe_connection_job(self) -> bool:
+        """فحص صريح خفيف (الحساب + تيك واحد حديث) - يعمل فقط على خيط MT5"""
+        # محاولة جلب معلومات الحساب
+        account_info = mt5.account_info()
+        if account_info is None:
+            logger.warning("[WARNING] لا يمكن الحصول على معلومات الحساب - محاولة إعادة الاتصال...")
+            return False
+        self.health.record_account(account_info)
+        
+        # أول تيك متوفر من الرموز المشتركة في البث أو رموز معروفة
+        test_symbols = self.tick_stream.symbols()[:3] or ("EURUSD", "GBPUSD", "USDJPY", "GOLD", "XAUUSD")
+        tick = None
+        for symbol in test_symbols:
+            tick = mt5.symbol_info_tick(symbol)
+            if tick is not None:
+                break
+        
+        if tick is None:
+            logger.warning("[WARNING] لا يمكن الحصول على البيانات اللحظية - الاتصال معطل")
+            return False
+        
+        # التحقق من أن البيانات حديثة (مع مرونة أكبر لبعض الأسواق)
+        try:
+            self.health.record_tick(tick.time)
+            tick_age = time.time() - tick.time
+            
+            # 15 دقيقة بدلاً من 5 للمرونة أكثر
+            if tick_age > HEALTH_STALE_TICK_AGE:
+                logger.warning(f"[WARNING] البيانات قديمة جداً (عمر: {timedelta(seconds=int(tick_age))}) - الاتصال غير فعال")
+                return False
+        except:
+            # إذا فشل في قراءة وقت التيك، لا نعتبر هذا خطأ كريتيكال
+            pass
+        
+        return True
+    
+    def validate_connection_health(self) -> bool:
+        """صحة الاتصال من الحركة الملاحظة - فحص صريح فقط عندما تهدأ الحركة"""
+        try:
+            if not self.connected:
+                return False
+            
+            if self.supervisor.state == ConnectionSupervisor.CONNECTED and self.health.is_live():
+                return True
+            
+            health_ok = self.io.call(self._probe_connection_job, priority=MT5_PRIORITY_MAINTENANCE)
+            self.health.record_probe(health_ok)
+            
+            if not health_ok:
+                snapshot = self.health.snapshot()
+                logger.warning(f"[WARNING] صحة اتصال MT5 ضعيفة - نسبة الأخطاء: {snapshot['error_rate']:.1%}")
+                self.supervisor.report_failure("فشل فحص الصحة")
+            
+            return health_ok
+            
+        except Exception as e:
+            logger.error(f"[ERROR] خطأ في فحص صحة الاتصال: {e}")
+            self.supervisor.report_failure(str(e))
+            return False
+    
+    def graceful_shutdown(self):
+        """إغلاق آمن لاتصال MT5"""
+        try:
+            if self.connected:
+                logger.info("[SYSTEM] إغلاق اتصال MT5...")
+                self.io.call(mt5.shutdown, priority=MT5_PRIORITY_MAINTENANCE)
+                self.connected = False
+                logger.info("[OK] تم إغلاق اتصال MT5 بأمان")
+        except Exception as e:
+            logger.error(f"[ERROR] خطأ في إغلاق MT5: {e}")
+        finally:
+            self.io.stop()
+    
+    def get_connection_status_detailed(self) -> Dict:
+        """الحصول على تفاصيل حالة الاتصال من اللقطة المحفوظة (بدون استدعاءات للمنصة)"""
+        try:
+            real_status = self.supervisor.is_available()
+            snapshot = self.health.snapshot()
+            
+            status_info = {
+                'connected': real_status,
+                'state': self.supervisor.state,
+                'status_text': '🟢 متصل ونشط' if real_status else '🔴 منقطع أو معطل',
+                'last_check': datetime.now().strftime('%H:%M:%S'),
+                'account_info': snapshot['account'] if real_status else None,
+                'data_freshness': None,
+                'health': snapshot
+            }
+            
+            # حداثة البيانات من آخر تيك ملاحظ
+            if real_status and snapshot['tick_age'] is not None:
+                status_info['data_freshness'] = f"{snapshot['tick_age']:.0f} ثانية"
+            
+            return status_info
+            
+        except Exception as e:
+            logger.error(f"[ERROR] خطأ في جلب حالة الاتصال التفصيلية: {e}")
+            return {
+                'connected': False,
+                'status_text': '❌ خطأ في الفحص',
+                'last_check': datetime.now().strftime('%H:%M:%S'),
+                'error': str(e)
+            }
+    
+    def get_live_price(self, symbol: str) -> Optional[Dict]:
+        """جلب السعر اللحظي الحقيقي - MT5 هو المصدر الأساسي الأولي مع نظام كاش"""
+        
+        if not symbol or symbol in ['notification', 'null', '', None]:
+            logger.warning(f"[WARNING] رمز غير صالح في get_live_price: {symbol}")
+            return None
+        
+        # آخر تيك من خيط البث (بدون استدعاء MT5 أو انتظار قفل)
+        streamed_data = self._get_streamed_price(symbol)
+        if streamed_data:
+            return streamed_data
+        
+        # التحقق من الكاش أولاً (القيمة القديمة تعاد فوراً مع تحديث في الخلفية)
+        cached_data = price_cache.get_or_revalidate(symbol, self._revalidate_price)
+        if cached_data:
+            logger.debug(f"[CACHE] استخدام بيانات مخزنة مؤقتاً لـ {symbol}")
+            return cached_data
+        
+        # ✅ أسرع مصدر سليم (MT5 أولاً عادة، ثم Yahoo، ثم آخر سعر جيد معروف)
+        # الطلبات المتزامنة لنفس الرمز تنضم للجلب الجاري بدلاً من رفضها
+        return price_fetch_flight.do_many([symbol], self._fetch_and_cache_prices).get(symbol)
+    
+    def get_live_prices(self, symbols: List[str]) -> Dict[str, Dict]:
+        """جلب الأسعار اللحظية لعدة رموز دفعة واحدة - طلب واحد على خيط MT5 لجميع الرموز"""
+        results = {}
+        pending = []
+        
+        # المرحلة 1: البث والكاش لجميع الرموز (القيمة القديمة تعاد فوراً مع تحديث في الخلفية)
+        for symbol in dict.fromkeys(symbols):
+            if not symbol or symbol in ['notification', 'null']:
+                logger.warning(f"[WARNING] رمز غير صالح في get_live_prices: {symbol}")
+                continue
+            
+            streamed_data = self._get_streamed_price(symbol)
+            if streamed_data:
+                results[symbol] = streamed_data
+                continue
+            
+            cached_data = price_cache.get_or_revalidate(symbol, self._revalidate_price)
+            if cached_data:
+                results[symbol] = cached_data
+                continue
+            
+            pending.append(symbol)
+        
+        if not pending:
+            logger.debug(f"[CACHE] جميع الرموز ({len(results)}) متوفرة في الكاش")
+            return results
+        
+        # المرحلة 2: الرموز المعلقة عبر موجه المصادر في تمريرة واحدة (مع الانضمام للجلب الجاري)
+        fetched = price_fetch_flight.do_many(pending, self._fetch_and_cache_prices)
+        results.update(fetched)
+        
+        logger.debug(f"[BATCH] تم جلب {len(fetched)}/{len(pending)} رمز من المصادر و {len(results) - len(fetched)} من الكاش")
+        return results
+    
+    def _fetch_and_cache_prices(self, symbols: List[str]) -> Dict[str, Dict]:
+        """جلب فعلي عبر موجه المصادر وحفظ النتائج في الكاش (بدون آخر سعر جيد معروف)"""
+        fetched = self.price_router.fetch(symbols)
+        for symbol in symbols:
+            if symbol not in fetched:
+                logger.error(f"[ERROR] فشل في جلب البيانات من جميع المصادر للرمز {symbol}")
+        cache_price_data_bulk({symbol: data for symbol, data in fetched.items() if not data.get('last_known_good')})
+        return fetched
+    
+    def _revalidate_price(self, symbol: str) -> Optional[Dict]:
+        """تحديث الكاش في الخلفية لرمز انتهت صلاحيته"""
+        data = price_fetch_flight.do_many([symbol], self._fetch_and_cache_prices).get(symbol)
+        if data and not data.get('last_known_good'):
+            return data
+        return None
+    
+    def _fetch_mt5_prices(self, symbols: List[str]) -> Dict[str, Dict]:
+        """مصدر MT5 للموجه: جميع التيكات في طلب واحد على خيط MT5 - يرفع استثناء عند انقطاع الاتصال"""
+        if not self.connected:
+            raise ConnectionError("MT5 غير متصل")
+        
+        ticks = self.io.call(self._read_ticks_job, symbols)
+        tick_times = [tick.time for tick in ticks.values() if tick is not None]
+        if tick_times:
+            self.health.record_tick(max(tick_times))
+        for symbol, tick in ticks.items():
+            self.archive.record_tick(symbol, tick)
+        
+        # تطبيق قواعد الحداثة على الدفعة كاملة بنفس الوقت المرجعي
+        now = datetime.now()
+        fetched = {}
+        for symbol, tick in ticks.items():
+            data = self._build_mt5_price_data(symbol, tick, now)
+            if data:
+                fetched[symbol] = data
+        return fetched
+    
+    def _read_ticks_job(self, symbols: List[str]) -> Dict:
+        """قراءة تيكات الدفعة - تعمل على خيط MT5"""
+        ticks = {}
+        for symbol in symbols:
+            try:
+                ticks[symbol] = mt5.symbol_info_tick(symbol)
+            except Exception as e:
+                if "connection" in str(e).lower() or "terminal" in str(e).lower():
+                    self.supervisor.report_failure(str(e))
+                    raise
+                logger.warning(f"[WARNING] فشل جلب البيانات من MT5 لـ {symbol}: {e}")
+        return ticks
+    
+    def _fetch_yahoo_prices(self, symbols: List[str]) -> Optional[Dict[str, Dict]]:
+        """مصدر Yahoo للموجه - None إذا لم يكن لأي رمز مقابل في Yahoo"""
+        supported = [symbol for symbol in symbols if self._convert_to_yahoo_symbol(symbol)]
+        if not supported:
+            return None
+        prices = self.yahoo_fallback.get_prices(supported)
+        if not prices:
+            raise ConnectionError("لا توجد استجابة من Yahoo Finance")
+        return prices
+    
+    def _get_streamed_price(self, symbol: str) -> Optional[Dict]:
+        """قراءة آخر تيك من خيط البث إذا كان يعمل وحديثاً"""
+        tick = self.tick_stream.latest_tick(symbol)
+        if tick is None:
+            return None
+        return self._build_mt5_price_data(symbol, tick, datetime.now())
+    
+    def _build_mt5_price_data(self, symbol: str, tick, now: datetime) -> Optional[Dict]:
+        """تحويل تيك MT5 إلى قاموس بيانات السعر مع تطبيق قواعد الحداثة"""
+        if tick is not None and hasattr(tick, 'bid') and hasattr(tick, 'ask') and tick.bid > 0 and tick.ask > 0:
+            # التحقق من أن البيانات حديثة (ليست قديمة)
+            tick_time = datetime.fromtimestamp(tick.time)
+            time_diff = now - tick_time
+            
+            # زيادة مرونة وقت البيانات إلى 15 دقيقة
+            if time_diff.total_seconds() > 900:
+                logger.warning(f"[WARNING] بيانات MT5 قديمة للرمز {symbol} (عمر البيانات: {time_diff})")
+                # لا نغير حالة الاتصال فوراً، قد تكون مشكلة مؤقتة في الرمز
+                return None
+            
+            logger.debug(f"[OK] تم جلب البيانات الحديثة من MT5 للرمز {symbol}")
+            return {
+                'symbol': symbol,
+                'bid': tick.bid,
+                'ask': tick.ask,
+                'last': tick.last,
+                'volume': tick.volume,
+                'time': tick_time,
+                'spread': tick.ask - tick.bid,
+                'source': 'MetaTrader5 (مصدر أساسي)',
+                'data_age': time_diff.total_seconds()
+            }
+        
+        logger.warning(f"[WARNING] لا توجد بيانات صحيحة من MT5 لـ {symbol}")
+        # لا نغير حالة الاتصال فوراً، قد يكون الرمز غير متاح فقط
+        return None
+    
+    def _convert_to_yahoo_symbol(self, mt5_symbol: str) -> Optional[str]:
+        """تحويل رموز MT5 إلى رموز Yahoo Finance"""
+        conversion_map = {
+            # العملات الرقمية
+            'BTCUSD': 'BTC-USD',
+            'ETHUSD': 'ETH-USD',
+            'LTCUSD': 'LTC-USD',
+            'BCHUSD': 'BCH-USD',
+            
+            # أزواج العملات (Forex)
+            'EURUSD': 'EURUSD=X',
+            'GBPUSD': 'GBPUSD=X',
+            'USDJPY': 'USDJPY=X',
+            'AUDUSD': 'AUDUSD=X',
+            'USDCAD': 'USDCAD=X',
+            'USDCHF': 'USDCHF=X',
+            'NZDUSD': 'NZDUSD=X',
+            'EURJPY': 'EURJPY=X',
+            'EURGBP': 'EURGBP=X',
             'EURAUD': 'EURAUD=X',
             
             # المؤشرات
@@ -772,8 +3019,14 @@ class MT5Manager:
             return None
         
         try:
+            # الأطر المدعومة تقدم من الذاكرة (مشتقة من تغذية M1 واحدة)
+            if self.bar_cache.supports(timeframe) and count <= self.bar_cache.capacity:
+                df = self.bar_cache.get_frame(symbol, timeframe, count)
+                if df is not None:
+                    return df
+            
             # جلب البيانات
-            rates = mt5.copy_rates_from_pos(symbol, timeframe, 0, count)
+            rates = self.io.call(mt5.copy_rates_from_pos, symbol, timeframe, 0, count)
             if rates is None or len(rates) == 0:
                 logger.warning(f"[WARNING] لا توجد بيانات للرمز {symbol}")
                 return None
@@ -793,179 +3046,957 @@ class MT5Manager:
             return None
     
     def get_symbol_info(self, symbol: str) -> Optional[Dict]:
-        """جلب معلومات الرمز من MT5"""
-        if not self.connected:
+        """معلومات الرمز من سجل المواصفات في الذاكرة (بدون استدعاء للمنصة)"""
+        try:
+            return self.symbols.get(symbol)
+        except Exception as e:
+            logger.error(f"[ERROR] خطأ في جلب معلومات الرمز {symbol}: {e}")
             return None
-        
+    
+    def calculate_technical_indicators(self, symbol: str) -> Optional[Dict]:
+        """حساب المؤشرات الفنية من البيانات التاريخية للرمز"""
         try:
-            info = mt5.symbol_info(symbol)
-            if info is None:
+            if not self.connected:
+                logger.warning(f"[WARNING] MT5 غير متصل - لا يمكن حساب المؤشرات لـ {symbol}")
+                return None
+            
+            # جلب البيانات التاريخية (100 شمعة للمؤشرات) من كاش الأطر الزمنية
+            bars = self.bar_cache.get_bars(symbol, mt5.TIMEFRAME_M15, 100)
+            if bars is None or len(bars) < 20:
+                logger.warning(f"[WARNING] بيانات غير كافية لحساب المؤشرات لـ {symbol}")
                 return None
             
+            bar_time = int(bars['time'][-2])
+            values = self._streaming_values(symbol, bars)
+            indicators = self._build_indicators(values)
+            logger.info(f"[OK] تم حساب المؤشرات الفنية لـ {symbol} - الاتجاه: {indicators['overall_trend']}")
+            
             return {
-                'symbol': info.name,
-                'description': info.description,
-                'point': info.point,
-                'digits': info.digits,
-                'spread': info.spread,
-                'volume_min': info.volume_min,
-                'volume_max': info.volume_max,
-                'volume_step': info.volume_step,
-                'contract_size': info.trade_contract_size,
-                'currency_base': info.currency_base,
-                'currency_profit': info.currency_profit,
-                'margin_currency': info.currency_margin,
+                'symbol': symbol,
+                'indicators': indicators,
+                'calculated_at': datetime.now(),
+                'data_points': len(bars),
+                'bar_time': bar_time
             }
             
         except Exception as e:
-            logger.error(f"[ERROR] خطأ في جلب معلومات الرمز {symbol}: {e}")
+            logger.error(f"[ERROR] خطأ في حساب المؤشرات الفنية لـ {symbol}: {e}")
+            return None
+    
+    def _streaming_values(self, symbol: str, bars: np.ndarray) -> Dict:
+        """القيم الخام مع الشمعة الجارية: الحالة المثبتة من الكاش ثم تيك الشمعة الجارية فوقها بتكلفة ثابتة"""
+        bar_time = int(bars['time'][-2])
+        state = self.indicator_cache.get(symbol, mt5.TIMEFRAME_M15, bar_time)
+        if state is not None and state.last_time == bar_time:
+            logger.debug(f"[CACHE] استخدام حالة المؤشرات المحفوظة لـ {symbol}")
+            return state.peek(bars[-1])
+        
+        # شمعة مغلقة جديدة: تثبيت الشموع الجديدة فقط في الحالة المتدرجة
+        values = self.indicator_engine.update_from_bars(symbol, mt5.TIMEFRAME_M15, bars)
+        self.indicator_cache.put(symbol, mt5.TIMEFRAME_M15, bar_time,
+                                 self.indicator_engine.state(symbol, mt5.TIMEFRAME_M15))
+        return values
+    
+    def calculate_technical_indicators_batch(self, symbols: List[str], count: int = 100) -> Dict[str, Dict]:
+        """حساب المؤشرات الفنية لعدة رموز: الرموز ذات الحالة المتدرجة بتكلفة ثابتة والباقي باستدعاء متجه واحد على مصفوفات (n_symbols, n_bars)"""
+        results = {}
+        if not self.connected:
+            logger.warning("[WARNING] MT5 غير متصل - لا يمكن حساب المؤشرات دفعة واحدة")
+            return results
+        
+        calculated_at = datetime.now()
+        cold = {}
+        for symbol in dict.fromkeys(symbols):
+            bars = self.bar_cache.get_bars(symbol, mt5.TIMEFRAME_M15, count)
+            if bars is not None and len(bars) == count:
+                if not self.indicator_engine.has_state(symbol, mt5.TIMEFRAME_M15):
+                    cold[symbol] = bars
+                    continue
+                # للرمز حالة متدرجة (تاريخ أطول من النافذة في RSI/MACD الأسية) - نفس قيم المسار الفردي
+                try:
+                    results[symbol] = {
+                        'symbol': symbol,
+                        'indicators': self._build_indicators(self._streaming_values(symbol, bars)),
+                        'calculated_at': calculated_at,
+                        'data_points': count,
+                        'bar_time': int(bars['time'][-2])
+                    }
+                except Exception as e:
+                    logger.error(f"[ERROR] خطأ في حساب المؤشرات المتدرجة لـ {symbol}: {e}")
+            else:
+                # رموز بتاريخ أقصر من النافذة تحسب بالمسار الفردي
+                technical_data = self.calculate_technical_indicators(symbol)
+                if technical_data:
+                    results[symbol] = technical_data
+        
+        if not cold:
+            return results
+        
+        try:
+            # رموز بلا حالة متدرجة: نفس النافذة التي يبني منها المسار الفردي حالته (الشموع المغلقة ثم الجارية)
+            batch_symbols = list(cold)
+            stacked = np.stack([cold[symbol] for symbol in batch_symbols])
+            matrix = compute_indicator_matrix(
+                stacked['close'],
+                stacked['high'],
+                stacked['low'],
+                stacked['tick_volume'].astype(float)
+            )
+            
+            for row, symbol in enumerate(batch_symbols):
+                values = {name: float(column[row]) for name, column in matrix.items()}
+                values['bars'] = count
+                results[symbol] = {
+                    'symbol': symbol,
+                    'indicators': self._build_indicators(values),
+                    'calculated_at': calculated_at,
+                    'data_points': count,
+                    'bar_time': int(cold[symbol]['time'][-2])
+                }
+            
+            logger.info(f"[OK] تم حساب المؤشرات الفنية لـ {len(batch_symbols)} رمز في استدعاء متجه واحد")
+            
+        except Exception as e:
+            logger.error(f"[ERROR] خطأ في حساب المؤشرات دفعة واحدة: {e}")
+        
+        return results
+    
+    def get_timeframe_context(self, symbol: str) -> Dict[str, Dict]:
+        """ملخص الاتجاه على الأطر الأكبر (H1/H4/D1) من الشموع المحفوظة في الذاكرة"""
+        context = {}
+        if not self.connected:
+            return context
+        
+        for timeframe, name in MTF_CONTEXT_TIMEFRAMES.items():
+            bars = self.bar_cache.get_bars(symbol, timeframe, 20)
+            if bars is None or len(bars) < 20:
+                continue
+            close = float(bars['close'][-1])
+            ma_20 = float(bars['close'].mean())
+            context[name] = {
+                'close': close,
+                'ma_20': ma_20,
+                'trend': 'صاعد' if close > ma_20 else 'هابط' if close < ma_20 else 'محايد',
+                'change_pct': (close - float(bars['open'][-1])) / float(bars['open'][-1]) * 100 if bars['open'][-1] else 0.0
+            }
+        return context
+    
+    @staticmethod
+    def _build_indicators(values: Dict) -> Dict:
+        """بناء قاموس المؤشرات وتفسيراتها من القيم الخام للمحرك المتدرج"""
+        def valid(value):
+            return value is not None and not pd.isna(value)
+        
+        indicators = {}
+        bars = values['bars']
+        close = values['close']
+        
+        # المتوسطات المتحركة
+        for window in (10, 20, 50):
+            if bars >= window:
+                indicators[f'ma_{window}'] = values[f'ma_{window}']
+        
+        # RSI
+        if bars >= 14:
+            indicators['rsi'] = values['rsi']
+            
+            # تفسير RSI
+            if indicators['rsi'] > 70:
+                indicators['rsi_interpretation'] = 'ذروة شراء'
+            elif indicators['rsi'] < 30:
+                indicators['rsi_interpretation'] = 'ذروة بيع'
+            else:
+                indicators['rsi_interpretation'] = 'محايد'
+        
+        # MACD
+        if bars >= 26:
+            indicators['macd'] = {
+                'macd': values['macd'] if valid(values['macd']) else 0,
+                'signal': values['macd_signal'] if valid(values['macd_signal']) else 0,
+                'histogram': values['macd_histogram'] if valid(values['macd_histogram']) else 0
+            }
+            
+            # تفسير MACD
+            if indicators['macd']['macd'] > indicators['macd']['signal']:
+                indicators['macd_interpretation'] = 'إشارة صعود'
+            elif indicators['macd']['macd'] < indicators['macd']['signal']:
+                indicators['macd_interpretation'] = 'إشارة هبوط'
+            else:
+                indicators['macd_interpretation'] = 'محايد'
+        
+        # حجم التداول
+        indicators['current_volume'] = values['volume']
+        if bars >= 20:
+            indicators['avg_volume'] = values['avg_volume']
+            indicators['volume_ratio'] = indicators['current_volume'] / indicators['avg_volume']
+            
+            if indicators['volume_ratio'] > 1.5:
+                indicators['volume_interpretation'] = 'حجم عالي'
+            elif indicators['volume_ratio'] < 0.5:
+                indicators['volume_interpretation'] = 'حجم منخفض'
+            else:
+                indicators['volume_interpretation'] = 'حجم طبيعي'
+        
+        # Stochastic
+        if bars >= 14:
+            indicators['stochastic'] = {
+                'k': values['stoch_k'] if valid(values['stoch_k']) else 50,
+                'd': values['stoch_d'] if valid(values['stoch_d']) else 50
+            }
+        
+        # البولنجر باندز
+        if bars >= 20:
+            indicators['bollinger'] = {
+                'upper': values['bb_upper'] if valid(values['bb_upper']) else close * 1.02,
+                'middle': values['bb_middle'] if valid(values['bb_middle']) else close,
+                'lower': values['bb_lower'] if valid(values['bb_lower']) else close * 0.98
+            }
+            
+            # تفسير البولنجر باندز
+            if close > indicators['bollinger']['upper']:
+                indicators['bollinger_interpretation'] = 'فوق النطاق العلوي - إشارة بيع محتملة'
+            elif close < indicators['bollinger']['lower']:
+                indicators['bollinger_interpretation'] = 'تحت النطاق السفلي - إشارة شراء محتملة'
+            else:
+                indicators['bollinger_interpretation'] = 'ضمن النطاق - حركة طبيعية'
+        
+        # الدعم والمقاومة
+        if bars >= 20:
+            indicators['resistance'] = values['resistance']
+            indicators['support'] = values['support']
+        
+        # معلومات السعر الحالي
+        indicators['current_price'] = close
+        prev_close = values['prev_close']
+        indicators['price_change_pct'] = ((close - prev_close) / prev_close * 100) if prev_close else 0
+        
+        # تحديد الاتجاه العام
+        trend_signals = []
+        if 'ma_10' in indicators and 'ma_20' in indicators:
+            if indicators['ma_10'] > indicators['ma_20']:
+                trend_signals.append('صعود')
+            else:
+                trend_signals.append('هبوط')
+        
+        if 'rsi' in indicators:
+            if indicators['rsi'] > 50:
+                trend_signals.append('صعود')
+            else:
+                trend_signals.append('هبوط')
+        
+        # تحديد الاتجاه الغالب
+        if trend_signals.count('صعود') > trend_signals.count('هبوط'):
+            indicators['overall_trend'] = 'صاعد'
+        elif trend_signals.count('هبوط') > trend_signals.count('صعود'):
+            indicators['overall_trend'] = 'هابط'
+        else:
+            indicators['overall_trend'] = 'محايد'
+        
+        return indicators
+
+# إنشاء مثيل مدير MT5
+mt5_manager = MT5Manager()
+
+# ===== محدد معدل Gemini وتنفيذ التحليلات بالتوازي =====
+GEMINI_MAX_CONCURRENCY = int(os.environ.get('TBOT_GEMINI_CONCURRENCY', '4'))  # أقصى عدد طلبات متزامنة
+GEMINI_RPM_LIMIT = int(os.environ.get('TBOT_GEMINI_RPM', '60'))  # طلبات في الدقيقة
+GEMINI_TPM_LIMIT = int(os.environ.get('TBOT_GEMINI_TPM', '250000'))  # توكنات في الدقيقة
+GEMINI_CALL_TIMEOUT = float(os.environ.get('TBOT_GEMINI_TIMEOUT', '60'))  # ثوان - مهلة الطلب الواحد شاملة الانتظار في المحدد
+GEMINI_CHARS_PER_TOKEN = 3  # تقدير التوكنات قبل الإرسال (النص العربي أكثف من الإنجليزي)
+GEMINI_EXPECTED_OUTPUT_TOKENS = 1500  # حجز مبدئي لتوكنات الرد
+GEMINI_RESULT_GRACE = 5  # ثوان - هامش فوق مهلة الطلب قبل اعتبار التحليل الجاري منتهي المهلة
+
+class TokenBucketLimiter:
+    """دلوان (طلبات وتوكنات) يمتلئان بشكل مستمر بالدقيقة - الانتظار حتى يتوفر الاثنان أو تنتهي المهلة"""
+    
+    def __init__(self, requests_per_minute: int = GEMINI_RPM_LIMIT, tokens_per_minute: int = GEMINI_TPM_LIMIT):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._condition = threading.Condition()
+        self.throttled = 0  # طلبات انتظرت المحدد
+        self.rejected = 0  # طلبات انتهت مهلتها قبل السماح
+    
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60)
+        self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60)
+    
+    def acquire(self, tokens: int, timeout: float = None) -> bool:
+        """حجز طلب واحد وعدد توكنات تقديري - False إذا انتهت المهلة قبل توفرهما"""
+        tokens = min(tokens, self.tokens_per_minute)  # طلب أكبر من الدلو كاملاً ينتظر امتلاءه فقط
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._condition:
+            waited = False
+            while True:
+                self._refill()
+                if self._requests >= 1 and self._tokens >= tokens:
+                    self._requests -= 1
+                    self._tokens -= tokens
+                    if waited:
+                        self.throttled += 1
+                    return True
+                
+                # الوقت حتى يكفي الدلوان
+                need_requests = max(0.0, 1 - self._requests) * 60 / self.requests_per_minute
+                need_tokens = max(0.0, tokens - self._tokens) * 60 / self.tokens_per_minute
+                wait = max(need_requests, need_tokens, 0.01)
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or wait > remaining:
+                        self.rejected += 1
+                        return False
+                    wait = min(wait, remaining)
+                waited = True
+                self._condition.wait(wait)
+    
+    def settle(self, reserved: int, actual: int):
+        """تصحيح دلو التوكنات بالاستهلاك الفعلي بعد الرد"""
+        if actual is None:
+            return
+        with self._condition:
+            self._refill()
+            self._tokens = min(self.tokens_per_minute, self._tokens + reserved - actual)
+            self._condition.notify_all()
+    
+    def stats(self) -> Dict:
+        with self._condition:
+            self._refill()
+            return {
+                'requests_available': self._requests,
+                'tokens_available': self._tokens,
+                'throttled': self.throttled,
+                'rejected': self.rejected
+            }
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // GEMINI_CHARS_PER_TOKEN + 1
+
+# إنشاء مثيل محدد معدل Gemini
+gemini_limiter = TokenBucketLimiter()
+
+# ===== محاسبة استهلاك Gemini وحاكم الميزانية اليومية =====
+GEMINI_DAILY_TOKEN_BUDGET = int(os.environ.get('TBOT_GEMINI_DAILY_TOKENS', '0'))  # 0 = بدون حد
+GEMINI_MONITORING_BUDGET_SHARE = float(os.environ.get('TBOT_GEMINI_MONITORING_SHARE', '0.8'))  # حصة المراقبة من الميزانية قبل إيقافها
+GEMINI_INPUT_PRICE_PER_M = float(os.environ.get('TBOT_GEMINI_INPUT_PRICE', '0.30'))  # دولار لكل مليون توكن إدخال
+GEMINI_OUTPUT_PRICE_PER_M = float(os.environ.get('TBOT_GEMINI_OUTPUT_PRICE', '2.50'))  # دولار لكل مليون توكن إخراج (شامل التفكير)
+GEMINI_USAGE_HOURS_KEPT = 48
+
+class GeminiBudgetExceeded(Exception):
+    """طلب مراقبة مرفوض لأن استهلاك اليوم تجاوز حصة المراقبة من الميزانية"""
+
+def is_monitoring_call() -> bool:
+    """طلبات حلقة المراقبة (وخيوط Gemini التي ورثت أولويتها) منخفضة الأولوية - الباقي طلبات يدوية من المستخدمين"""
+    return get_thread_mt5_priority() >= MT5_PRIORITY_MONITORING
+
+def _new_usage_bucket() -> Dict:
+    return {'calls': 0, 'prompt_tokens': 0, 'output_tokens': 0, 'cost': 0.0, 'latency': 0.0, 'errors': 0}
+
+class GeminiUsageTracker:
+    """تسجيل توكنات وزمن ونتيجة كل طلب Gemini مجمعة حسب الرمز والمستخدم والساعة مع ميزانية يومية"""
+    
+    def __init__(self, daily_budget: int = GEMINI_DAILY_TOKEN_BUDGET, monitoring_share: float = GEMINI_MONITORING_BUDGET_SHARE):
+        self.daily_budget = daily_budget
+        self.monitoring_share = monitoring_share
+        self._lock = threading.Lock()
+        self.by_symbol = defaultdict(_new_usage_bucket)
+        self.by_user = defaultdict(_new_usage_bucket)
+        self.by_hour = defaultdict(_new_usage_bucket)  # {'YYYY-MM-DD HH': bucket}
+        self.outcomes = defaultdict(int)
+        self._day = None
+        self.day_tokens = 0
+        self.shed = 0
+    
+    def _roll_day(self):
+        today = datetime.now().strftime('%Y-%m-%d')
+        if today != self._day:
+            self._day = today
+            self.day_tokens = 0
+    
+    def allow(self, monitoring: bool = None) -> bool:
+        """هل يسمح بطلب جديد؟ المراقبة تتوقف عند حصتها من الميزانية - الطلبات اليدوية لا تتوقف"""
+        if monitoring is None:
+            monitoring = is_monitoring_call()
+        if not self.daily_budget or not monitoring:
+            return True
+        with self._lock:
+            self._roll_day()
+            if self.day_tokens < self.daily_budget * self.monitoring_share:
+                return True
+            self.shed += 1
+            return False
+    
+    def record(self, kind: str, symbols: List[str], users: List[int], prompt_tokens: int, output_tokens: int,
+               latency: float, outcome: str):
+        """تسجيل طلب واحد - طلب الدفعة يوزع بالتساوي على رموزه ومستخدميه"""
+        cost = (prompt_tokens * GEMINI_INPUT_PRICE_PER_M + output_tokens * GEMINI_OUTPUT_PRICE_PER_M) / 1_000_000
+        hour = datetime.now().strftime('%Y-%m-%d %H')
+        with self._lock:
+            self._roll_day()
+            before = self.day_tokens
+            self.day_tokens += prompt_tokens + output_tokens
+            crossed = self.daily_budget and before < self.daily_budget * self.monitoring_share <= self.day_tokens
+            self.outcomes[f"{kind}:{outcome}"] += 1
+            targets = [(self.by_hour, [hour])]
+            targets.append((self.by_symbol, list(symbols) or [kind]))
+            targets.append((self.by_user, [user for user in users if user] or ['system']))
+            for table, keys in targets:
+                share = 1 / len(keys)
+                for key in keys:
+                    bucket = table[key]
+                    bucket['calls'] += share
+                    bucket['prompt_tokens'] += prompt_tokens * share
+                    bucket['output_tokens'] += output_tokens * share
+                    bucket['cost'] += cost * share
+                    bucket['latency'] += latency * share
+                    if outcome != 'ok':
+                        bucket['errors'] += share
+            for old_hour in sorted(self.by_hour)[:-GEMINI_USAGE_HOURS_KEPT]:
+                del self.by_hour[old_hour]
+        
+        if crossed:
+            logger.warning(f"[BUDGET] استهلاك Gemini اليوم {self.day_tokens:,} / {self.daily_budget:,} توكن - إيقاف تحليلات المراقبة والإبقاء على الطلبات اليدوية")
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            self._roll_day()
+            hour = self.by_hour.get(datetime.now().strftime('%Y-%m-%d %H'), _new_usage_bucket())
+            return {
+                'day_tokens': self.day_tokens,
+                'daily_budget': self.daily_budget,
+                'shed': self.shed,
+                'outcomes': dict(self.outcomes),
+                'hour': dict(hour),
+                'top_symbols': sorted(((symbol, round(bucket['cost'], 4)) for symbol, bucket in self.by_symbol.items()),
+                                      key=lambda item: -item[1])[:5]
+            }
+
+# إنشاء مثيل محاسبة استهلاك Gemini
+gemini_usage = GeminiUsageTracker()
+
+# ===== كاش نتائج تحليل Gemini =====
+ANALYSIS_CACHE_TTL = float(os.environ.get('TBOT_ANALYSIS_CACHE_TTL', '900'))  # ثوان - شمعة M15 واحدة
+ANALYSIS_CACHE_MAX_MOVE_PCT = float(os.environ.get('TBOT_ANALYSIS_CACHE_MAX_MOVE_PCT', '0.3'))  # حركة سعر تلغي التحليلات المحفوظة
+ANALYSIS_CACHE_SIZE = 512
+ANALYSIS_RSI_STEP = 5  # تكميم RSI إلى مناطق بعرض 5 نقاط
+ANALYSIS_STOCH_STEP = 10
+ANALYSIS_VOLUME_STEP = 0.5
+
+def _quantize(value, step: float) -> Optional[int]:
+    if value is None or pd.isna(value):
+        return None
+    return int(math.floor(value / step))
+
+def _sign(value) -> int:
+    if value is None or pd.isna(value):
+        return 0
+    return (value > 0) - (value < 0)
+
+def indicator_fingerprint(indicators: Dict) -> Tuple:
+    """بصمة مكممة للمؤشرات: التغيرات الصغيرة داخل نفس المنطقة لا تغير البصمة"""
+    macd = indicators.get('macd') or {}
+    stochastic = indicators.get('stochastic') or {}
+    return (
+        _quantize(indicators.get('rsi'), ANALYSIS_RSI_STEP),
+        _sign(macd.get('histogram')),
+        _sign(macd.get('macd')),
+        _quantize(stochastic.get('k'), ANALYSIS_STOCH_STEP),
+        _quantize(indicators.get('volume_ratio'), ANALYSIS_VOLUME_STEP),
+        indicators.get('bollinger_interpretation'),
+        indicators.get('overall_trend'),
+    )
+
+class AnalysisCache:
+    """كاش نتائج Gemini بمفتاح (رمز، آخر شمعة، بصمة المؤشرات، نمط التداول) مع مدة صلاحية وإلغاء عند الحركة الكبيرة"""
+    
+    def __init__(self, ttl: float = ANALYSIS_CACHE_TTL, max_move_pct: float = ANALYSIS_CACHE_MAX_MOVE_PCT,
+                 max_size: int = ANALYSIS_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_move_pct = max_move_pct
+        self.max_size = max_size
+        self._entries = OrderedDict()  # {key: (analysis, price, stored_at monotonic)}
+        self._anchors = {}  # {symbol: السعر عند آخر تحليل محفوظ}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+    
+    @staticmethod
+    def make_key(symbol: str, technical_data: Optional[Dict], trading_mode: str) -> Optional[Tuple]:
+        """المفتاح أو None إذا لم تتوفر المؤشرات (لا تخزين بدون بيانات فنية)"""
+        if not technical_data or not technical_data.get('indicators') or technical_data.get('bar_time') is None:
             return None
+        return (symbol, technical_data['bar_time'], indicator_fingerprint(technical_data['indicators']), trading_mode)
     
-    def calculate_technical_indicators(self, symbol: str) -> Optional[Dict]:
-        """حساب المؤشرات الفنية من البيانات التاريخية للرمز"""
-        try:
-            if not self.connected:
-                logger.warning(f"[WARNING] MT5 غير متصل - لا يمكن حساب المؤشرات لـ {symbol}")
-                return None
-            
-            # جلب البيانات التاريخية (100 شمعة للمؤشرات)
-            df = self.get_market_data(symbol, mt5.TIMEFRAME_M15, 100)
-            if df is None or len(df) < 20:
-                logger.warning(f"[WARNING] بيانات غير كافية لحساب المؤشرات لـ {symbol}")
+    def _moved(self, symbol: str, price: float) -> bool:
+        anchor = self._anchors.get(symbol)
+        return bool(anchor and price and abs(price / anchor - 1) * 100 >= self.max_move_pct)
+    
+    def get(self, symbol: str, technical_data: Optional[Dict], trading_mode: str, price: float) -> Optional[Dict]:
+        """التحليل المحفوظ لنفس الحالة أو None"""
+        key = self.make_key(symbol, technical_data, trading_mode)
+        with self._lock:
+            if self._moved(symbol, price):
+                self._invalidate_symbol(symbol)
+                self.invalidations += 1
+                logger.info(f"[CACHE] حركة سعر كبيرة لـ {symbol} - إلغاء التحليلات المحفوظة")
+            
+            entry = self._entries.get(key) if key is not None else None
+            if entry is None or time.monotonic() - entry[2] > self.ttl:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
                 return None
             
-            indicators = {}
-            
-            # المتوسطات المتحركة
-            if len(df) >= 10:
-                indicators['ma_10'] = ta.trend.sma_indicator(df['close'], window=10).iloc[-1]
-            if len(df) >= 20:
-                indicators['ma_20'] = ta.trend.sma_indicator(df['close'], window=20).iloc[-1]
-            if len(df) >= 50:
-                indicators['ma_50'] = ta.trend.sma_indicator(df['close'], window=50).iloc[-1]
-            
-            # RSI
-            if len(df) >= 14:
-                indicators['rsi'] = ta.momentum.rsi(df['close'], window=14).iloc[-1]
-                
-                # تفسير RSI
-                if indicators['rsi'] > 70:
-                    indicators['rsi_interpretation'] = 'ذروة شراء'
-                elif indicators['rsi'] < 30:
-                    indicators['rsi_interpretation'] = 'ذروة بيع'
-                else:
-                    indicators['rsi_interpretation'] = 'محايد'
-            
-            # MACD
-            if len(df) >= 26:
-                macd_line = ta.trend.macd(df['close'])
-                macd_signal = ta.trend.macd_signal(df['close'])
-                macd_histogram = ta.trend.macd_diff(df['close'])
-                
-                indicators['macd'] = {
-                    'macd': macd_line.iloc[-1] if not pd.isna(macd_line.iloc[-1]) else 0,
-                    'signal': macd_signal.iloc[-1] if not pd.isna(macd_signal.iloc[-1]) else 0,
-                    'histogram': macd_histogram.iloc[-1] if not pd.isna(macd_histogram.iloc[-1]) else 0
-                }
-                
-                # تفسير MACD
-                if indicators['macd']['macd'] > indicators['macd']['signal']:
-                    indicators['macd_interpretation'] = 'إشارة صعود'
-                elif indicators['macd']['macd'] < indicators['macd']['signal']:
-                    indicators['macd_interpretation'] = 'إشارة هبوط'
-                else:
-                    indicators['macd_interpretation'] = 'محايد'
-            
-            # حجم التداول
-            indicators['current_volume'] = df['tick_volume'].iloc[-1]
-            if len(df) >= 20:
-                indicators['avg_volume'] = df['tick_volume'].rolling(window=20).mean().iloc[-1]
-                indicators['volume_ratio'] = indicators['current_volume'] / indicators['avg_volume']
-                
-                if indicators['volume_ratio'] > 1.5:
-                    indicators['volume_interpretation'] = 'حجم عالي'
-                elif indicators['volume_ratio'] < 0.5:
-                    indicators['volume_interpretation'] = 'حجم منخفض'
-                else:
-                    indicators['volume_interpretation'] = 'حجم طبيعي'
-            
-            # Stochastic
-            if len(df) >= 14:
-                stoch_k = ta.momentum.stoch(df['high'], df['low'], df['close'])
-                stoch_d = ta.momentum.stoch_signal(df['high'], df['low'], df['close'])
-                
-                indicators['stochastic'] = {
-                    'k': stoch_k.iloc[-1] if not pd.isna(stoch_k.iloc[-1]) else 50,
-                    'd': stoch_d.iloc[-1] if not pd.isna(stoch_d.iloc[-1]) else 50
-                }
-            
-            # البولنجر باندز
-            if len(df) >= 20:
-                bollinger_high = ta.volatility.bollinger_hband(df['close'])
-                bollinger_low = ta.volatility.bollinger_lband(df['close'])
-                bollinger_mid = ta.volatility.bollinger_mavg(df['close'])
-                
-                indicators['bollinger'] = {
-                    'upper': bollinger_high.iloc[-1] if not pd.isna(bollinger_high.iloc[-1]) else df['close'].iloc[-1] * 1.02,
-                    'middle': bollinger_mid.iloc[-1] if not pd.isna(bollinger_mid.iloc[-1]) else df['close'].iloc[-1],
-                    'lower': bollinger_low.iloc[-1] if not pd.isna(bollinger_low.iloc[-1]) else df['close'].iloc[-1] * 0.98
-                }
-                
-                # تفسير البولنجر باندز
-                current_price = df['close'].iloc[-1]
-                if current_price > indicators['bollinger']['upper']:
-                    indicators['bollinger_interpretation'] = 'فوق النطاق العلوي - إشارة بيع محتملة'
-                elif current_price < indicators['bollinger']['lower']:
-                    indicators['bollinger_interpretation'] = 'تحت النطاق السفلي - إشارة شراء محتملة'
-                else:
-                    indicators['bollinger_interpretation'] = 'ضمن النطاق - حركة طبيعية'
-            
-            # الدعم والمقاومة
-            if len(df) >= 20:
-                indicators['resistance'] = df['high'].rolling(window=20).max().iloc[-1]
-                indicators['support'] = df['low'].rolling(window=20).min().iloc[-1]
-            
-            # معلومات السعر الحالي
-            indicators['current_price'] = df['close'].iloc[-1]
-            indicators['price_change_pct'] = ((df['close'].iloc[-1] - df['close'].iloc[-2]) / df['close'].iloc[-2] * 100) if len(df) >= 2 else 0
-            
-            # تحديد الاتجاه العام
-            trend_signals = []
-            if 'ma_10' in indicators and 'ma_20' in indicators:
-                if indicators['ma_10'] > indicators['ma_20']:
-                    trend_signals.append('صعود')
-                else:
-                    trend_signals.append('هبوط')
-            
-            if 'rsi' in indicators:
-                if indicators['rsi'] > 50:
-                    trend_signals.append('صعود')
-                else:
-                    trend_signals.append('هبوط')
-            
-            # تحديد الاتجاه الغالب
-            if trend_signals.count('صعود') > trend_signals.count('هبوط'):
-                indicators['overall_trend'] = 'صاعد'
-            elif trend_signals.count('هبوط') > trend_signals.count('صعود'):
-                indicators['overall_trend'] = 'هابط'
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+    
+    def put(self, symbol: str, technical_data: Optional[Dict], trading_mode: str, price: float, analysis: Dict):
+        """حفظ تحليل ناجح (التحليل الاحتياطي لا يحفظ)"""
+        key = self.make_key(symbol, technical_data, trading_mode)
+        if key is None or not analysis or analysis.get('source') == 'Fallback Analysis':
+            return
+        with self._lock:
+            self._entries[key] = (analysis, price, time.monotonic())
+            self._entries.move_to_end(key)
+            if price:
+                self._anchors[symbol] = price
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+    
+    def _invalidate_symbol(self, symbol: str):
+        for key in [key for key in self._entries if key[0] == symbol]:
+            del self._entries[key]
+        self._anchors.pop(symbol, None)
+    
+    def invalidate(self, symbol: str = None):
+        """مسح تحليلات رمز معين أو الكاش بالكامل"""
+        with self._lock:
+            if symbol is None:
+                self._entries.clear()
+                self._anchors.clear()
             else:
-                indicators['overall_trend'] = 'محايد'
-            
-            logger.info(f"[OK] تم حساب المؤشرات الفنية لـ {symbol} - الاتجاه: {indicators['overall_trend']}")
-            
+                self._invalidate_symbol(symbol)
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
             return {
-                'symbol': symbol,
-                'indicators': indicators,
-                'calculated_at': datetime.now(),
-                'data_points': len(df)
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits / total * 100) if total else 0.0,
+                'invalidations': self.invalidations,
+                'size': len(self._entries)
             }
-            
-        except Exception as e:
-            logger.error(f"[ERROR] خطأ في حساب المؤشرات الفنية لـ {symbol}: {e}")
+
+# إنشاء مثيل كاش التحليلات
+analysis_cache = AnalysisCache()
+
+# ===== بوابة التغير الجوهري قبل تحليل Gemini =====
+CHANGE_GATE_ENABLED = os.environ.get('TBOT_CHANGE_GATE', '1') == '1'
+CHANGE_GATE_RSI_LEVELS = (30, 50, 70)  # عبور أي مستوى = تغير جوهري
+CHANGE_GATE_SR_PROXIMITY_PCT = 0.15  # % - الاقتراب من الدعم أو المقاومة
+CHANGE_GATE_VOLUME_SPIKE = 1.5  # نسبة الحجم إلى متوسطه
+CHANGE_GATE_MAX_AGE = 1800  # ثوان - إعادة التحليل دورياً حتى بدون تغير
+
+class MaterialChangeGate:
+    """يقارن متجه المؤشرات الحالي بالمتجه المستخدم في آخر تحليل لكل (رمز، نمط تداول) ويمرر فقط ما عبر عتبة"""
+    
+    def __init__(self, enabled: bool = CHANGE_GATE_ENABLED, rsi_levels=CHANGE_GATE_RSI_LEVELS,
+                 sr_proximity_pct: float = CHANGE_GATE_SR_PROXIMITY_PCT,
+                 volume_spike: float = CHANGE_GATE_VOLUME_SPIKE, max_age: float = CHANGE_GATE_MAX_AGE):
+        self.enabled = enabled
+        self.rsi_levels = tuple(sorted(rsi_levels))
+        self.sr_proximity_pct = sr_proximity_pct
+        self.volume_spike = volume_spike
+        self.max_age = max_age
+        self._last = {}  # {(symbol, trading_mode): (state, users, analyzed_at monotonic)}
+        self._lock = threading.Lock()
+        self.passed = {}  # {reason: count}
+        self.skipped = {}  # {reason: count}
+        self.last_decision = {}  # {(symbol, trading_mode): (passed, reason)}
+    
+    def _state(self, technical_data: Optional[Dict], price: float) -> Optional[Dict]:
+        """المتجه المختصر للمقارنة: مناطق وإشارات وليس قيماً خاماً"""
+        indicators = (technical_data or {}).get('indicators')
+        if not indicators or not price:
             return None
+        
+        rsi = indicators.get('rsi')
+        macd = indicators.get('macd') or {}
+        bollinger = indicators.get('bollinger') or {}
+        band = 0
+        if bollinger.get('upper') and price > bollinger['upper']:
+            band = 1
+        elif bollinger.get('lower') and price < bollinger['lower']:
+            band = -1
+        
+        near_level = False
+        for level in (indicators.get('support'), indicators.get('resistance')):
+            if level and abs(price / level - 1) * 100 <= self.sr_proximity_pct:
+                near_level = True
+        
+        volume_ratio = indicators.get('volume_ratio')
+        return {
+            'bar_time': (technical_data or {}).get('bar_time'),
+            'rsi_zone': bisect.bisect(self.rsi_levels, rsi) if rsi is not None and not pd.isna(rsi) else None,
+            'macd_sign': _sign(macd.get('histogram')),
+            'band': band,
+            'near_level': near_level,
+            'volume_spike': bool(volume_ratio and volume_ratio >= self.volume_spike),
+        }
+    
+    def check(self, symbol: str, technical_data: Optional[Dict], price: float, users=(),
+              trading_mode: str = None) -> Tuple[bool, str]:
+        """(يمرر؟، السبب) - التخطي يعني أن آخر تحليل لهذا النمط ما زال يمثل حالة الرمز"""
+        if not self.enabled:
+            return True, 'disabled'
+        
+        state = self._state(technical_data, price)
+        with self._lock:
+            last = self._last.get((symbol, trading_mode))
+        
+        if state is None:
+            decision = (True, 'no_indicators')
+        elif last is None:
+            decision = (True, 'first_analysis')
+        else:
+            previous, analyzed_users, analyzed_at = last
+            if set(users) - analyzed_users:
+                decision = (True, 'new_subscribers')
+            elif time.monotonic() - analyzed_at > self.max_age:
+                decision = (True, 'max_age')
+            elif state['rsi_zone'] != previous['rsi_zone']:
+                decision = (True, 'rsi_zone')
+            elif state['macd_sign'] != previous['macd_sign']:
+                decision = (True, 'macd_flip')
+            elif state['band'] != previous['band']:
+                decision = (True, 'band_break')
+            elif state['near_level'] and not previous['near_level']:
+                decision = (True, 'sr_proximity')
+            elif state['volume_spike'] and not previous['volume_spike']:
+                decision = (True, 'volume_spike')
+            elif state['bar_time'] == previous['bar_time']:
+                decision = (False, 'same_bar')
+            else:
+                decision = (False, 'below_thresholds')
+        
+        with self._lock:
+            counters = self.passed if decision[0] else self.skipped
+            counters[decision[1]] = counters.get(decision[1], 0) + 1
+            self.last_decision[(symbol, trading_mode)] = decision
+        return decision
+    
+    def record(self, symbol: str, technical_data: Optional[Dict], price: float, users=(),
+               trading_mode: str = None):
+        """تسجيل المتجه المستخدم في التحليل الأخير للرمز ومشتركي هذا النمط الذين استلموه"""
+        state = self._state(technical_data, price)
+        if state is None:
+            return
+        with self._lock:
+            self._last[(symbol, trading_mode)] = (state, set(users), time.monotonic())
+    
+    def reset(self, symbol: str = None):
+        with self._lock:
+            if symbol is None:
+                self._last.clear()
+            else:
+                for key in [key for key in self._last if key[0] == symbol]:
+                    del self._last[key]
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'passed': dict(self.passed),
+                'skipped': dict(self.skipped),
+                'skipped_total': sum(self.skipped.values()),
+                'passed_total': sum(self.passed.values()),
+                'last_skips': {'/'.join(filter(None, key)): reason
+                               for key, (passed, reason) in self.last_decision.items() if not passed}
+            }
 
-# إنشاء مثيل مدير MT5
-mt5_manager = MT5Manager()
+# إنشاء مثيل بوابة التغير الجوهري
+change_gate = MaterialChangeGate()
+
+# ===== تعليمات تحليل Gemini الثابتة =====
+GEMINI_BATCH_SIZE = max(1, int(os.environ.get('TBOT_GEMINI_BATCH_SIZE', '4')))  # رموز في الطلب الواحد - 1 يلغي التجميع
+
+# منهجية التحليل (STEP 1-5) - ثابتة لكل الطلبات ولا تعتمد على الرمز أو المستخدم
+GEMINI_ANALYSIS_INSTRUCTIONS = """
+=== تعليمات التحليل المتقدم ===
+
+🔶 أنت الآن خبير تداول محترف بخبرة تفوق 20 عامًا في الأسواق المالية العالمية. هدفك تقديم تحليل عميق ومتقدم جدًا بناءً على منهج علمي ومنظم، قائم على معايير كمية دقيقة وشفافية كاملة في الحسابات.
+
+⚠️ **قاعدة مهمة:** لا تقدم أي توصية إلا إذا تجاوزت نسبة النجاح المحسوبة 80% بناءً على معايير كمية فقط (لا حدس أو افتراضات).
+
+📋 **متطلبات الجودة الاحترافية:**
+- استخدم معايير كمية فقط في القرار
+- لا تكتب جمل عامة مثل "قد يصعد السعر" أو "يوجد احتمال"
+- استخدم لغة تحليلية صارمة ومنظمة فقط
+- إذا لم توجد صفقة قوية، قل بوضوح: "لا توجد صفقة ناجحة بنسبة 80% أو أكثر حالياً"
+
+## 🔍 STEP 1: التحليل الفني المتعمق والمتقدم
+قيّم كل مؤشر بدقة وأعطِ نقاط من 10، واستخدم المؤشرات التالية:
+
+**📊 المؤشرات الأساسية:** RSI, MACD, Moving Averages (EMA, SMA), Bollinger Bands, Volume Profile, ATR
+**📈 تحليل متعدد الأطر:** حدد الاتجاه العام عبر أطر زمنية متعددة (سكالبينغ، قصير، متوسط)
+**🎯 نقاط حساسة:** ارصد مناطق الانعكاس، التشبع، الاختراقات الحقيقية، والمناطق الحساسة
+**📋 سلوك السعر:** افحص سلوك السعر عند مستويات رئيسية (عرض وطلب، دعم ومقاومة)
+
+**أ) مؤشر RSI:**
+- إذا RSI 20-30: نقاط الشراء = 9/10 (ذروة بيع قوية)
+- إذا RSI 30-50: نقاط الشراء = 7/10 (منطقة جيدة)  
+- إذا RSI 50-70: نقاط البيع = 7/10 (منطقة جيدة للبيع)
+- إذا RSI 70-80: نقاط البيع = 9/10 (ذروة شراء قوية)
+- إذا RSI 40-60: نقاط = 4/10 (منطقة محايدة)
+
+**ب) مؤشر MACD:**
+- MACD فوق Signal + موجب: نقاط الشراء = 8/10
+- MACD فوق Signal + سالب: نقاط الشراء = 6/10  
+- MACD تحت Signal + موجب: نقاط البيع = 6/10
+- MACD تحت Signal + سالب: نقاط البيع = 8/10
+- تقاطع حديث: نقاط إضافية = +2
+
+**ج) المتوسطات المتحركة:**
+- السعر فوق MA10 > MA20 > MA50: نقاط الشراء = 9/10
+- السعر تحت MA10 < MA20 < MA50: نقاط البيع = 9/10
+- ترتيب مختلط: نقاط = 3-5/10 حسب القوة
+
+**د) مستويات الدعم والمقاومة:**
+- قرب مستوى دعم قوي: نقاط الشراء = +3
+- قرب مستوى مقاومة قوية: نقاط البيع = +3
+- كسر مستوى بحجم عالي: نقاط = +4
+
+**هـ) تحليل الشموع اليابانية (إن توفرت):**
+- نماذج انعكاسية قوية: +2 نقاط
+- نماذج استمرارية: +1 نقطة
+- تأكيد النموذج بالحجم: +1 نقطة إضافية
+
+**و) تحليل الـ ATR والتقلبات:**
+- ATR منخفض = استقرار: +1 نقطة
+- ATR مرتفع جداً = مخاطرة: -2 نقاط
+
+## 🔍 STEP 2: تحليل ظروف السوق
+
+**أ) حجم التداول:**
+- حجم > 150% من المتوسط: قوة إضافية = +15%
+- حجم 120-150% من المتوسط: قوة إضافية = +10%  
+- حجم 80-120% من المتوسط: طبيعي = 0%
+- حجم < 80% من المتوسط: ضعف = -10%
+
+**ب) التقلبات (Volatility):**
+- تقلبات منخفضة: استقرار = +5%
+- تقلبات معتدلة: مثالية = +10%
+- تقلبات عالية: مخاطرة = -15%
+
+## 🔍 STEP 3: تحليل المخاطر والفرص
+
+**عوامل الخطر (تقلل النسبة):**
+- تضارب في المؤشرات: -10% لكل تضارب
+- أخبار سلبية متوقعة: -15%
+- عدم استقرار الأسواق العالمية: -10%
+- اقتراب من نهاية جلسة التداول: -5%
+
+**عوامل الفرص (تزيد النسبة):**
+- جميع المؤشرات متفقة: +20%
+- كسر مستوى مهم بحجم عالي: +15%
+- أخبار إيجابية داعمة: +10%
+- توقيت مثالي (بداية الجلسة): +5%
+
+## 🔍 STEP 4: معايرة حسب نمط التداول
+
+**للسكالبينغ (مضاعف دقة):**
+- RSI + MACD متفقان: مضاعف x1.2
+- حجم تداول عالي: مضاعف x1.15
+- تقلبات منخفضة: مضاعف x1.1
+- وقت ذروة السوق: مضاعف x1.05
+
+**للتداول طويل المدى (مضاعف اتجاه):**
+- اتجاه قوي على عدة إطارات: مضاعف x1.3
+- اختراق مستويات مهمة: مضاعف x1.2  
+- دعم أساسيات اقتصادية: مضاعف x1.15
+
+## 🔍 STEP 5: الحساب النهائي لنسبة النجاح
+
+**الصيغة الحسابية:**
+```
+النقاط الأساسية = (مجموع نقاط المؤشرات ÷ عدد المؤشرات) × 10
+
+النسبة المعدلة = النقاط الأساسية 
+               + تعديل حجم التداول
+               + تعديل التقلبات  
+               + عوامل الفرص
+               - عوامل المخاطر
+
+النسبة النهائية = النسبة المعدلة × مضاعف نمط التداول
+```
+
+**قواعد مهمة:**
+- النسبة النهائية يجب أن تكون بين 10% و 95%
+- إذا كانت المؤشرات متضاربة بشدة: الحد الأقصى 45%
+- إذا كانت جميع المؤشرات متفقة: الحد الأدنى 60%
+- للمبتدئين: تقليل النسبة بـ 10%
+- للخبراء: زيادة النسبة بـ 5%
+
+## 📊 متطلبات النتيجة النهائية (شفافية كاملة):
+
+1. **التحليل التفصيلي:** اعرض نقاط كل مؤشر وتبريرك بناءً على إشارات واضحة
+2. **حساب النسبة خطوة بخطوة:** أظهر العملية الحسابية الكاملة والشفافة
+3. **التوصية المحددة:** حدد نوع الصفقة (شراء/بيع)، نقطة الدخول المثلى، الأهداف (TP1/TP2)، وقف الخسارة (SL)
+4. **تقييم نسبة العائد/المخاطرة:** احسب Risk/Reward Ratio بدقة
+5. **إدارة المخاطر المتقدمة:** اقترح حجم الصفقة (Lot Size) وحساب الخسارة المحتملة بالنقاط
+6. **تحليل التباين:** لا تتجاهل التباين بين المؤشرات (مثلاً: تقاطع سلبي في MACD مع RSI صاعد)
+7. **نسبة النجاح النهائية المبررة:** بصيغة "نسبة نجاح الصفقة: X%" مع التبرير الكامل
+
+## ⚠️ تحذيرات مهمة وقواعد المصداقية:
+
+**قواعد الدقة والمصداقية (معايير احترافية صارمة):**
+- لا تبالغ بالتفاؤل: إذا كانت الصفقة محفوفة بالمخاطر، اذكر ذلك صراحة
+- استبعد أي صفقة لا تستوفي الشروط الحسابية الدقيقة
+- لا تتردد في إعطاء نسب منخفضة (15-35%) إذا كانت الإشارات ضعيفة
+- لا تتجاوز 90% إلا في حالات الإشارات القوية جداً والنادرة مع توافق جميع المؤشرات
+- إذا كانت البيانات ناقصة أو غير موثوقة: الحد الأقصى 50%
+- إذا كان هناك تضارب شديد في المؤشرات: 20-40% فقط
+- للمؤشرات المتفقة بقوة مع دعم الأخبار ودون تباين: 75-90%
+- تذكر: أنك تعمل ضمن غرفة تداول احترافية ولا يقل تحليلك جودة عن كبار المتداولين والمؤسسات
+
+**أمثلة على نسب صحيحة:**
+- إشارة ضعيفة مع تضارب: "نسبة نجاح الصفقة: 28%" 
+- إشارة متوسطة: "نسبة نجاح الصفقة: 54%"
+- إشارة قوية مع دعم أخبار: "نسبة نجاح الصفقة: 83%"
+- إشارة ممتازة نادرة: "نسبة نجاح الصفقة: 91%"
+
+**التحقق النهائي قبل الإجابة:**
+1. هل نسبة النجاح تعكس حقاً قوة/ضعف التحليل؟
+2. هل أخذت جميع المخاطر في الاعتبار؟
+3. هل النسبة منطقية مقارنة بظروف السوق؟
+4. هل يمكنني الدفاع عن هذه النسبة بالأرقام والمؤشرات؟
+
+## 🎯 التحذير النهائي والالتزام الاحترافي:
+
+**❌ لا تقدم أي توصية إلا إذا:**
+- تجاوزت نسبة النجاح المحسوبة 80% بناءً على معايير كمية
+- توفرت كل شروط الدخول والربح الواضحة
+- لم يوجد تباين خطير بين المؤشرات
+
+**✅ إذا لم تستوف الشروط أعلاه، قل:**
+"لا توجد صفقة ناجحة بنسبة 80% أو أكثر حالياً"
+
+**🔥 تذكر:** أنت تعمل كخبير احترافي في غرفة تداول مؤسسية. المصداقية والدقة أهم من التفاؤل. المتداول يعتمد على تحليلك في اتخاذ قرارات مالية مهمة جداً!
+"""
+
+# نص التعليمات الكامل يرسل مرة واحدة كتعليمات نظام لنموذج التحليل - الطلبات تحمل البيانات المتغيرة فقط
+GEMINI_SYSTEM_INSTRUCTION = "أنت محلل مالي خبير متخصص في التداول.\n" + GEMINI_ANALYSIS_INSTRUCTIONS
+GEMINI_SYSTEM_INSTRUCTION_TOKENS = estimate_tokens(GEMINI_SYSTEM_INSTRUCTION)
+
+# أجزاء الطلب المجهزة مسبقاً حسب نوع الرمز ونمط التداول
+_SYMBOL_TYPE_CONTEXTS = {
+    'major': """
+**سياق خاص بأزواج العملات الرئيسية:**
+- هذا زوج عملات رئيسي بسيولة عالية وتقلبات معتدلة
+- تأثر قوي بقرارات البنوك المركزية (Fed, ECB, BoE)
+- ساعات التداول النشطة: London + New York overlap
+- عوامل مؤثرة: معدلات الفائدة، التضخم، GDP، البطالة
+- نسبة النجاح المتوقعة أعلى بسبب قابلية التنبؤ النسبية
+""",
+    'metal': """
+**سياق خاص بالمعادن النفيسة:**
+- الذهب/الفضة أصول ملاذ آمن مع تقلبات متوسطة إلى عالية
+- تأثر قوي بالأحداث الجيوسياسية والتضخم
+- علاقة عكسية مع الدولار الأمريكي عادة
+- عوامل مؤثرة: التضخم، أسعار الفائدة، الأزمات العالمية
+- كن حذراً من التحركات المفاجئة خلال الأخبار المهمة
+""",
+    'crypto': """
+**سياق خاص بالعملات الرقمية:**
+- تقلبات عالية جداً مع إمكانية مكاسب/خسائر كبيرة
+- سوق 24/7 مع تأثر قوي بالمشاعر والأخبار
+- تأثر بالتنظيم الحكومي، اعتماد المؤسسات، التطوير التقني
+- عوامل مؤثرة: تصريحات المؤثرين، القرارات التنظيمية، التطوير التقني
+- قلل نسبة النجاح 10-15% بسبب عدم القابلية للتنبؤ
+""",
+    'other': """
+**سياق عام للأصول:**
+- حلل خصائص هذا الرمز والعوامل المؤثرة عليه
+- اعتبر السيولة والتقلبات التاريخية
+- راعِ ساعات التداول النشطة والأحداث الاقتصادية
+""",
+}
+
+_TRADING_MODE_INSTRUCTIONS = {
+    'scalping': """
+تعليمات خاصة للسكالبينغ:
+- ركز على الفرص قصيرة المدى (دقائق إلى ساعات)
+- أهداف ربح صغيرة (1-2%)
+- وقف خسارة ضيق (0.5-1%)
+- تحليل سريع وفوري
+- ثقة عالية مطلوبة (80%+)
+- ركز على التحركات السريعة والمؤشرات قصيرة المدى
+- حجم صفقات أصغر لتقليل المخاطر
+- اهتم بـ RSI و MACD للإشارات السريعة
+""",
+    'longterm': """
+تعليمات خاصة للتداول طويل المدى:
+- ركز على الاتجاهات طويلة المدى (أيام إلى أسابيع)
+- أهداف ربح أكبر (5-10%)
+- وقف خسارة أوسع (2-3%)
+- تحليل شامل ومتأني
+- تحمل تذبذبات أكثر
+- ركز على الاتجاهات الرئيسية والأساسيات
+- حجم صفقات أكبر للاستفادة من الاتجاهات الطويلة
+- اهتم بالمتوسطات المتحركة والدعم والمقاومة
+""",
+}
+
+def _symbol_type_key(symbol: str) -> Optional[str]:
+    if not symbol.endswith('USD'):
+        return None
+    if symbol.startswith(('EUR', 'GBP')):
+        return 'major'
+    if symbol.startswith(('XAU', 'XAG')):
+        return 'metal'
+    if symbol.startswith(('BTC', 'ETH')):
+        return 'crypto'
+    return 'other'
+
+# مخطط الرد المنظم - حقول محددة النوع تقرأ مباشرة بدلاً من البحث في النص
+GEMINI_ANALYSIS_SCHEMA = {
+    'type': 'OBJECT',
+    'properties': {
+        'action': {'type': 'STRING', 'enum': ['BUY', 'SELL', 'HOLD']},
+        'success_rate': {'type': 'NUMBER'},
+        'entry': {'type': 'NUMBER', 'nullable': True},
+        'tp1': {'type': 'NUMBER', 'nullable': True},
+        'tp2': {'type': 'NUMBER', 'nullable': True},
+        'sl': {'type': 'NUMBER', 'nullable': True},
+        'reasoning': {'type': 'STRING'},
+        'analysis': {'type': 'STRING'}
+    },
+    'required': ['action', 'success_rate', 'reasoning', 'analysis']
+}
+GEMINI_BATCH_SCHEMA = {
+    'type': 'ARRAY',
+    'items': {**GEMINI_ANALYSIS_SCHEMA,
+              'properties': {'symbol': {'type': 'STRING'}, **GEMINI_ANALYSIS_SCHEMA['properties']},
+              'required': ['symbol'] + GEMINI_ANALYSIS_SCHEMA['required']}
+}
+
+# صيغة الإجابة المنظمة لطلب رمز واحد
+GEMINI_OUTPUT_FORMAT = """
+=== صيغة الإجابة ===
+أعد كائن JSON حسب المخطط: action (BUY أو SELL أو HOLD)، success_rate (نسبة نجاح الصفقة 10-95)، entry و tp1 و tp2 و sl (أسعار الدخول والأهداف ووقف الخسارة أو null إن لم توجد صفقة)، reasoning (ملخص التبرير في سطرين)، analysis (التحليل الكامل حسب متطلبات النتيجة النهائية، وينتهي بسطر: نسبة نجاح الصفقة: X%)
+"""
+
+# صيغة الإجابة لطلب عدة رموز - مصفوفة JSON بعنصر لكل رمز
+GEMINI_BATCH_OUTPUT_FORMAT = """
+=== صيغة الإجابة (عدة رموز في طلب واحد) ===
+طبّق تعليمات التحليل على كل رمز بشكل مستقل تماماً، ثم أعد مصفوفة JSON بعنصر واحد لكل رمز وبنفس ترتيب الرموز. كل عنصر يحتوي symbol (رمز الأصل كما ورد) وحقول التحليل: action (BUY أو SELL أو HOLD)، success_rate (نسبة نجاح الصفقة 10-95)، entry و tp1 و tp2 و sl (أو null)، reasoning (ملخص التبرير في سطرين)، analysis (التحليل الكامل للرمز، وينتهي بسطر: نسبة نجاح الصفقة: X%)
+"""
 
 # ===== كلاس تحليل Gemini AI =====
 class GeminiAnalyzer:
@@ -973,20 +4004,287 @@ class GeminiAnalyzer:
     
     def __init__(self):
         self.model = None
+        self.analysis_model = None
+        self.limiter = gemini_limiter
+        self.usage = gemini_usage
+        self._stats_lock = threading.Lock()
+        self.response_stats = {'structured': 0, 'regex_fallback': 0}  # كم رد قرئ من الحقول المنظمة وكم احتاج استخراج النص
+        # طلبات Gemini المتزامنة محدودة بعدد خيوط المجمع
+        self.executor = ThreadPoolExecutor(max_workers=GEMINI_MAX_CONCURRENCY, thread_name_prefix="GeminiWorker")
         if GEMINI_AVAILABLE:
             try:
                 self.model = genai.GenerativeModel('gemini-2.5-flash')
+                # نموذج التحليل: منهجية STEP 1-5 ترفق مرة كتعليمات نظام بدلاً من تكرارها في كل طلب
+                self.analysis_model = genai.GenerativeModel('gemini-2.5-flash', system_instruction=GEMINI_SYSTEM_INSTRUCTION)
                 logger.info("[OK] تم تهيئة محلل Gemini بنجاح")
             except Exception as e:
                 logger.error(f"[ERROR] فشل في تهيئة محلل Gemini: {e}")
     
-    def analyze_market_data_with_retry(self, symbol: str, price_data: Dict, user_id: int = None, market_data: pd.DataFrame = None, max_retries: int = 3) -> Dict:
+    def _generate_content(self, prompt: str, timeout: float = GEMINI_CALL_TIMEOUT,
+                          output_tokens: int = GEMINI_EXPECTED_OUTPUT_TOKENS, generation_config: Dict = None,
+                          model=None, kind: str = 'analysis', symbols: List[str] = (), users: List[int] = ()):
+        """استدعاء Gemini عبر الميزانية ومحدد المعدل مع تسجيل التوكنات والزمن - المهلة تشمل الانتظار في المحدد"""
+        model = model or self.model
+        if not self.usage.allow():
+            self.usage.record(kind, symbols, users, 0, 0, 0.0, 'shed')
+            raise GeminiBudgetExceeded(f"ميزانية Gemini اليومية للمراقبة مستنفدة ({self.usage.day_tokens:,} توكن)")
+        
+        requested = time.monotonic()
+        deadline = requested + timeout
+        prompt_estimate = estimate_tokens(prompt)
+        if model is self.analysis_model:
+            prompt_estimate += GEMINI_SYSTEM_INSTRUCTION_TOKENS  # تعليمات النظام تحتسب ضمن توكنات الإدخال
+        reserved = prompt_estimate + output_tokens
+        if not self.limiter.acquire(reserved, timeout):
+            self.usage.record(kind, symbols, users, 0, 0, time.monotonic() - requested, 'throttled')
+            raise TimeoutError("حد معدل Gemini - انتهت المهلة قبل السماح بالطلب")
+        
+        started = time.monotonic()
+        try:
+            response = model.generate_content(prompt, generation_config=generation_config,
+                                              request_options={'timeout': max(1.0, deadline - started)})
+        except Exception:
+            # الطلب الفاشل يحتسب بتقدير الإدخال فقط
+            self.limiter.settle(reserved, prompt_estimate)
+            self.usage.record(kind, symbols, users, prompt_estimate, 0, time.monotonic() - started, 'error')
+            raise
+        latency = time.monotonic() - started
+        
+        usage = getattr(response, 'usage_metadata', None)
+        prompt_tokens = getattr(usage, 'prompt_token_count', None) or prompt_estimate
+        # توكنات التفكير تحتسب ضمن الإخراج
+        response_tokens = (getattr(usage, 'candidates_token_count', None) or 0) + (getattr(usage, 'thoughts_token_count', None) or 0)
+        self.limiter.settle(reserved, getattr(usage, 'total_token_count', None))
+        self.usage.record(kind, symbols, users, prompt_tokens, response_tokens, latency, 'ok')
+        logger.info(f"[GEMINI] {kind} {','.join(symbols) or '-'}: إدخال {prompt_tokens} "
+                    f"(منها من الكاش {getattr(usage, 'cached_content_token_count', 0) or 0}) / "
+                    f"إخراج {response_tokens} - الجزء المتغير {len(prompt)} حرف - {latency:.1f} ث")
+        return response
+    
+    def _generate_analysis(self, payload: str, timeout: float = GEMINI_CALL_TIMEOUT, **kwargs):
+        """إرسال طلب تحليل: البيانات المتغيرة فقط مع نموذج التعليمات الثابتة، أو التعليمات ضمن الطلب إن لم يتوفر"""
+        if self.analysis_model is not None:
+            return self._generate_content(payload, timeout, model=self.analysis_model, kind='analysis', **kwargs)
+        return self._generate_content(GEMINI_SYSTEM_INSTRUCTION + payload, timeout, kind='analysis', **kwargs)
+    
+    def analyze_many(self, jobs: List[Tuple], timeout: float = GEMINI_CALL_TIMEOUT):
+        """تحليل عدة رموز بالتوازي وعلى دفعات - يعيد (job, analysis) فور اكتمال كل تحليل بترتيب الانتهاء
+        
+        jobs: [(symbol, price_data, user_id, technical_data, trading_mode)]
+        """
+        if not jobs:
+            return
+        priority = get_thread_mt5_priority()  # طلبات MT5 من خيوط المجمع بنفس أولوية المستدعي
+        
+        def run(batch, started):
+            started.append(time.monotonic())
+            set_thread_mt5_priority(priority)
+            if len(batch) == 1:
+                symbol, price_data, user_id, technical_data, trading_mode = batch[0]
+                # محاولة واحدة ضمن المهلة - إعادة المحاولة بعد انتهائها تستهلك توكنات لنتيجة لن تنتظر
+                return {symbol: self.analyze_market_data(symbol, price_data, user_id, technical_data=technical_data,
+                                                         trading_mode=trading_mode, timeout=timeout)}
+            return self.analyze_batch(batch, timeout)
+        
+        pending = {}  # {future: (batch, [وقت بدء التنفيذ في المجمع])}
+        
+        def submit(batch):
+            started = []
+            pending[self.executor.submit(run, batch, started)] = (batch, started)
+        
+        # الدفعة من نمط تداول واحد - الرمز لا يتكرر داخلها
+        by_mode = defaultdict(list)
+        for job in jobs:
+            by_mode[job[4]].append(job)
+        for mode_jobs in by_mode.values():
+            for i in range(0, len(mode_jobs), GEMINI_BATCH_SIZE):
+                submit(mode_jobs[i:i + GEMINI_BATCH_SIZE])
+        
+        # مهلة كل طلب تبدأ عند بدء تنفيذه في المجمع (موجة بموجة) - وقت المستهلك بين النتائج لا يحتسب
+        budget = timeout + GEMINI_RESULT_GRACE
+        while pending:
+            now = time.monotonic()
+            deadlines = [started[0] + budget for _, started in pending.values() if started]
+            wait_time = max(0.0, min(deadlines) - now) if deadlines else budget
+            done, _ = wait_futures(pending, timeout=wait_time, return_when=FIRST_COMPLETED)
+            if not done:
+                now = time.monotonic()
+                expired = [future for future, (_, started) in pending.items()
+                           if (started and started[0] + budget <= now) or not deadlines]
+                for future in expired:
+                    batch, _ = pending.pop(future)
+                    future.cancel()
+                    for job in batch:
+                        logger.warning(f"[WARNING] انتهت مهلة تحليل {job[0]}")
+                        yield job, self._fallback_analysis(job[0], job[1])
+                continue
+            for future in done:
+                batch, _ = pending.pop(future)
+                try:
+                    results = future.result()
+                    retry_single = len(batch) > 1
+                except Exception as e:
+                    # فشل الطلب كاملاً (اتصال، مهلة، حد معدل، ميزانية، خطأ API) - N طلبات فردية ستفشل بنفس السبب
+                    logger.error(f"[ERROR] خطأ في تحليل {[job[0] for job in batch]}: {e}")
+                    results = {}
+                    retry_single = False
+                for job in batch:
+                    symbol, price_data = job[:2]
+                    if symbol in results:
+                        yield job, results[symbol]
+                    elif retry_single:
+                        # الرد وصل وتم تفكيكه لكن عنصر هذا الرمز مفقود أو غير صالح - إعادته بطلب فردي
+                        submit([job])
+                    else:
+                        yield job, self._fallback_analysis(symbol, price_data)
+    
+    def analyze_batch(self, jobs: List[Tuple], timeout: float = GEMINI_CALL_TIMEOUT) -> Dict[str, Dict]:
+        """تحليل عدة رموز في طلب Gemini واحد بتعليمات مشتركة - يعيد فقط الرموز التي وصل تحليلها سليماً
+        ويرفع الاستثناء إذا فشل الطلب نفسه أو لم يكن الرد مصفوفة JSON
+        
+        jobs: [(symbol, price_data, user_id, technical_data, trading_mode)]
+        """
+        if not self.model or not jobs:
+            return {}
+        
+        contexts = {}
+        sections = []
+        for index, (symbol, price_data, user_id, technical_data, trading_mode) in enumerate(jobs, 1):
+            market_context, user_context = self._build_market_context(symbol, price_data, user_id, technical_data, trading_mode)
+            contexts[symbol] = user_context
+            sections.append(f"""
+            ### الرمز {index}: {symbol}
+            {market_context}""")
+        
+        symbols = [job[0] for job in jobs]
+        prompt = f"""
+            قم بتحليل كل رمز من الرموز التالية بشكل مستقل ({', '.join(symbols)}):
+            {''.join(sections)}
+            
+            الأنماط المتعلمة من المستخدمين:
+            {self._load_learned_patterns()}
+            
+            {get_analysis_rules_for_prompt()}
+            {GEMINI_BATCH_OUTPUT_FORMAT}
+            """
+        
+        try:
+            response = self._generate_analysis(prompt, timeout, output_tokens=GEMINI_EXPECTED_OUTPUT_TOKENS * len(jobs),
+                                               symbols=symbols, users=[job[2] for job in jobs],
+                                               generation_config={'response_mime_type': 'application/json',
+                                                                  'response_schema': GEMINI_BATCH_SCHEMA})
+            items = self._parse_batch_response(response.text, symbols)
+            if items is None:
+                raise ValueError("رد الدفعة ليس مصفوفة JSON صالحة")
+        except Exception as e:
+            logger.error(f"[ERROR] فشل طلب الدفعة {symbols}: {e}")
+            raise
+        
+        results = {}
+        for symbol, price_data, user_id, technical_data, trading_mode in jobs:
+            item = items.get(symbol)
+            if item is None:
+                continue
+            self._count_response('structured')
+            logger.info(f"[AI_ANALYSIS] {symbol}: التوصية={item['action']}, نسبة النجاح={item['success_rate']:.1f}% (دفعة {len(jobs)} رموز)")
+            results[symbol] = self._build_analysis_result(symbol, price_data, user_id, contexts[symbol],
+                                                          item['analysis'], item['action'], item['success_rate'], item,
+                                                          trading_mode)
+        
+        if len(results) < len(jobs):
+            logger.warning(f"[WARNING] عناصر غير صالحة في رد الدفعة - إعادة فردية لـ {[s for s in symbols if s not in results]}")
+        return results
+    
+    def _parse_batch_response(self, text: str, symbols: List[str]) -> Optional[Dict[str, Dict]]:
+        """تفكيك مصفوفة JSON من رد الدفعة - يتجاهل العناصر الناقصة أو غير الصالحة، وNone إذا لم يكن الرد مصفوفة"""
+        start, end = text.find('['), text.rfind(']')
+        if start == -1 or end <= start:
+            return None
+        try:
+            items = json.loads(text[start:end + 1])
+        except ValueError:
+            return None
+        if not isinstance(items, list):
+            return None
+        
+        parsed = {}
+        for item in items:
+            fields = self._parse_structured_analysis(item)
+            if fields is None:
+                continue
+            symbol = str(item.get('symbol', '')).upper()
+            if symbol in symbols and symbol not in parsed:
+                parsed[symbol] = fields
+        return parsed
+    
+    def _parse_structured_analysis(self, item) -> Optional[Dict]:
+        """قراءة حقول الرد المنظم في مرور واحد - None إذا نقص حقل أساسي أو كان بنوع خاطئ"""
+        if isinstance(item, str):
+            try:
+                item = json.loads(item[item.find('{'):item.rfind('}') + 1])
+            except ValueError:
+                return None
+        if not isinstance(item, dict):
+            return None
+        
+        action = str(item.get('action', '')).upper()
+        analysis = item.get('analysis')
+        try:
+            success_rate = float(item.get('success_rate'))
+        except (TypeError, ValueError):
+            return None
+        if action not in ('BUY', 'SELL', 'HOLD') or not 0 <= success_rate <= 100:
+            return None
+        if not isinstance(analysis, str) or not analysis.strip():
+            return None
+        
+        levels = {}
+        for key in ('entry', 'tp1', 'tp2', 'sl'):
+            value = item.get(key)
+            levels[key] = float(value) if isinstance(value, (int, float)) and value > 0 else None
+        reasoning = item.get('reasoning')
+        return {'action': action, 'success_rate': success_rate, 'analysis': analysis,
+                'reasoning': reasoning if isinstance(reasoning, str) and reasoning.strip() else None, **levels}
+    
+    def _count_response(self, kind: str):
+        with self._stats_lock:
+            self.response_stats[kind] += 1
+    
+    def _build_analysis_result(self, symbol: str, price_data: Dict, user_id: int, user_context: str,
+                               analysis_text: str, recommendation: str, confidence: float, fields: Dict = None,
+                               trading_mode: str = None) -> Dict:
+        """بناء قاموس التحليل الموحد الذي تستخدمه الحلقة والتنسيق"""
+        fields = fields or {}
+        if user_id:
+            trading_mode = get_user_trading_mode(user_id)
+        # تعديل الثقة حسب نمط التداول
+        if user_id:
+            confidence = self._adjust_confidence_for_user(confidence, user_id)
+        
+        return {
+            'action': recommendation,
+            'confidence': confidence,
+            'reasoning': [fields.get('reasoning') or analysis_text],
+            'ai_analysis': analysis_text,
+            'entry': fields.get('entry'),
+            'tp1': fields.get('tp1'),
+            'tp2': fields.get('tp2'),
+            'sl': fields.get('sl'),
+            'source': f"Gemini AI ({price_data.get('source', 'Unknown')})",
+            'symbol': symbol,
+            'timestamp': datetime.now(),
+            'price_data': price_data,
+            'trading_mode': trading_mode,
+            'user_context': user_context if user_id else None
+        }
+    
+    def analyze_market_data_with_retry(self, symbol: str, price_data: Dict, user_id: int = None, market_data: pd.DataFrame = None, max_retries: int = 3, technical_data: Dict = None, trading_mode: str = None) -> Dict:
         """تحليل بيانات السوق مع آلية إعادة المحاولة"""
         last_error = None
         
         for attempt in range(max_retries):
             try:
-                return self.analyze_market_data(symbol, price_data, user_id, market_data)
+                return self.analyze_market_data(symbol, price_data, user_id, market_data, technical_data, trading_mode)
             except Exception as e:
                 last_error = e
                 if attempt == max_retries - 1:
@@ -1000,360 +4298,165 @@ class GeminiAnalyzer:
         # إذا فشلت جميع المحاولات
         return self._fallback_analysis(symbol, price_data)
 
-    def analyze_market_data(self, symbol: str, price_data: Dict, user_id: int = None, market_data: pd.DataFrame = None) -> Dict:
+    def _build_market_context(self, symbol: str, price_data: Dict, user_id: int = None, technical_data: Dict = None,
+                              trading_mode: str = None) -> Tuple[str, str]:
+        """بناء الجزء الخاص بالرمز من الطلب (بيانات لحظية، مؤشرات، سياق المستخدم والتدريب) - يعيد (النص، سياق المستخدم)
+        
+        بدون user_id مع trading_mode: تحليل أساسي مشترك لنمط التداول بلا رأس مال أو منطقة زمنية
+        """
+        # إعداد البيانات للتحليل
+        current_price = price_data.get('last', price_data.get('bid', 0))
+        spread = price_data.get('spread', 0)
+        data_source = price_data.get('source', 'Unknown')
+        
+        # جلب المؤشرات الفنية الحقيقية من MT5 (إذا لم تمرر محسوبة مسبقاً)
+        if technical_data is None:
+            technical_data = mt5_manager.calculate_technical_indicators(symbol)
+        technical_analysis = ""
+        
+        if technical_data and technical_data.get('indicators'):
+            indicators = technical_data['indicators']
+            technical_analysis = f"""
+            
+            المؤشرات الفنية الحقيقية (محسوبة من البيانات التاريخية):
+            - المتوسط المتحرك 10: {indicators.get('ma_10', 'غير متوفر'):.5f}
+            - المتوسط المتحرك 20: {indicators.get('ma_20', 'غير متوفر'):.5f}
+            - المتوسط المتحرك 50: {indicators.get('ma_50', 'غير متوفر'):.5f}
+            - RSI: {indicators.get('rsi', 'غير متوفر'):.2f} ({indicators.get('rsi_interpretation', 'غير محدد')})
+            - MACD: {indicators.get('macd', {}).get('macd', 'غير متوفر'):.5f}
+            - MACD Signal: {indicators.get('macd', {}).get('signal', 'غير متوفر'):.5f}
+            - MACD Histogram: {indicators.get('macd', {}).get('histogram', 'غير متوفر'):.5f}
+            - تفسير MACD: {indicators.get('macd_interpretation', 'غير محدد')}
+            - حجم التداول الحالي: {indicators.get('current_volume', 'غير متوفر')}
+            - متوسط الحجم: {indicators.get('avg_volume', 'غير متوفر')}
+            - نسبة الحجم: {indicators.get('volume_ratio', 'غير متوفر'):.2f}
+            - تفسير الحجم: {indicators.get('volume_interpretation', 'غير محدد')}
+            - Stochastic %K: {indicators.get('stochastic', {}).get('k', 'غير متوفر'):.2f}
+            - Stochastic %D: {indicators.get('stochastic', {}).get('d', 'غير متوفر'):.2f}
+            - Bollinger Upper: {indicators.get('bollinger', {}).get('upper', 'غير متوفر'):.5f}
+            - Bollinger Middle: {indicators.get('bollinger', {}).get('middle', 'غير متوفر'):.5f}
+            - Bollinger Lower: {indicators.get('bollinger', {}).get('lower', 'غير متوفر'):.5f}
+            - تفسير Bollinger: {indicators.get('bollinger_interpretation', 'غير محدد')}
+            - مقاومة: {indicators.get('resistance', 'غير متوفر'):.5f}
+            - دعم: {indicators.get('support', 'غير متوفر'):.5f}
+            - الاتجاه العام: {indicators.get('overall_trend', 'غير محدد')}
+            - تغيير السعر %: {indicators.get('price_change_pct', 0):.2f}%
+            """
+        else:
+            technical_analysis = """
+            
+            المؤشرات الفنية: غير متوفرة (MT5 غير متصل أو بيانات غير كافية)
+            """
+        
+        # سياق الأطر الزمنية الأكبر (من الذاكرة بدون استدعاءات إضافية)
+        timeframe_context = mt5_manager.get_timeframe_context(symbol)
+        if timeframe_context:
+            technical_analysis += """
+            الاتجاه على الأطر الزمنية الأكبر (السعر مقابل المتوسط 20):"""
+            for name, context in timeframe_context.items():
+                technical_analysis += f"""
+            - {name}: {context['trend']} (الإغلاق {context['close']:.5f}، المتوسط 20 {context['ma_20']:.5f}، تغير الشمعة الجارية {context['change_pct']:.2f}%)"""
+            technical_analysis += "\n"
+        
+        # تحديد نوع الرمز وخصائصه (أجزاء نصية مجهزة مسبقاً)
+        symbol_type_context = _SYMBOL_TYPE_CONTEXTS.get(_symbol_type_key(symbol), "")
+        
+        # جلب سياق المستخدم
+        user_context = ""
+        trading_mode_instructions = ""
+        
+        if user_id:
+            trading_mode = get_user_trading_mode(user_id)
+            capital = get_user_capital(user_id)
+            user_timezone = get_user_timezone(user_id)
+            
+            user_context = f"""
+            
+            سياق المستخدم:
+            - نمط التداول: {trading_mode} ({'سكالبينغ سريع' if trading_mode == 'scalping' else 'تداول طويل المدى'})
+            - رأس المال: ${capital:,.2f}
+            - المنطقة الزمنية: {user_timezone}
+            """
+            
+            # تخصيص التحليل حسب نمط التداول
+            trading_mode_instructions = _TRADING_MODE_INSTRUCTIONS['scalping' if trading_mode == 'scalping' else 'longterm']
+        elif trading_mode:
+            # التحليل الأساسي المشترك: نمط التداول فقط - التخصيص لكل مستخدم يتم محلياً
+            user_context = f"""
+            
+            نمط التداول المستهدف: {trading_mode} ({'سكالبينغ سريع' if trading_mode == 'scalping' else 'تداول طويل المدى'})
+            """
+            trading_mode_instructions = _TRADING_MODE_INSTRUCTIONS['scalping' if trading_mode == 'scalping' else 'longterm']
+        
+        # تحميل بيانات التدريب السابقة
+        training_context = self._load_training_context(symbol)
+        
+        context = f"""
+        البيانات اللحظية الحالية:
+        - السعر الحالي: {current_price}
+        - سعر الشراء: {price_data.get('bid', 'غير متوفر')}
+        - سعر البيع: {price_data.get('ask', 'غير متوفر')}
+        - الفرق (Spread): {spread}
+        - مصدر البيانات: {data_source}
+        - الوقت: {price_data.get('time', 'الآن')}
+        {technical_analysis}
+        {symbol_type_context}
+        {user_context}
+        {trading_mode_instructions}
+        
+        بيانات التدريب السابقة:
+        {training_context}
+        """
+        return context, user_context
+    
+    def analyze_market_data(self, symbol: str, price_data: Dict, user_id: int = None, market_data: pd.DataFrame = None, technical_data: Dict = None, trading_mode: str = None,
+                            timeout: float = GEMINI_CALL_TIMEOUT) -> Dict:
         """تحليل بيانات السوق باستخدام Gemini AI مع مراعاة سياق المستخدم والمؤشرات الفنية"""
         if not self.model:
             return self._fallback_analysis(symbol, price_data)
         
         try:
-            # إعداد البيانات للتحليل
-            current_price = price_data.get('last', price_data.get('bid', 0))
-            spread = price_data.get('spread', 0)
-            data_source = price_data.get('source', 'Unknown')
-            
-            # جلب المؤشرات الفنية الحقيقية من MT5
-            technical_data = mt5_manager.calculate_technical_indicators(symbol)
-            technical_analysis = ""
-            
-            if technical_data and technical_data.get('indicators'):
-                indicators = technical_data['indicators']
-                technical_analysis = f"""
-                
-                المؤشرات الفنية الحقيقية (محسوبة من البيانات التاريخية):
-                - المتوسط المتحرك 10: {indicators.get('ma_10', 'غير متوفر'):.5f}
-                - المتوسط المتحرك 20: {indicators.get('ma_20', 'غير متوفر'):.5f}
-                - المتوسط المتحرك 50: {indicators.get('ma_50', 'غير متوفر'):.5f}
-                - RSI: {indicators.get('rsi', 'غير متوفر'):.2f} ({indicators.get('rsi_interpretation', 'غير محدد')})
-                - MACD: {indicators.get('macd', {}).get('macd', 'غير متوفر'):.5f}
-                - MACD Signal: {indicators.get('macd', {}).get('signal', 'غير متوفر'):.5f}
-                - MACD Histogram: {indicators.get('macd', {}).get('histogram', 'غير متوفر'):.5f}
-                - تفسير MACD: {indicators.get('macd_interpretation', 'غير محدد')}
-                - حجم التداول الحالي: {indicators.get('current_volume', 'غير متوفر')}
-                - متوسط الحجم: {indicators.get('avg_volume', 'غير متوفر')}
-                - نسبة الحجم: {indicators.get('volume_ratio', 'غير متوفر'):.2f}
-                - تفسير الحجم: {indicators.get('volume_interpretation', 'غير محدد')}
-                - Stochastic %K: {indicators.get('stochastic', {}).get('k', 'غير متوفر'):.2f}
-                - Stochastic %D: {indicators.get('stochastic', {}).get('d', 'غير متوفر'):.2f}
-                - Bollinger Upper: {indicators.get('bollinger', {}).get('upper', 'غير متوفر'):.5f}
-                - Bollinger Middle: {indicators.get('bollinger', {}).get('middle', 'غير متوفر'):.5f}
-                - Bollinger Lower: {indicators.get('bollinger', {}).get('lower', 'غير متوفر'):.5f}
-                - تفسير Bollinger: {indicators.get('bollinger_interpretation', 'غير محدد')}
-                - مقاومة: {indicators.get('resistance', 'غير متوفر'):.5f}
-                - دعم: {indicators.get('support', 'غير متوفر'):.5f}
-                - الاتجاه العام: {indicators.get('overall_trend', 'غير محدد')}
-                - تغيير السعر %: {indicators.get('price_change_pct', 0):.2f}%
-                """
-            else:
-                technical_analysis = """
-                
-                المؤشرات الفنية: غير متوفرة (MT5 غير متصل أو بيانات غير كافية)
-                """
-            
-            # تحديد نوع الرمز وخصائصه
-            symbol_type_context = ""
-            if symbol.endswith('USD'):
-                if symbol.startswith('EUR') or symbol.startswith('GBP'):
-                    symbol_type_context = """
-                    
-                    **سياق خاص بأزواج العملات الرئيسية:**
-                    - هذا زوج عملات رئيسي بسيولة عالية وتقلبات معتدلة
-                    - تأثر قوي بقرارات البنوك المركزية (Fed, ECB, BoE)
-                    - ساعات التداول النشطة: London + New York overlap
-                    - عوامل مؤثرة: معدلات الفائدة، التضخم، GDP، البطالة
-                    - نسبة النجاح المتوقعة أعلى بسبب قابلية التنبؤ النسبية
-                    """
-                elif symbol.startswith('XAU') or symbol.startswith('XAG'):
-                    symbol_type_context = """
-                    
-                    **سياق خاص بالمعادن النفيسة:**
-                    - الذهب/الفضة أصول ملاذ آمن مع تقلبات متوسطة إلى عالية
-                    - تأثر قوي بالأحداث الجيوسياسية والتضخم
-                    - علاقة عكسية مع الدولار الأمريكي عادة
-                    - عوامل مؤثرة: التضخم، أسعار الفائدة، الأزمات العالمية
-                    - كن حذراً من التحركات المفاجئة خلال الأخبار المهمة
-                    """
-                elif symbol.startswith('BTC') or symbol.startswith('ETH'):
-                    symbol_type_context = """
-                    
-                    **سياق خاص بالعملات الرقمية:**
-                    - تقلبات عالية جداً مع إمكانية مكاسب/خسائر كبيرة
-                    - سوق 24/7 مع تأثر قوي بالمشاعر والأخبار
-                    - تأثر بالتنظيم الحكومي، اعتماد المؤسسات، التطوير التقني
-                    - عوامل مؤثرة: تصريحات المؤثرين، القرارات التنظيمية، التطوير التقني
-                    - قلل نسبة النجاح 10-15% بسبب عدم القابلية للتنبؤ
-                    """
-                else:
-                    symbol_type_context = """
-                    
-                    **سياق عام للأصول:**
-                    - حلل خصائص هذا الرمز والعوامل المؤثرة عليه
-                    - اعتبر السيولة والتقلبات التاريخية
-                    - راعِ ساعات التداول النشطة والأحداث الاقتصادية
-                    """
-            
-            # جلب سياق المستخدم
-            user_context = ""
-            trading_mode_instructions = ""
-            
-            if user_id:
-                trading_mode = get_user_trading_mode(user_id)
-                capital = get_user_capital(user_id)
-                user_timezone = get_user_timezone(user_id)
-                
-                user_context = f"""
-                
-                سياق المستخدم:
-                - نمط التداول: {trading_mode} ({'سكالبينغ سريع' if trading_mode == 'scalping' else 'تداول طويل المدى'})
-                - رأس المال: ${capital:,.2f}
-                - المنطقة الزمنية: {user_timezone}
-                """
-                
-                # تخصيص التحليل حسب نمط التداول
-                if trading_mode == 'scalping':
-                    trading_mode_instructions = """
-                    
-                    تعليمات خاصة للسكالبينغ:
-                    - ركز على الفرص قصيرة المدى (دقائق إلى ساعات)
-                    - أهداف ربح صغيرة (1-2%)
-                    - وقف خسارة ضيق (0.5-1%)
-                    - تحليل سريع وفوري
-                    - ثقة عالية مطلوبة (80%+)
-                    - ركز على التحركات السريعة والمؤشرات قصيرة المدى
-                    - حجم صفقات أصغر لتقليل المخاطر
-                    - اهتم بـ RSI و MACD للإشارات السريعة
-                    """
-                else:
-                    trading_mode_instructions = """
-                    
-                    تعليمات خاصة للتداول طويل المدى:
-                    - ركز على الاتجاهات طويلة المدى (أيام إلى أسابيع)
-                    - أهداف ربح أكبر (5-10%)
-                    - وقف خسارة أوسع (2-3%)
-                    - تحليل شامل ومتأني
-                    - تحمل تذبذبات أكثر
-                    - ركز على الاتجاهات الرئيسية والأساسيات
-                    - حجم صفقات أكبر للاستفادة من الاتجاهات الطويلة
-                    - اهتم بالمتوسطات المتحركة والدعم والمقاومة
-                    """
-            
-            # تحميل بيانات التدريب السابقة
-            training_context = self._load_training_context(symbol)
+            market_context, user_context = self._build_market_context(symbol, price_data, user_id, technical_data, trading_mode)
             
             # تحميل الأنماط المتعلمة من الصور
             learned_patterns = self._load_learned_patterns()
             
-            # إنشاء prompt للتحليل المتقدم مع المؤشرات الفنية
+            # إنشاء prompt للتحليل المتقدم مع المؤشرات الفنية - منهجية التحليل في تعليمات النظام
             prompt = f"""
-            أنت محلل مالي خبير متخصص في التداول. قم بتحليل البيانات التالية للرمز {symbol}:
-            
-            البيانات اللحظية الحالية:
-            - السعر الحالي: {current_price}
-            - سعر الشراء: {price_data.get('bid', 'غير متوفر')}
-            - سعر البيع: {price_data.get('ask', 'غير متوفر')}
-            - الفرق (Spread): {spread}
-            - مصدر البيانات: {data_source}
-            - الوقت: {price_data.get('time', 'الآن')}
-            {technical_analysis}
-            {symbol_type_context}
-            {user_context}
-            {trading_mode_instructions}
-            
-            بيانات التدريب السابقة:
-            {training_context}
+            قم بتحليل البيانات التالية للرمز {symbol}:
+            {market_context}
             
             الأنماط المتعلمة من المستخدمين:
             {learned_patterns}
             
             {get_analysis_rules_for_prompt()}
-            
-            === تعليمات التحليل المتقدم ===
-            
-            🔶 أنت الآن خبير تداول محترف بخبرة تفوق 20 عامًا في الأسواق المالية العالمية. هدفك تقديم تحليل عميق ومتقدم جدًا بناءً على منهج علمي ومنظم، قائم على معايير كمية دقيقة وشفافية كاملة في الحسابات.
-            
-            ⚠️ **قاعدة مهمة:** لا تقدم أي توصية إلا إذا تجاوزت نسبة النجاح المحسوبة 80% بناءً على معايير كمية فقط (لا حدس أو افتراضات).
-            
-            📋 **متطلبات الجودة الاحترافية:**
-            - استخدم معايير كمية فقط في القرار
-            - لا تكتب جمل عامة مثل "قد يصعد السعر" أو "يوجد احتمال"
-            - استخدم لغة تحليلية صارمة ومنظمة فقط
-            - إذا لم توجد صفقة قوية، قل بوضوح: "لا توجد صفقة ناجحة بنسبة 80% أو أكثر حالياً"
-            
-            ## 🔍 STEP 1: التحليل الفني المتعمق والمتقدم
-            قيّم كل مؤشر بدقة وأعطِ نقاط من 10، واستخدم المؤشرات التالية:
-            
-            **📊 المؤشرات الأساسية:** RSI, MACD, Moving Averages (EMA, SMA), Bollinger Bands, Volume Profile, ATR
-            **📈 تحليل متعدد الأطر:** حدد الاتجاه العام عبر أطر زمنية متعددة (سكالبينغ، قصير، متوسط)
-            **🎯 نقاط حساسة:** ارصد مناطق الانعكاس، التشبع، الاختراقات الحقيقية، والمناطق الحساسة
-            **📋 سلوك السعر:** افحص سلوك السعر عند مستويات رئيسية (عرض وطلب، دعم ومقاومة)
-            
-            **أ) مؤشر RSI:**
-            - إذا RSI 20-30: نقاط الشراء = 9/10 (ذروة بيع قوية)
-            - إذا RSI 30-50: نقاط الشراء = 7/10 (منطقة جيدة)  
-            - إذا RSI 50-70: نقاط البيع = 7/10 (منطقة جيدة للبيع)
-            - إذا RSI 70-80: نقاط البيع = 9/10 (ذروة شراء قوية)
-            - إذا RSI 40-60: نقاط = 4/10 (منطقة محايدة)
-            
-            **ب) مؤشر MACD:**
-            - MACD فوق Signal + موجب: نقاط الشراء = 8/10
-            - MACD فوق Signal + سالب: نقاط الشراء = 6/10  
-            - MACD تحت Signal + موجب: نقاط البيع = 6/10
-            - MACD تحت Signal + سالب: نقاط البيع = 8/10
-            - تقاطع حديث: نقاط إضافية = +2
-            
-            **ج) المتوسطات المتحركة:**
-            - السعر فوق MA10 > MA20 > MA50: نقاط الشراء = 9/10
-            - السعر تحت MA10 < MA20 < MA50: نقاط البيع = 9/10
-            - ترتيب مختلط: نقاط = 3-5/10 حسب القوة
-            
-            **د) مستويات الدعم والمقاومة:**
-            - قرب مستوى دعم قوي: نقاط الشراء = +3
-            - قرب مستوى مقاومة قوية: نقاط البيع = +3
-            - كسر مستوى بحجم عالي: نقاط = +4
-            
-            **هـ) تحليل الشموع اليابانية (إن توفرت):**
-            - نماذج انعكاسية قوية: +2 نقاط
-            - نماذج استمرارية: +1 نقطة
-            - تأكيد النموذج بالحجم: +1 نقطة إضافية
-            
-            **و) تحليل الـ ATR والتقلبات:**
-            - ATR منخفض = استقرار: +1 نقطة
-            - ATR مرتفع جداً = مخاطرة: -2 نقاط
-            
-            ## 🔍 STEP 2: تحليل ظروف السوق
-            
-            **أ) حجم التداول:**
-            - حجم > 150% من المتوسط: قوة إضافية = +15%
-            - حجم 120-150% من المتوسط: قوة إضافية = +10%  
-            - حجم 80-120% من المتوسط: طبيعي = 0%
-            - حجم < 80% من المتوسط: ضعف = -10%
-            
-            **ب) التقلبات (Volatility):**
-            - تقلبات منخفضة: استقرار = +5%
-            - تقلبات معتدلة: مثالية = +10%
-            - تقلبات عالية: مخاطرة = -15%
-            
-            ## 🔍 STEP 3: تحليل المخاطر والفرص
-            
-            **عوامل الخطر (تقلل النسبة):**
-            - تضارب في المؤشرات: -10% لكل تضارب
-            - أخبار سلبية متوقعة: -15%
-            - عدم استقرار الأسواق العالمية: -10%
-            - اقتراب من نهاية جلسة التداول: -5%
-            
-            **عوامل الفرص (تزيد النسبة):**
-            - جميع المؤشرات متفقة: +20%
-            - كسر مستوى مهم بحجم عالي: +15%
-            - أخبار إيجابية داعمة: +10%
-            - توقيت مثالي (بداية الجلسة): +5%
-            
-            ## 🔍 STEP 4: معايرة حسب نمط التداول
-            
-            **للسكالبينغ (مضاعف دقة):**
-            - RSI + MACD متفقان: مضاعف x1.2
-            - حجم تداول عالي: مضاعف x1.15
-            - تقلبات منخفضة: مضاعف x1.1
-            - وقت ذروة السوق: مضاعف x1.05
-            
-            **للتداول طويل المدى (مضاعف اتجاه):**
-            - اتجاه قوي على عدة إطارات: مضاعف x1.3
-            - اختراق مستويات مهمة: مضاعف x1.2  
-            - دعم أساسيات اقتصادية: مضاعف x1.15
-            
-            ## 🔍 STEP 5: الحساب النهائي لنسبة النجاح
-            
-            **الصيغة الحسابية:**
-            ```
-            النقاط الأساسية = (مجموع نقاط المؤشرات ÷ عدد المؤشرات) × 10
-            
-            النسبة المعدلة = النقاط الأساسية 
-                           + تعديل حجم التداول
-                           + تعديل التقلبات  
-                           + عوامل الفرص
-                           - عوامل المخاطر
-            
-            النسبة النهائية = النسبة المعدلة × مضاعف نمط التداول
-            ```
-            
-            **قواعد مهمة:**
-            - النسبة النهائية يجب أن تكون بين 10% و 95%
-            - إذا كانت المؤشرات متضاربة بشدة: الحد الأقصى 45%
-            - إذا كانت جميع المؤشرات متفقة: الحد الأدنى 60%
-            - للمبتدئين: تقليل النسبة بـ 10%
-            - للخبراء: زيادة النسبة بـ 5%
-            
-            ## 📊 متطلبات النتيجة النهائية (شفافية كاملة):
-            
-            1. **التحليل التفصيلي:** اعرض نقاط كل مؤشر وتبريرك بناءً على إشارات واضحة
-            2. **حساب النسبة خطوة بخطوة:** أظهر العملية الحسابية الكاملة والشفافة
-            3. **التوصية المحددة:** حدد نوع الصفقة (شراء/بيع)، نقطة الدخول المثلى، الأهداف (TP1/TP2)، وقف الخسارة (SL)
-            4. **تقييم نسبة العائد/المخاطرة:** احسب Risk/Reward Ratio بدقة
-            5. **إدارة المخاطر المتقدمة:** اقترح حجم الصفقة (Lot Size) وحساب الخسارة المحتملة بالنقاط
-            6. **تحليل التباين:** لا تتجاهل التباين بين المؤشرات (مثلاً: تقاطع سلبي في MACD مع RSI صاعد)
-            7. **نسبة النجاح النهائية المبررة:** بصيغة "نسبة نجاح الصفقة: X%" مع التبرير الكامل
-            
-            ## ⚠️ تحذيرات مهمة وقواعد المصداقية:
-            
-            **قواعد الدقة والمصداقية (معايير احترافية صارمة):**
-            - لا تبالغ بالتفاؤل: إذا كانت الصفقة محفوفة بالمخاطر، اذكر ذلك صراحة
-            - استبعد أي صفقة لا تستوفي الشروط الحسابية الدقيقة
-            - لا تتردد في إعطاء نسب منخفضة (15-35%) إذا كانت الإشارات ضعيفة
-            - لا تتجاوز 90% إلا في حالات الإشارات القوية جداً والنادرة مع توافق جميع المؤشرات
-            - إذا كانت البيانات ناقصة أو غير موثوقة: الحد الأقصى 50%
-            - إذا كان هناك تضارب شديد في المؤشرات: 20-40% فقط
-            - للمؤشرات المتفقة بقوة مع دعم الأخبار ودون تباين: 75-90%
-            - تذكر: أنك تعمل ضمن غرفة تداول احترافية ولا يقل تحليلك جودة عن كبار المتداولين والمؤسسات
-            
-            **أمثلة على نسب صحيحة:**
-            - إشارة ضعيفة مع تضارب: "نسبة نجاح الصفقة: 28%" 
-            - إشارة متوسطة: "نسبة نجاح الصفقة: 54%"
-            - إشارة قوية مع دعم أخبار: "نسبة نجاح الصفقة: 83%"
-            - إشارة ممتازة نادرة: "نسبة نجاح الصفقة: 91%"
-            
-            **التحقق النهائي قبل الإجابة:**
-            1. هل نسبة النجاح تعكس حقاً قوة/ضعف التحليل؟
-            2. هل أخذت جميع المخاطر في الاعتبار؟
-            3. هل النسبة منطقية مقارنة بظروف السوق؟
-            4. هل يمكنني الدفاع عن هذه النسبة بالأرقام والمؤشرات؟
-            
-            ## 🎯 التحذير النهائي والالتزام الاحترافي:
-            
-            **❌ لا تقدم أي توصية إلا إذا:**
-            - تجاوزت نسبة النجاح المحسوبة 80% بناءً على معايير كمية
-            - توفرت كل شروط الدخول والربح الواضحة
-            - لم يوجد تباين خطير بين المؤشرات
-            
-            **✅ إذا لم تستوف الشروط أعلاه، قل:**
-            "لا توجد صفقة ناجحة بنسبة 80% أو أكثر حالياً"
-            
-            **🔥 تذكر:** أنت تعمل كخبير احترافي في غرفة تداول مؤسسية. المصداقية والدقة أهم من التفاؤل. المتداول يعتمد على تحليلك في اتخاذ قرارات مالية مهمة جداً!
+            {GEMINI_OUTPUT_FORMAT}
             """
             
-            # إرسال الطلب لـ Gemini
-            response = self.model.generate_content(prompt)
-            analysis_text = response.text
-            
-            # استخراج التوصية من النص
-            recommendation = self._extract_recommendation(analysis_text)
-            confidence = self._extract_confidence(analysis_text)
+            # إرسال الطلب لـ Gemini برد منظم حسب المخطط
+            response = self._generate_analysis(prompt, timeout, generation_config={'response_mime_type': 'application/json',
+                                                                                   'response_schema': GEMINI_ANALYSIS_SCHEMA},
+                                               symbols=[symbol], users=[user_id])
+            fields = self._parse_structured_analysis(response.text)
+            
+            if fields is not None:
+                self._count_response('structured')
+                analysis_text = fields['analysis']
+                recommendation = fields['action']
+                confidence = fields['success_rate']
+            else:
+                # الرد لا يطابق المخطط - استخراج التوصية والنسبة من النص كبديل
+                self._count_response('regex_fallback')
+                logger.warning(f"[WARNING] رد Gemini لـ {symbol} غير منظم - استخراج من النص ({self.response_stats['regex_fallback']} مرة حتى الآن)")
+                analysis_text = response.text
+                recommendation = self._extract_recommendation(analysis_text)
+                confidence = self._extract_confidence(analysis_text)
             
             # تسجيل تفاصيل لتتبع نسبة النجاح المستخرجة
             logger.info(f"[AI_ANALYSIS] {symbol}: التوصية={recommendation}, نسبة النجاح={confidence:.1f}%")
             
-            # تعديل الثقة حسب نمط التداول
-            if user_id:
-                confidence = self._adjust_confidence_for_user(confidence, user_id)
-            
-            return {
-                'action': recommendation,
-                'confidence': confidence,
-                'reasoning': [analysis_text],
-                'ai_analysis': analysis_text,
-                'source': f'Gemini AI ({data_source})',
-                'symbol': symbol,
-                'timestamp': datetime.now(),
-                'price_data': price_data,
-                'user_context': user_context if user_id else None
-            }
+            return self._build_analysis_result(symbol, price_data, user_id, user_context,
+                                               analysis_text, recommendation, confidence, fields, trading_mode)
             
         except Exception as e:
             logger.error(f"[ERROR] خطأ في تحليل Gemini للرمز {symbol}: {e}")
@@ -1421,6 +4524,21 @@ class GeminiAnalyzer:
         except:
             return confidence
     
+    def personalize_analysis(self, analysis: Dict, user_id: int, price_data: Dict = None) -> Dict:
+        """تخصيص التحليل الأساسي المشترك لمستخدم محدد محلياً (الثقة، رأس المال، حجم الصفقة، الهدف والوقف) بدون طلب Gemini"""
+        if not analysis or analysis.get('source') == 'Fallback Analysis' or analysis.get('user_context'):
+            return analysis  # التحليل الاحتياطي أو المخصص مسبقاً يرسل كما هو
+        
+        # السعر الحي للدورة الحالية - التحليل من الكاش قد يحمل سعراً عمره حتى 15 دقيقة
+        price_data = price_data or analysis.get('price_data') or {}
+        personalized = dict(analysis)
+        personalized['price_data'] = price_data
+        personalized['confidence'] = self._adjust_confidence_for_user(analysis.get('confidence', 0), user_id)
+        personalized['trade_plan'] = build_user_trade_plan(user_id, analysis.get('symbol'), analysis.get('action', 'HOLD'),
+                                                           price_data.get('last', price_data.get('bid')), analysis)
+        personalized['user_id'] = user_id
+        return personalized
+    
     def _extract_recommendation(self, text: str) -> str:
         """استخراج التوصية من نص التحليل"""
         text_lower = text.lower()
@@ -1663,10 +4781,17 @@ class GeminiAnalyzer:
                 target2 = current_price * 1.03
                 stop_loss = current_price * 0.985
             
-            # حساب النقاط
-            points1 = abs(target1 - entry_price) * 10000 if entry_price else 0
-            points2 = abs(target2 - entry_price) * 10000 if entry_price else 0
-            stop_points = abs(entry_price - stop_loss) * 10000 if entry_price else 0
+            # المستويات من الرد المنظم لـ Gemini لها الأولوية إذا اتسقت مع اتجاه الصفقة
+            ai_levels = consistent_ai_levels(analysis, action)
+            if ai_levels:
+                entry_price, target1, target2, stop_loss = ai_levels
+            
+            # حساب النقاط (pips لأزواج العملات) حسب نقطة الرمز ودقة عرضه (من سجل المواصفات في الذاكرة)
+            symbols = mt5_manager.symbols
+            digits = symbols.digits(symbol)
+            points1 = symbols.to_pips(symbol, target1 - entry_price) if entry_price else 0
+            points2 = symbols.to_pips(symbol, target2 - entry_price) if entry_price else 0
+            stop_points = symbols.to_pips(symbol, entry_price - stop_loss) if entry_price else 0
             
             # حساب نسبة المخاطرة/المكافأة
             risk_reward_ratio = (points1 / stop_points) if stop_points > 0 else 1.0
@@ -1688,7 +4813,7 @@ class GeminiAnalyzer:
             message += "━━━━━━━━━━━━━━━━━━━━━━━━━\n"
             message += f"💱 {symbol} | {symbol_info['name']} {symbol_info['emoji']}\n"
             message += f"📡 مصدر البيانات: 🔗 MetaTrader5 (لحظي - بيانات حقيقية)\n"
-            message += f"💰 السعر الحالي: {current_price:,.5f}\n"
+            message += f"💰 السعر الحالي: {current_price:,.{digits}f}\n"
             message += f"➡️ التغيير اليومي: {daily_change}\n"
             message += f"⏰ وقت التحليل: {formatted_time}\n\n"
             
@@ -1703,10 +4828,10 @@ class GeminiAnalyzer:
             else:
                 message += f"🟡 نوع الصفقة: انتظار (HOLD)\n"
             
-            message += f"📍 سعر الدخول المقترح: {entry_price:,.5f}\n"
-            message += f"🎯 الهدف الأول: {target1:,.5f} ({points1:.0f} نقطة)\n"
-            message += f"🎯 الهدف الثاني: {target2:,.5f} ({points2:.0f} نقطة)\n"
-            message += f"🛑 وقف الخسارة: {stop_loss:,.5f} ({stop_points:.0f} نقطة)\n"
+            message += f"📍 سعر الدخول المقترح: {entry_price:,.{digits}f}\n"
+            message += f"🎯 الهدف الأول: {target1:,.{digits}f} ({points1:.0f} نقطة)\n"
+            message += f"🎯 الهدف الثاني: {target2:,.{digits}f} ({points2:.0f} نقطة)\n"
+            message += f"🛑 وقف الخسارة: {stop_loss:,.{digits}f} ({stop_points:.0f} نقطة)\n"
             message += f"📊 نسبة المخاطرة/المكافأة: 1:{risk_reward_ratio:.1f}\n"
             message += f"✅ نسبة نجاح الصفقة: {ai_success_rate:.0f}%\n\n"
             
@@ -1739,12 +4864,12 @@ class GeminiAnalyzer:
                 ma50 = indicators.get('ma_50')
                 
                 if ma10 and ma10 > 0:
-                    message += f"• MA10: {ma10:.5f}\n"
+                    message += f"• MA10: {ma10:.{digits}f}\n"
                 else:
                     message += f"• MA10: --\n"
                     
                 if ma50 and ma50 > 0:
-                    message += f"• MA50: {ma50:.5f}\n"
+                    message += f"• MA50: {ma50:.{digits}f}\n"
                 else:
                     message += f"• MA50: --\n"
                 
@@ -1771,8 +4896,8 @@ class GeminiAnalyzer:
                 support_level = indicators.get('support')
                 if resistance_level and support_level:
                     message += "📊 مستويات مهمة:\n"
-                    message += f"• مقاومة: {resistance_level:.5f}\n"
-                    message += f"• دعم: {support_level:.5f}\n\n"
+                    message += f"• مقاومة: {resistance_level:.{digits}f}\n"
+                    message += f"• دعم: {support_level:.{digits}f}\n\n"
                 
                 # تحليل حجم التداول
                 volume_status = indicators.get('volume_interpretation')
@@ -1792,9 +4917,9 @@ class GeminiAnalyzer:
                 bollinger = indicators.get('bollinger', {})
                 if bollinger.get('upper') and bollinger.get('lower'):
                     message += "🎯 تحليل البولنجر باندز:\n"
-                    message += f"• النطاق العلوي: {bollinger['upper']:.5f}\n"
-                    message += f"• النطاق الأوسط: {bollinger['middle']:.5f}\n"
-                    message += f"• النطاق السفلي: {bollinger['lower']:.5f}\n"
+                    message += f"• النطاق العلوي: {bollinger['upper']:.{digits}f}\n"
+                    message += f"• النطاق الأوسط: {bollinger['middle']:.{digits}f}\n"
+                    message += f"• النطاق السفلي: {bollinger['lower']:.{digits}f}\n"
                     bollinger_interp = indicators.get('bollinger_interpretation', '')
                     if bollinger_interp:
                         message += f"• التفسير: {bollinger_interp}\n"
@@ -2847,6 +5972,68 @@ def calculate_ai_success_rate(analysis: Dict, technical_data: Dict, symbol: str,
         return 55.0
 
 # ===== وظائف إرسال التنبيهات المحسنة =====
+# نسب الهدف ووقف الخسارة وحجم الصفقة حسب نمط التداول
+TRADING_MODE_RISK_PROFILES = {
+    'scalping': {'profit_pct': 0.015, 'loss_pct': 0.005, 'position_pct': 0.02, 'risk_description': "منخفضة (سكالبينغ)"},
+    'longterm': {'profit_pct': 0.05, 'loss_pct': 0.02, 'position_pct': 0.05, 'risk_description': "متوسطة (طويل الأمد)"}
+}
+
+def consistent_ai_levels(analysis: Optional[Dict], action: str) -> Optional[Tuple[float, float, float, float]]:
+    """(entry, tp1, tp2, sl) من الرد المنظم لـ Gemini إذا اكتملت واتسقت مع اتجاه الصفقة، وإلا None"""
+    if not analysis or action not in ('BUY', 'SELL'):
+        return None
+    levels = tuple(analysis.get(key) for key in ('entry', 'tp1', 'tp2', 'sl'))
+    if not all(levels):
+        return None
+    entry, tp1, tp2, sl = levels
+    direction = 1 if action == 'BUY' else -1
+    if direction * (tp2 - tp1) >= 0 and direction * (tp1 - entry) > 0 > direction * (sl - entry):
+        return levels
+    return None
+
+def build_user_trade_plan(user_id: int, symbol: str, action: str, current_price: float = None,
+                          analysis: Dict = None) -> Dict:
+    """حساب الهدف ووقف الخسارة وحجم الصفقة لمستخدم حسب نمط تداوله ورأس ماله - محلي بالكامل
+    
+    مستويات Gemini المتسقة (tp1/tp2/sl) لها الأولوية على النسب الثابتة لنمط التداول
+    """
+    trading_mode = get_user_trading_mode(user_id)
+    capital = get_user_capital(user_id)
+    profile = TRADING_MODE_RISK_PROFILES['scalping' if trading_mode == 'scalping' else 'longterm']
+    
+    target = None
+    target2 = None
+    stop_loss = None
+    ai_levels = consistent_ai_levels(analysis, action)
+    if ai_levels:
+        _, target, target2, stop_loss = ai_levels
+    elif current_price:
+        if action == 'BUY':
+            target = current_price * (1 + profile['profit_pct'])
+            stop_loss = current_price * (1 - profile['loss_pct'])
+        elif action == 'SELL':
+            target = current_price * (1 - profile['profit_pct'])
+            stop_loss = current_price * (1 + profile['loss_pct'])
+    
+    position_size = capital * profile['position_pct']
+    
+    # تحويل المبلغ إلى لوتات حسب القيمة الاسمية للوت وخطوة الحجم للرمز
+    lot_size = None
+    if current_price and current_price > 0:
+        lot_size = mt5_manager.symbols.normalize_volume(symbol, position_size / mt5_manager.symbols.lot_value(symbol, current_price))
+    
+    return {
+        'trading_mode': trading_mode,
+        'capital': capital,
+        'target': target,
+        'target2': target2,
+        'stop_loss': stop_loss,
+        'levels_source': 'ai' if ai_levels else 'profile',
+        'position_size': position_size,
+        'lot_size': lot_size,
+        'risk_description': profile['risk_description']
+    }
+
 def send_trading_signal_alert(user_id: int, symbol: str, signal: Dict, analysis: Dict = None):
     """إرسال تنبيه إشارة التداول مع أزرار التقييم"""
     try:
@@ -2921,37 +6108,20 @@ def send_trading_signal_alert(user_id: int, symbol: str, signal: Dict, analysis:
             price_data = analysis.get('price_data', {})
             current_price = price_data.get('last', price_data.get('bid'))
         
-        # حساب الهدف ووقف الخسارة حسب نمط التداول
-        target = None
-        stop_loss = None
-        if current_price:
-            # تحديد النسب حسب نمط التداول
-            if trading_mode == 'scalping':
-                profit_pct = 0.015  # 1.5% للسكالبينغ
-                loss_pct = 0.005   # 0.5% وقف خسارة
-            else:  # longterm
-                profit_pct = 0.05   # 5% للتداول طويل الأمد
-                loss_pct = 0.02     # 2% وقف خسارة
-            
-            if action == 'BUY':
-                target = current_price * (1 + profit_pct)
-                stop_loss = current_price * (1 - loss_pct)
-            elif action == 'SELL':
-                target = current_price * (1 - profit_pct)
-                stop_loss = current_price * (1 + loss_pct)
+        # الهدف ووقف الخسارة وحجم الصفقة حسب نمط التداول (من طبقة التخصيص إن كانت لهذا المستخدم)
+        plan = analysis.get('trade_plan') if analysis and analysis.get('user_id') == user_id else None
+        plan = plan or build_user_trade_plan(user_id, symbol, action, current_price, analysis)
+        target = plan['target']
+        target2 = plan.get('target2')
+        stop_loss = plan['stop_loss']
+        position_size = plan['position_size']
+        lot_size = plan['lot_size']
+        risk_description = plan['risk_description']
         
         # إنشاء رسالة التنبيه المحسنة
         symbol_info = ALL_SYMBOLS.get(symbol, {'name': symbol, 'emoji': '📈'})
         emoji = symbol_info['emoji']
         
-        # حساب حجم الصفقة المناسب حسب نمط التداول
-        if trading_mode == 'scalping':
-            position_size = min(capital * 0.02, capital * 0.05)  # 2-5% للسكالبينغ
-            risk_description = "منخفضة (سكالبينغ)"
-        else:
-            position_size = min(capital * 0.05, capital * 0.10)  # 5-10% للتداول طويل الأمد
-            risk_description = "متوسطة (طويل الأمد)"
-        
         formatted_time = get_current_time_for_user(user_id)
         
         # مصدر البيانات
@@ -2975,15 +6145,20 @@ def send_trading_signal_alert(user_id: int, symbol: str, signal: Dict, analysis:
 💰 **البيانات السعرية:**"""
         
         if current_price and current_price > 0:
-            message += f"\n• **السعر الحالي:** ${current_price:.5f}"
+            digits = mt5_manager.symbols.digits(symbol)
+            message += f"\n• **السعر الحالي:** ${current_price:.{digits}f}"
             
             if target and target > 0:
                 profit_pct = ((target/current_price-1)*100) if current_price > 0 else 0
-                message += f"\n• **الهدف:** ${target:.5f} ({profit_pct:+.1f}%)"
+                message += f"\n• **الهدف:** ${target:.{digits}f} ({profit_pct:+.1f}%)"
+            
+            if target2 and target2 > 0:
+                profit_pct = ((target2/current_price-1)*100) if current_price > 0 else 0
+                message += f"\n• **الهدف الثاني:** ${target2:.{digits}f} ({profit_pct:+.1f}%)"
             
             if stop_loss and stop_loss > 0:
                 loss_pct = ((stop_loss/current_price-1)*100) if current_price > 0 else 0
-                message += f"\n• **وقف الخسارة:** ${stop_loss:.5f} ({loss_pct:+.1f}%)"
+                message += f"\n• **وقف الخسارة:** ${stop_loss:.{digits}f} ({loss_pct:+.1f}%)"
         else:
             message += "\n• السعر: غير متوفر حالياً"
 
@@ -2994,7 +6169,7 @@ def send_trading_signal_alert(user_id: int, symbol: str, signal: Dict, analysis:
 • **رأس المال:** ${capital:,.0f}
 
 💡 **التوصية المخصصة:**
-• **حجم الصفقة المقترح:** ${position_size:.0f}
+• **حجم الصفقة المقترح:** ${position_size:.0f}{f' (≈ {lot_size:g} لوت)' if lot_size else ''}
 • **نسبة من رأس المال:** {(position_size/capital*100):.1f}%
 • **نسبة المخاطرة:** {risk_description}
 
@@ -4270,6 +7445,9 @@ def save_analysis_rules(rules):
         os.makedirs(FEEDBACK_DIR, exist_ok=True)
         with open(rules_file, 'w', encoding='utf-8') as f:
             json.dump(rules, f, ensure_ascii=False, indent=2, default=str)
+        # القواعد جزء من الـ prompt - التحليلات المحفوظة لم تعد صالحة
+        analysis_cache.invalidate()
+        change_gate.reset()
         return True
     except Exception as e:
         logger.error(f"[ERROR] خطأ في حفظ قواعد التحليل: {e}")
@@ -4295,7 +7473,7 @@ def process_user_rule_with_ai(user_input, user_id):
 اكتب القاعدة المحسنة بشكل مرقم ومنظم:
 """
         
-        response = gemini_analyzer.model.generate_content(prompt)
+        response = gemini_analyzer._generate_content(prompt, kind='rules', users=[user_id])
         return response.text.strip()
         
     except Exception as e:
@@ -4746,7 +7924,7 @@ def handle_detailed_analysis(call):
             price_data = mt5_manager.get_live_price(symbol)
             current_price = ""
             if price_data:
-                current_price = f" - ${price_data.get('last', price_data.get('bid', 0)):.5f}"
+                current_price = f" - ${mt5_manager.symbols.format_price(symbol, price_data.get('last', price_data.get('bid', 0)))}"
             
             button_text = f"{info['emoji']} {info['name']}{current_price}"
             markup.row(
@@ -4825,10 +8003,10 @@ def handle_full_symbol_analysis(call):
 • **النوع:** {symbol_info['type']}
 
 💰 **البيانات السعرية:**
-• **السعر الحالي:** ${price_data.get('last', price_data.get('bid', 0)):.5f}
-• **سعر الشراء:** ${price_data.get('bid', 0):.5f}
-• **سعر البيع:** ${price_data.get('ask', 0):.5f}
-• **فرق السعر:** {price_data.get('spread', 0):.5f}
+• **السعر الحالي:** ${mt5_manager.symbols.format_price(symbol, price_data.get('last', price_data.get('bid', 0)))}
+• **سعر الشراء:** ${mt5_manager.symbols.format_price(symbol, price_data.get('bid', 0))}
+• **سعر البيع:** ${mt5_manager.symbols.format_price(symbol, price_data.get('ask', 0))}
+• **فرق السعر:** {mt5_manager.symbols.format_price(symbol, price_data.get('spread', 0))}
 • **الحجم:** {price_data.get('volume', 0):,}
 
 👤 **سياق المستخدم:**
@@ -6303,9 +9481,16 @@ def display_instant_prices(user_id, chat_id, message_id, symbols, category_name,
             prices_data = []
             available_count = 0
             
+            # جلب أسعار الفئة كاملة دفعة واحدة (من البث أو الكاش أو MT5)
+            try:
+                live_prices = mt5_manager.get_live_prices(list(symbols.keys()))
+            except Exception as e:
+                logger.error(f"[ERROR] خطأ في جلب أسعار الفئة {category}: {e}")
+                live_prices = {}
+            
             for symbol, info in symbols.items():
                 try:
-                    price_data = mt5_manager.get_live_price(symbol)
+                    price_data = live_prices.get(symbol)
                     if price_data:
                         bid = price_data.get('bid', 0)
                         ask = price_data.get('ask', 0)
@@ -6318,11 +9503,12 @@ def display_instant_prices(user_id, chat_id, message_id, symbols, category_name,
                             display_bid = bid if bid > 0 else last_price
                             display_ask = ask if ask > 0 else last_price
                             display_spread = spread if spread > 0 else abs(display_ask - display_bid)
+                            digits = mt5_manager.symbols.digits(symbol)
                             
                             prices_data.append(f"""
 {info['emoji']} **{info['name']}**
-📊 شراء: {display_bid:.5f} | بيع: {display_ask:.5f}
-📏 فرق: {display_spread:.5f}
+📊 شراء: {display_bid:.{digits}f} | بيع: {display_ask:.{digits}f}
+📏 فرق: {display_spread:.{digits}f}
 """)
                         else:
                             prices_data.append(f"""
@@ -6487,10 +9673,53 @@ def is_notification_time_allowed(user_id: int, alert_timing: str) -> bool:
     
     return True
 
+def deliver_analysis_to_users(symbol: str, core_analysis: Dict, user_ids: List[int],
+                              price_data: Dict = None) -> Tuple[int, int]:
+    """تخصيص التحليل الأساسي لكل مستخدم محلياً بسعر الدورة الحالية وإرساله حسب إعداداته - يعيد (نجاح، فشل)"""
+    successful_operations = 0
+    failed_operations = 0
+    for user_id in user_ids:
+        try:
+            analysis = gemini_analyzer.personalize_analysis(core_analysis, user_id, price_data)
+            
+            # الحصول على إعدادات المستخدم
+            settings = get_user_advanced_notification_settings(user_id)
+            min_confidence = settings.get('success_threshold', 70)
+            alert_timing = settings.get('alert_timing', '24h')
+            
+            # فحص التوقيت المناسب للإشعارات
+            if not is_notification_time_allowed(user_id, alert_timing):
+                successful_operations += 1  # العملية نجحت لكن ليس الوقت المناسب
+                continue
+            
+            # إرسال التنبيه إذا كانت هناك إشارة قوية
+            if analysis.get('confidence', 0) >= min_confidence:
+                signal = {
+                    'action': analysis.get('action', 'HOLD'),
+                    'confidence': analysis.get('confidence', 0),
+                    'reasoning': analysis.get('reasoning', [])
+                }
+                
+                try:
+                    send_trading_signal_alert(user_id, symbol, signal, analysis)
+                    successful_operations += 1
+                except Exception as alert_error:
+                    logger.error(f"[ERROR] خطأ في إرسال تنبيه {symbol} للمستخدم {user_id}: {alert_error}")
+                    failed_operations += 1
+            else:
+                successful_operations += 1  # لا توجد إشارة قوية ولكن العملية نجحت
+                
+        except Exception as user_error:
+            logger.error(f"[ERROR] خطأ في معالجة المستخدم {user_id} للرمز {symbol}: {user_error}")
+            failed_operations += 1
+    return successful_operations, failed_operations
+
 def monitoring_loop():
     """حلقة مراقبة الأسعار وإرسال التنبيهات مع معالجة محسنة للأخطاء"""
     global monitoring_active
     logger.info("[RUNNING] بدء حلقة المراقبة...")
+    # طلبات المستخدمين التفاعلية تتقدم على دفعات المراقبة في طابور MT5
+    set_thread_mt5_priority(MT5_PRIORITY_MONITORING)
     consecutive_errors = 0
     max_consecutive_errors = 5
     connection_check_interval = 300  # فحص الاتصال كل 5 دقائق
@@ -6504,8 +9733,7 @@ def monitoring_loop():
             if current_time - last_connection_check > connection_check_interval:
                 logger.debug("[DEBUG] فحص دوري لحالة اتصال MT5...")
                 if not mt5_manager.validate_connection_health():
-                    logger.warning("[WARNING] انقطاع في اتصال MT5 تم اكتشافه - محاولة إعادة الاتصال...")
-                    mt5_manager.check_real_connection()
+                    logger.warning("[WARNING] انقطاع في اتصال MT5 تم اكتشافه - إعادة الاتصال تتم في الخلفية")
                 last_connection_check = current_time
             
             # مراقبة المستخدمين النشطين فقط
@@ -6542,67 +9770,89 @@ def monitoring_loop():
             
             # الخطوة 2: جلب البيانات لجميع الرموز مرة واحدة فقط
             symbols_data = {}  # {symbol: price_data}
+            try:
+                symbols_data = mt5_manager.get_live_prices(list(all_symbols_needed))
+            except Exception as e:
+                logger.error(f"[ERROR] خطأ في جلب بيانات الرموز دفعة واحدة: {e}")
+            
             for symbol in all_symbols_needed:
-                try:
-                    price_data = mt5_manager.get_live_price(symbol)
-                    if price_data:
-                        symbols_data[symbol] = price_data
-                    else:
-                        failed_operations += 1
-                        if not mt5_manager.connected:
-                            mt5_connection_errors += 1
-                except Exception as e:
-                    logger.error(f"[ERROR] خطأ في جلب بيانات {symbol}: {e}")
+                if symbol not in symbols_data:
                     failed_operations += 1
+                    if not mt5_manager.connected:
+                        mt5_connection_errors += 1
             
-            # الخطوة 3: معالجة كل رمز مع المستخدمين المهتمين به
+            # حساب المؤشرات الفنية لجميع الرموز في استدعاء متجه واحد
+            technical_batch = {}
+            if symbols_data:
+                try:
+                    technical_batch = mt5_manager.calculate_technical_indicators_batch(list(symbols_data))
+                except Exception as e:
+                    logger.error(f"[ERROR] خطأ في حساب المؤشرات دفعة واحدة: {e}")
+            
+            # الخطوة 3: اختيار الرموز التي تحتاج تحليلاً (بوابة التغير ثم كاش التحليلات)
+            gate_skips = {}  # {symbol/trading_mode: سبب التخطي} لهذه الدورة
+            budget_skips = []  # رموز بلا تحليل جديد لأن ميزانية Gemini للمراقبة مستنفدة
+            gemini_allowed = gemini_usage.allow(monitoring=True)
+            ready = []  # [(job, analysis)] من الكاش
+            pending = set()  # {(symbol, trading_mode)} بانتظار Gemini
+            mode_users = {}  # {(symbol, trading_mode): [user_id]}
+            jobs = []
             for symbol, price_data in symbols_data.items():
                 try:
-                    # تحليل الرمز مرة واحدة فقط
-                    analysis = gemini_analyzer.analyze_market_data_with_retry(symbol, price_data, users_by_symbol[symbol][0])
-                    
-                    if not analysis:
-                        failed_operations += len(users_by_symbol[symbol])
-                        continue
+                    technical_data = technical_batch.get(symbol)
+                    current_price = price_data.get('last') or price_data.get('bid', 0)
                     
-                    # إرسال للمستخدمين المهتمين بهذا الرمز
+                    # تحليل أساسي واحد لكل (رمز، نمط تداول) - من كاش التحليلات إذا لم تتغير الشمعة أو بصمة المؤشرات
+                    users_by_mode = defaultdict(list)
                     for user_id in users_by_symbol[symbol]:
-                        try:
-                            # الحصول على إعدادات المستخدم
-                            settings = get_user_advanced_notification_settings(user_id)
-                            min_confidence = settings.get('success_threshold', 70)
-                            alert_timing = settings.get('alert_timing', '24h')
-                            
-                            # فحص التوقيت المناسب للإشعارات
-                            if not is_notification_time_allowed(user_id, alert_timing):
-                                successful_operations += 1  # العملية نجحت لكن ليس الوقت المناسب
-                                continue
-                            
-                            # إرسال التنبيه إذا كانت هناك إشارة قوية
-                            if analysis.get('confidence', 0) >= min_confidence:
-                                signal = {
-                                    'action': analysis.get('action', 'HOLD'),
-                                    'confidence': analysis.get('confidence', 0),
-                                    'reasoning': analysis.get('reasoning', [])
-                                }
-                                
-                                try:
-                                    send_trading_signal_alert(user_id, symbol, signal, analysis)
-                                    successful_operations += 1
-                                except Exception as alert_error:
-                                    logger.error(f"[ERROR] خطأ في إرسال تنبيه {symbol} للمستخدم {user_id}: {alert_error}")
-                                    failed_operations += 1
-                            else:
-                                successful_operations += 1  # لا توجد إشارة قوية ولكن العملية نجحت
-                                
-                        except Exception as user_error:
-                            logger.error(f"[ERROR] خطأ في معالجة المستخدم {user_id} للرمز {symbol}: {user_error}")
-                            failed_operations += 1
+                        users_by_mode[get_user_trading_mode(user_id)].append(user_id)
+                    for trading_mode, subscribers in users_by_mode.items():
+                        # بوابة التغير الجوهري: آخر تحليل لهذا النمط ما زال يمثل حالة الرمز - لا تحليل ولا تنبيهات مكررة
+                        should_analyze, gate_reason = change_gate.check(symbol, technical_data, current_price,
+                                                                        subscribers, trading_mode)
+                        if not should_analyze:
+                            gate_skips[f"{symbol}/{trading_mode}"] = gate_reason
+                            successful_operations += len(subscribers)
                             continue
-                            
+                        
+                        mode_users[(symbol, trading_mode)] = subscribers
+                        job = (symbol, price_data, None, technical_data, trading_mode)
+                        analysis = analysis_cache.get(symbol, technical_data, trading_mode, current_price)
+                        if analysis is not None:
+                            ready.append((job, analysis))
+                        elif not gemini_allowed:
+                            budget_skips.append(symbol)
+                            successful_operations += len(subscribers)
+                        else:
+                            pending.add((symbol, trading_mode))
+                            jobs.append(job)
+                        
                 except Exception as symbol_error:
                     logger.error(f"[ERROR] خطأ في معالجة الرمز {symbol}: {symbol_error}")
                     failed_operations += len(users_by_symbol[symbol])
+            
+            # الخطوة 4: تحليلات Gemini بالتوازي وإرسال كل نتيجة فور اكتمالها مع تخصيص محلي لكل مشترك
+            for job, analysis in itertools.chain(ready, gemini_analyzer.analyze_many(jobs)):
+                symbol, price_data, _, technical_data, trading_mode = job
+                subscribers = mode_users[(symbol, trading_mode)]
+                try:
+                    current_price = price_data.get('last') or price_data.get('bid', 0)
+                    if (symbol, trading_mode) in pending:
+                        analysis_cache.put(symbol, technical_data, trading_mode, current_price, analysis)
+                    
+                    if not analysis:
+                        failed_operations += len(subscribers)
+                        continue
+                    if analysis.get('source') != 'Fallback Analysis':
+                        change_gate.record(symbol, technical_data, current_price, subscribers, trading_mode)
+                    
+                    delivered, failed = deliver_analysis_to_users(symbol, analysis, subscribers, price_data)
+                    successful_operations += delivered
+                    failed_operations += failed
+                    
+                except Exception as symbol_error:
+                    logger.error(f"[ERROR] خطأ في معالجة الرمز {symbol} ({trading_mode}): {symbol_error}")
+                    failed_operations += len(subscribers)
                     continue
             
             # تتبع نجاح العمليات وحالة الاتصال
@@ -6618,8 +9868,26 @@ def monitoring_loop():
                 
                 # إذا كانت معظم الأخطاء بسبب MT5، نحاول إعادة الاتصال
                 if mt5_connection_errors > failed_operations * 0.7:  # 70% من الأخطاء بسبب MT5
-                    logger.info("[RECONNECT] محاولة إعادة اتصال شاملة بسبب أخطاء MT5 المتكررة...")
-                    mt5_manager.check_real_connection()
+                    logger.info("[RECONNECT] طلب فحص الاتصال بسبب أخطاء MT5 المتكررة...")
+                    mt5_manager.supervisor.report_failure("أخطاء MT5 متكررة في حلقة المراقبة")
+            
+            cache_stats = mt5_manager.indicator_cache.stats()
+            logger.debug(f"[CACHE] كاش المؤشرات: {cache_stats['hits']} إصابة / {cache_stats['misses']} إخفاق ({cache_stats['hit_rate']:.1f}%) - الحجم {cache_stats['size']}")
+            cache_stats = analysis_cache.stats()
+            logger.debug(f"[CACHE] كاش التحليلات: {cache_stats['hits']} إصابة / {cache_stats['misses']} إخفاق ({cache_stats['hit_rate']:.1f}%) - إلغاء بالحركة {cache_stats['invalidations']} - الحجم {cache_stats['size']}")
+            if gate_skips:
+                logger.info(f"[GATE] تخطي {len(gate_skips)} (رمز، نمط) بدون تغير جوهري: {gate_skips}")
+            gate_stats = change_gate.stats()
+            logger.debug(f"[GATE] مرر {gate_stats['passed_total']} / تخطى {gate_stats['skipped_total']} - أسباب التخطي: {gate_stats['skipped']} - أسباب التمرير: {gate_stats['passed']}")
+            limiter_stats = gemini_limiter.stats()
+            logger.debug(f"[GEMINI] {len(jobs)} تحليل بالتوازي ({GEMINI_MAX_CONCURRENCY} خيوط) - المتاح: {limiter_stats['requests_available']:.1f} طلب / {limiter_stats['tokens_available']:.0f} توكن - انتظر المحدد {limiter_stats['throttled']} - رفض {limiter_stats['rejected']}")
+            response_stats = gemini_analyzer.response_stats
+            logger.debug(f"[GEMINI] ردود منظمة {response_stats['structured']} - استخراج من النص {response_stats['regex_fallback']}")
+            if budget_skips:
+                logger.warning(f"[BUDGET] تخطي تحليل {len(budget_skips)} رمز - ميزانية Gemini اليومية للمراقبة مستنفدة: {budget_skips}")
+            usage_stats = gemini_usage.stats()
+            logger.debug(f"[BUDGET] اليوم {usage_stats['day_tokens']:,} توكن (الميزانية {usage_stats['daily_budget'] or 'بدون حد'}) - "
+                         f"هذه الساعة {usage_stats['hour']['calls']:.0f} طلب / ${usage_stats['hour']['cost']:.4f} - الأعلى تكلفة: {usage_stats['top_symbols']}")
             
             # انتظار 15 ثانية - تردد موحد لجميع المستخدمين
             time.sleep(15)
@@ -6634,8 +9902,8 @@ def monitoring_loop():
                 consecutive_errors = 0  # إعادة تعيين العداد
                 
                 # محاولة إعادة تهيئة MT5 بعد الإيقاف المؤقت
-                logger.info("[RECONNECT] محاولة إعادة تهيئة MT5 بعد الإيقاف المؤقت...")
-                mt5_manager.initialize_mt5()
+                logger.info("[RECONNECT] طلب إعادة تهيئة MT5 بعد الإيقاف المؤقت...")
+                mt5_manager.supervisor.request_reconnect("إيقاف مؤقت بعد أخطاء متتالية")
             else:
                 # انتظار متدرج حسب عدد الأخطاء
                 wait_time = min(60 * consecutive_errors, 300)  # حد أقصى 5 دقائق
@@ -6663,6 +9931,19 @@ if __name__ == "__main__":
         logger.info("[SYSTEM] نظام التنبيهات: مراقبة لحظية مع تقييم المستخدم")
         logger.info("[SYSTEM] نظام التخزين: تسجيل جميع الصفقات والتقييمات")
         
+        # تحميل مواصفات جميع الرموز مرة واحدة (الدقة والنقطة وأحجام العقود)
+        mt5_manager.symbols.load(ALL_SYMBOLS.keys())
+        
+        if mt5_manager.archive.enabled:
+            logger.info(f"[ARCHIVE] تسجيل التيكات وشموع M1 في {mt5_manager.archive.root}")
+        
+        # بدء مشرف الاتصال (إعادة الاتصال في الخلفية)
+        mt5_manager.supervisor.start()
+        
+        # بدء خيط بث التيكات لجميع الرموز المدعومة
+        mt5_manager.tick_stream.subscribe(ALL_SYMBOLS.keys())
+        mt5_manager.tick_stream.start()
+        
         # إنشاء متغير لإيقاف حلقة المراقبة بأمان
         monitoring_active = True
         
@@ -6714,6 +9995,11 @@ if __name__ == "__main__":
     finally:
         # إغلاق اتصال MT5 عند الإنهاء بشكل آمن
         monitoring_active = False
+        mt5_manager.tick_stream.stop()
+        mt5_manager.archive.flush()
+        mt5_manager.yahoo_fallback.stop()
+        mt5_manager.price_router.stop()
+        mt5_manager.supervisor.stop()
         try:
             mt5_manager.graceful_shutdown()
         except Exception as e:
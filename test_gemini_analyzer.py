@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+اختبار محلل Gemini بنموذج وهمي - طلبات الدفعات وتعليمات النظام والردود المنظمة ومحاسبة الاستهلاك والتخصيص المحلي
+"""
+
+import json
+import time
+
+import pytest
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+        self.usage_metadata = None
+
+
+class FakeModel:
+    """نموذج يرد على طلبات الدفعات بمصفوفة JSON وعلى الطلبات الفردية بالرد المحدد (نص حر افتراضياً)"""
+
+    def __init__(self, items, single="توصية: شراء - نسبة نجاح الصفقة: 81%"):
+        self.items = items
+        self.single = single
+        self.prompts = []
+
+    def generate_content(self, prompt, generation_config=None, request_options=None):
+        self.prompts.append(prompt)
+        if generation_config and generation_config['response_schema']['type'] == 'ARRAY':
+            return FakeResponse("```json\n" + json.dumps(self.items, ensure_ascii=False) + "\n```")
+        return FakeResponse(self.single)
+
+
+def job(symbol, trading_mode='scalping'):
+    return (symbol, {'symbol': symbol, 'last': 1.0, 'bid': 1.0, 'ask': 1.0, 'source': 'Test'}, None, {}, trading_mode)
+
+
+def test_batch_splits_items_and_retries_malformed_alone(bot, monkeypatch):
+    model = FakeModel([
+        {'symbol': 'EURUSD', 'action': 'SELL', 'success_rate': 72, 'analysis': 'نسبة نجاح الصفقة: 72%'},
+        {'symbol': 'GBPUSD', 'action': 'maybe', 'success_rate': 60, 'analysis': '...'},
+        {'symbol': 'XAUUSD', 'action': 'BUY', 'success_rate': 'high', 'analysis': '...'},
+    ])
+    monkeypatch.setattr(bot.gemini_analyzer, 'model', model)
+    monkeypatch.setattr(bot.gemini_analyzer, 'analysis_model', model)
+    monkeypatch.setattr(bot, 'GEMINI_BATCH_SIZE', 3)
+
+    fallbacks = bot.gemini_analyzer.response_stats['regex_fallback']
+    jobs = [job('EURUSD'), job('GBPUSD'), job('XAUUSD')]
+    results = {done[0]: analysis for done, analysis in bot.gemini_analyzer.analyze_many(jobs)}
+
+    # طلب دفعة واحد ثم طلب فردي لكل عنصر غير صالح - التعليمات الثابتة في تعليمات النظام وليست في الطلبات
+    assert len(model.prompts) == 3
+    assert not any(bot.GEMINI_ANALYSIS_INSTRUCTIONS in prompt for prompt in model.prompts)
+    assert all(symbol in model.prompts[0] for symbol in ('EURUSD', 'GBPUSD', 'XAUUSD'))
+    assert results['EURUSD']['action'] == 'SELL' and results['EURUSD']['confidence'] == 72
+    assert results['EURUSD']['source'] == 'Gemini AI (Test)'
+    assert results['GBPUSD']['action'] == 'BUY' and results['XAUUSD']['confidence'] == 81
+    assert bot.gemini_analyzer.response_stats['regex_fallback'] == fallbacks + 2
+
+
+def test_failed_batch_call_falls_back_without_single_retries(bot, monkeypatch):
+    class FailingModel(FakeModel):
+        def generate_content(self, prompt, generation_config=None, request_options=None):
+            self.prompts.append(prompt)
+            raise TimeoutError("429 rate limit")
+
+    model = FailingModel([])
+    monkeypatch.setattr(bot.gemini_analyzer, 'model', model)
+    monkeypatch.setattr(bot.gemini_analyzer, 'analysis_model', model)
+    monkeypatch.setattr(bot, 'GEMINI_BATCH_SIZE', 3)
+
+    jobs = [job('EURUSD'), job('GBPUSD'), job('XAUUSD')]
+    results = {done[0]: analysis for done, analysis in bot.gemini_analyzer.analyze_many(jobs)}
+
+    # فشل الطلب كاملاً: تحليل احتياطي لكل رمز بدون طلبات فردية إضافية
+    assert len(model.prompts) == 1
+    assert {analysis['source'] for analysis in results.values()} == {'Fallback Analysis'}
+    assert set(results) == {'EURUSD', 'GBPUSD', 'XAUUSD'}
+
+
+def test_single_job_makes_one_attempt_within_timeout(bot, monkeypatch):
+    class FailingModel(FakeModel):
+        def generate_content(self, prompt, generation_config=None, request_options=None):
+            self.prompts.append(request_options)
+            raise TimeoutError("deadline exceeded")
+
+    model = FailingModel([])
+    monkeypatch.setattr(bot.gemini_analyzer, 'model', model)
+    monkeypatch.setattr(bot.gemini_analyzer, 'analysis_model', model)
+    monkeypatch.setattr(bot, 'GEMINI_BATCH_SIZE', 1)
+
+    # بدون إعادة محاولة أو انتظار بعد انتهاء مهلة analyze_many - الطلب نفسه محدود بنفس المهلة
+    started = time.monotonic()
+    results = list(bot.gemini_analyzer.analyze_many([job('EURUSD')], timeout=2))
+    assert time.monotonic() - started < 1
+    assert len(model.prompts) == 1 and model.prompts[0]['timeout'] <= 2
+    assert results[0][1]['source'] == 'Fallback Analysis'
+
+
+def test_slow_consumer_does_not_expire_pending_analyses(bot, monkeypatch):
+    model = FakeModel([], single=json.dumps({'action': 'BUY', 'success_rate': 70, 'analysis': 'نسبة نجاح الصفقة: 70%'}))
+    monkeypatch.setattr(bot.gemini_analyzer, 'model', model)
+    monkeypatch.setattr(bot.gemini_analyzer, 'analysis_model', model)
+    monkeypatch.setattr(bot, 'GEMINI_BATCH_SIZE', 1)
+    monkeypatch.setattr(bot, 'GEMINI_RESULT_GRACE', 0)
+
+    # المستهلك يرسل تنبيهات أبطأ من مهلة الطلب - المهلة تحسب من بدء كل طلب وليس من بداية الدورة
+    sources = []
+    for _, analysis in bot.gemini_analyzer.analyze_many([job('EURUSD'), job('GBPUSD'), job('XAUUSD')], timeout=0.3):
+        sources.append(analysis['source'])
+        time.sleep(0.4)
+    assert sources == ['Gemini AI (Test)'] * 3
+
+
+def test_instructions_inlined_without_system_instruction_model(bot, monkeypatch):
+    model = FakeModel([])
+    monkeypatch.setattr(bot.gemini_analyzer, 'model', model)
+    monkeypatch.setattr(bot.gemini_analyzer, 'analysis_model', None)
+
+    analysis = bot.gemini_analyzer.analyze_market_data(*job('EURUSD')[:2], technical_data={})
+    assert analysis['action'] == 'BUY'
+    assert model.prompts[0].startswith(bot.GEMINI_SYSTEM_INSTRUCTION)
+    assert 'سياق خاص بأزواج العملات الرئيسية' in model.prompts[0]
+
+
+def test_structured_response_read_in_one_pass(bot, monkeypatch):
+    model = FakeModel([], single=json.dumps({
+        'action': 'SELL', 'success_rate': 84, 'entry': 1.0850, 'tp1': 1.0820, 'tp2': 1.0790, 'sl': None,
+        'reasoning': 'تقاطع MACD سلبي مع RSI فوق 70', 'analysis': 'شراء سابق انتهى - نسبة نجاح الصفقة: 84%'},
+        ensure_ascii=False))
+    monkeypatch.setattr(bot.gemini_analyzer, 'model', model)
+    monkeypatch.setattr(bot.gemini_analyzer, 'analysis_model', model)
+    structured = bot.gemini_analyzer.response_stats['structured']
+
+    analysis = bot.gemini_analyzer.analyze_market_data(*job('EURUSD')[:2], technical_data={})
+    # الحقول المنظمة تحسم التوصية رغم ورود كلمة "شراء" في النص
+    assert analysis['action'] == 'SELL' and analysis['confidence'] == 84
+    assert analysis['tp1'] == 1.0820 and analysis['sl'] is None
+    assert analysis['reasoning'] == ['تقاطع MACD سلبي مع RSI فوق 70']
+    assert bot.gemini_analyzer.response_stats['structured'] == structured + 1
+
+
+def test_usage_accounting_and_budget_sheds_monitoring_only(bot, monkeypatch):
+    usage = bot.GeminiUsageTracker(daily_budget=10_000, monitoring_share=0.5)
+    model = FakeModel([])
+    monkeypatch.setattr(bot.gemini_analyzer, 'model', model)
+    monkeypatch.setattr(bot.gemini_analyzer, 'usage', usage)
+
+    usage.record('analysis', ['EURUSD', 'GBPUSD'], [1, 2], 3000, 1000, 2.0, 'ok')
+    assert usage.by_symbol['EURUSD']['prompt_tokens'] == 1500
+    assert usage.by_user[2]['output_tokens'] == 500
+    assert usage.stats()['hour']['cost'] == pytest.approx((3000 * 0.30 + 1000 * 2.50) / 1e6)
+
+    # بعد حصة المراقبة: طلبات المراقبة ترفض والطلبات اليدوية تستمر
+    usage.record('rules', [], [1], 1500, 500, 1.0, 'ok')
+    bot.set_thread_mt5_priority(bot.MT5_PRIORITY_MONITORING)
+    try:
+        with pytest.raises(bot.GeminiBudgetExceeded):
+            bot.gemini_analyzer._generate_content("prompt", symbols=['EURUSD'])
+    finally:
+        bot.set_thread_mt5_priority(bot.MT5_PRIORITY_INTERACTIVE)
+    bot.gemini_analyzer._generate_content("prompt", kind='rules', users=[1])
+    assert len(model.prompts) == 1
+    assert usage.stats()['outcomes'] == {'analysis:ok': 1, 'rules:ok': 2, 'analysis:shed': 1}
+
+
+def test_core_analysis_per_mode_with_local_personalization(bot, monkeypatch):
+    model = FakeModel([], single=json.dumps({
+        'action': 'BUY', 'success_rate': 80, 'reasoning': 'اتجاه صاعد', 'analysis': 'نسبة نجاح الصفقة: 80%'}))
+    monkeypatch.setattr(bot.gemini_analyzer, 'model', model)
+    monkeypatch.setattr(bot.gemini_analyzer, 'analysis_model', model)
+    monkeypatch.setattr(bot, 'GEMINI_BATCH_SIZE', 4)
+    modes = {1: 'scalping', 2: 'scalping', 3: 'longterm'}
+    monkeypatch.setattr(bot, 'get_user_trading_mode', lambda user_id: modes[user_id])
+    monkeypatch.setattr(bot, 'get_user_capital', lambda user_id: 1000.0 * user_id)
+
+    # نفس الرمز بنمطين: طلب مستقل لكل نمط بدون بيانات أي مستخدم
+    done = list(bot.gemini_analyzer.analyze_many([job('EURUSD', 'scalping'), job('EURUSD', 'longterm')]))
+    assert len(model.prompts) == 2
+    assert not any('رأس المال' in prompt for prompt in model.prompts)
+    core = {item[4]: analysis for item, analysis in done}
+    assert core['scalping']['trading_mode'] == 'scalping' and core['scalping']['confidence'] == 80
+
+    # التخصيص محلي لكل مشترك: الثقة حسب النمط وحجم الصفقة من رأس ماله
+    first = bot.gemini_analyzer.personalize_analysis(core['scalping'], 1)
+    second = bot.gemini_analyzer.personalize_analysis(core['scalping'], 2)
+    longterm = bot.gemini_analyzer.personalize_analysis(core['longterm'], 3)
+    assert first['confidence'] == pytest.approx(72) and longterm['confidence'] == pytest.approx(88)
+    assert first['trade_plan']['position_size'] == pytest.approx(20)
+    assert second['trade_plan']['position_size'] == pytest.approx(40)
+    assert longterm['trade_plan']['target'] == pytest.approx(1.05)
+    assert core['scalping']['confidence'] == 80 and len(model.prompts) == 2
+
+    # تحليل من الكاش يخصص بسعر الدورة الحالية وليس بالسعر المحفوظ معه
+    live = bot.gemini_analyzer.personalize_analysis(core['longterm'], 3, {'last': 2.0, 'bid': 2.0})
+    assert live['price_data']['last'] == 2.0
+    assert live['trade_plan']['target'] == pytest.approx(2.1)
+    assert core['longterm']['price_data']['last'] == 1.0
+
+    # مستويات Gemini المتسقة مع الاتجاه تحل محل النسب الثابتة للنمط، والمتناقضة تهمل
+    with_levels = dict(core['scalping'], entry=1.0, tp1=1.004, tp2=1.008, sl=0.997)
+    plan = bot.gemini_analyzer.personalize_analysis(with_levels, 1)['trade_plan']
+    assert (plan['target'], plan['target2'], plan['stop_loss']) == (1.004, 1.008, 0.997)
+    assert plan['levels_source'] == 'ai'
+    inverted = dict(with_levels, sl=1.002)
+    plan = bot.gemini_analyzer.personalize_analysis(inverted, 1)['trade_plan']
+    assert plan['levels_source'] == 'profile' and plan['target'] == pytest.approx(1.015)
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+اختبار أرشيف التيكات والشموع (ترميز الفروق والقراءة عبر memmap)
+"""
+
+import os
+from collections import namedtuple
+
+import numpy as np
+
+Tick = namedtuple('Tick', 'time bid ask last volume time_msc')
+
+
+def test_ticks_round_trip_across_days(bot, tmp_path):
+    archive = bot.MarketArchive(str(tmp_path), enabled=True, point_of=lambda symbol: 0.001, flush_rows=3)
+    start = 1_700_006_400_000  # بداية يوم UTC بالمللي ثانية
+    ticks = [Tick((start + i * 250) // 1000, 151.2 + i * 0.003, 151.215 + i * 0.003, 0.0, i, start + i * 250)
+             for i in range(10)]
+    for tick in ticks:
+        archive.record_tick('USDJPY', tick)
+    archive.record_tick('USDJPY', ticks[3])  # مكرر - يتجاهل
+    next_day = start + 86_400_000
+    archive.record_tick('USDJPY', Tick(next_day // 1000, 150.0, 150.01, 0.0, 1, next_day))
+    archive.flush()
+
+    days = archive.days('USDJPY')
+    assert len(days) == 2
+    first = archive.read('USDJPY', days[0])
+    assert len(first) == 10
+    assert (first['time_msc'] == [tick.time_msc for tick in ticks]).all()
+    assert np.allclose(first['bid'], [tick.bid for tick in ticks])
+    assert np.allclose(first['ask'], [tick.ask for tick in ticks])
+    assert [len(data) for _, data in archive.iter_days('USDJPY', start=days[1])] == [1]
+
+
+def test_closed_bars_recorded_once_and_partial_writes_dropped(bot, tmp_path):
+    archive = bot.MarketArchive(str(tmp_path), enabled=True, point_of=lambda symbol: 0.00001)
+    rates = np.zeros(5, dtype=bot.RATES_DTYPE)
+    rates['time'] = 1_700_006_400 + np.arange(5) * 60
+    rates['close'] = 1.08500 + np.arange(5) * 0.0001
+    rates['open'] = rates['close'] - 0.00005
+    rates['high'] = rates['close'] + 0.0002
+    rates['low'] = rates['open'] - 0.0002
+    rates['tick_volume'] = 40
+
+    archive.record_bars('EURUSD', rates)
+    archive.record_bars('EURUSD', rates[2:])  # تداخل - الشموع المسجلة لا تتكرر
+    archive.flush()
+
+    day = archive.days('EURUSD', archive.BARS)[0]
+    bars = archive.read('EURUSD', day, archive.BARS)
+    assert len(bars) == 4  # الشمعة الأخيرة جارية
+    for field in ('time', 'open', 'high', 'low', 'close', 'tick_volume'):
+        assert np.allclose(bars[field], rates[:4][field])
+
+    # بايتات زائدة بعد إغلاق مفاجئ تحذف عند فتح اليوم مجدداً
+    with open(os.path.join(tmp_path, 'EURUSD', day, 'bars_m1.close.bin'), 'ab') as f:
+        f.write(b'\x01\x00\x00\x00')
+    reopened = bot.MarketArchive(str(tmp_path), enabled=True, point_of=lambda symbol: 0.00001)
+    reopened.record_bars('EURUSD', rates)
+    reopened.flush()
+    assert len(reopened.read('EURUSD', day, archive.BARS)) == 4
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+اختبار خيط MT5 المخصص (الأولويات والمهل) ومشرف الاتصال ومراقبة الصحة
+"""
+
+import threading
+import time
+
+import numpy as np
+import pytest
+
+
+def test_interactive_requests_jump_ahead_and_deadlines_expire(bot):
+    worker = bot.MT5IOWorker()
+    release = threading.Event()
+    order = []
+    try:
+        # حجز الخيط بطلب طويل حتى تتراكم الطلبات في الطابور
+        blocker = worker.submit(release.wait, 1, priority=bot.MT5_PRIORITY_MAINTENANCE)
+
+        monitoring = worker.submit(order.append, 'monitoring', priority=bot.MT5_PRIORITY_MONITORING)
+        expired = worker.submit(order.append, 'expired', priority=bot.MT5_PRIORITY_INTERACTIVE, timeout=0)
+        interactive = worker.submit(order.append, 'interactive', priority=bot.MT5_PRIORITY_INTERACTIVE)
+
+        release.set()
+        for future in (blocker, monitoring, interactive):
+            future.result(timeout=1)
+
+        assert order == ['interactive', 'monitoring']
+        with pytest.raises(TimeoutError):
+            expired.result(timeout=1)
+
+        # أولوية الخيط الحالي تستخدم عند عدم تحديدها
+        bot.set_thread_mt5_priority(bot.MT5_PRIORITY_MONITORING)
+        assert bot.get_thread_mt5_priority() == bot.MT5_PRIORITY_MONITORING
+        assert worker.call(sum, [1, 2]) == 3
+    finally:
+        bot.set_thread_mt5_priority(bot.MT5_PRIORITY_INTERACTIVE)
+        worker.stop()
+
+
+def test_supervisor_reconnects_in_background(bot, monkeypatch):
+    monkeypatch.setattr(bot, 'SUPERVISOR_BACKOFF_BASE', 0.01)
+    monkeypatch.setattr(bot, 'SUPERVISOR_BACKOFF_MAX', 0.02)
+    monkeypatch.setattr(bot, 'SUPERVISOR_DEGRADED_RECHECK', 0.01)
+    terminal = {'up': False, 'attempts': 0}
+
+    class Manager:
+        connected = False
+        io = bot.MT5IOWorker()
+        health = bot.MT5HealthMonitor()
+
+        def _initialize_mt5_job(self):
+            terminal['attempts'] += 1
+            self.connected = terminal['up']
+            return terminal['up']
+
+        def _probe_connection_job(self):
+            return terminal['up']
+
+    manager = Manager()
+    supervisor = bot.ConnectionSupervisor(manager, connected=False)
+    try:
+        supervisor.start()
+        for _ in range(200):
+            if supervisor.state == bot.ConnectionSupervisor.DOWN:
+                break
+            threading.Event().wait(0.01)
+        assert supervisor.state == bot.ConnectionSupervisor.DOWN
+        assert not supervisor.is_available() and not manager.connected
+
+        terminal['up'] = True
+        supervisor.request_reconnect("test")
+        for _ in range(200):
+            if supervisor.state == bot.ConnectionSupervisor.CONNECTED:
+                break
+            threading.Event().wait(0.01)
+        assert supervisor.state == bot.ConnectionSupervisor.CONNECTED and manager.connected
+
+        # فشلان متتاليان في الفحص: تدهور ثم إعادة اتصال
+        terminal['up'] = False
+        supervisor.report_failure("test")
+        assert supervisor.state == bot.ConnectionSupervisor.DEGRADED
+        for _ in range(200):
+            if not supervisor.is_available():
+                break
+            threading.Event().wait(0.01)
+        assert supervisor.state in (bot.ConnectionSupervisor.RECONNECTING, bot.ConnectionSupervisor.DOWN)
+    finally:
+        supervisor.stop()
+        manager.io.stop()
+
+
+def test_supervisor_keeps_reconnect_requested_during_probe(bot, monkeypatch):
+    probing = threading.Event()
+    release = threading.Event()
+
+    class Manager:
+        connected = True
+        io = bot.MT5IOWorker()
+        health = bot.MT5HealthMonitor()
+
+        def _probe_connection_job(self):
+            probing.set()
+            release.wait(1)
+            return True
+
+    manager = Manager()
+    supervisor = bot.ConnectionSupervisor(manager, connected=True)
+    supervisor.state = bot.ConnectionSupervisor.DEGRADED
+    checker = threading.Thread(target=supervisor._check)
+    try:
+        checker.start()
+        assert probing.wait(1)
+        # طلب إعادة اتصال من خيط مستدعٍ بينما الفحص جارٍ - نتيجة الفحص الناجح لا تلغيه
+        supervisor.request_reconnect("test")
+        release.set()
+        checker.join(1)
+        assert supervisor.state == bot.ConnectionSupervisor.RECONNECTING and not manager.connected
+        assert supervisor.attempts == 0
+    finally:
+        release.set()
+        manager.io.stop()
+
+
+def test_health_monitor_uses_observed_traffic(bot):
+    monitor = bot.MT5HealthMonitor()
+    assert monitor.is_quiet() and not monitor.is_live()
+
+    monitor.record_tick(time.time() - 2)
+    monitor.record_call(True, 0.001)
+    assert monitor.is_live()
+    assert monitor.snapshot()['tick_age'] == pytest.approx(2, abs=1)
+
+    # كثرة الأخطاء تجعل الاتصال غير حي حتى مع وجود حركة
+    for _ in range(bot.HEALTH_MIN_SAMPLES):
+        monitor.record_call(False, 0.001)
+    assert not monitor.is_live()
+
+    # نجاح الاستدعاءات وحده لا يكفي - الحياة من وصول تيكات جديدة فقط
+    quiet = bot.MT5HealthMonitor()
+    quiet.record_call(True, 0.001)
+    assert quiet.is_quiet() and not quiet.is_live()
+
+    # المنصة المتوقفة تعيد نفس التيك - تكراره لا يجدد الحياة
+    stale = bot.MT5HealthMonitor()
+    tick_time = time.time() - 5
+    stale.record_tick(tick_time)
+    stale.last_tick_seen -= bot.HEALTH_QUIET_AFTER + 1
+    stale.record_tick(tick_time)
+    assert stale.is_quiet() and not stale.is_live()
+    stale.record_tick(tick_time, fresh=True)
+    assert stale.is_live()
+
+
+def test_empty_results_judged_by_terminal_error(bot, monkeypatch):
+    """MT5 يبلغ عن الفشل بإرجاع None - الفارغ فشل فقط مع خطأ من المنصة، ورمز غير موجود ليس فشلاً في الاتصال"""
+    error = [(bot.mt5.RES_S_OK, 'Success')]
+    monkeypatch.setattr(bot.mt5, 'last_error', lambda: error[0])
+    assert not bot._mt5_job_succeeded(False)
+    assert bot._mt5_job_succeeded({'EURUSD': object()})
+    assert bot._mt5_job_succeeded([])
+
+    error[0] = (bot.mt5.RES_E_NOT_FOUND, 'Symbol not found')
+    assert bot._mt5_job_succeeded(None)
+    assert bot._mt5_job_succeeded({'NOTLISTED': None})
+
+    error[0] = (bot.mt5.RES_E_FAIL, 'Call failed')
+    assert not bot._mt5_job_succeeded({'EURUSD': None, 'GBPUSD': None})
+    assert not bot._mt5_job_succeeded([])
+
+    error[0] = (-10004, 'No IPC connection')
+    assert not bot._mt5_job_succeeded({'EURUSD': object()})
+
+    outcomes = []
+    worker = bot.MT5IOWorker()
+    worker.observer = lambda ok, latency: outcomes.append(ok)
+    try:
+        assert worker.call(lambda: {'EURUSD': None}) == {'EURUSD': None}
+        error[0] = (bot.mt5.RES_S_OK, 'Success')
+        worker.call(lambda: None)
+    finally:
+        worker.stop()
+    assert outcomes == [False, True]
+
+
+def test_symbol_registry_serves_metadata_from_memory(bot, monkeypatch):
+    from types import SimpleNamespace
+
+    calls = []
+
+    def symbol_info(symbol):
+        calls.append(symbol)
+        return SimpleNamespace(name=symbol, description=symbol, point=0.001, digits=3, spread=12,
+                               volume_min=0.01, volume_max=50.0, volume_step=0.01, trade_contract_size=100000.0,
+                               currency_base='USD', currency_profit='JPY', currency_margin='USD')
+
+    monkeypatch.setattr(bot.mt5, 'symbol_info', symbol_info)
+
+    class Manager:
+        connected = True
+        io = bot.MT5IOWorker()
+
+    registry = bot.SymbolMetadataRegistry(Manager())
+    try:
+        assert registry.load(['USDJPY']) == 1
+        assert calls == ['USDJPY']
+
+        # التنسيق والنقاط من الذاكرة بدون استدعاءات جديدة
+        assert registry.format_price('USDJPY', 151.23456) == '151.235'
+        assert registry.to_points('USDJPY', 0.25) == pytest.approx(250)
+        assert registry.to_pips('USDJPY', 0.25) == pytest.approx(25)
+        # العملة الأساسية الدولار: قيمة اللوت هي حجم العقد وليست حجم العقد × السعر
+        assert registry.lot_value('USDJPY', 151.2) == pytest.approx(100000)
+        assert registry.normalize_volume('USDJPY', 0.0567) == 0.05
+        assert registry.normalize_volume('USDJPY', 80) == 50.0
+        assert calls == ['USDJPY']
+
+        # رمز غير محمل: قيم افتراضية فوراً وتحميله في الخلفية
+        Manager.connected = False
+        assert registry.digits('XAUUSD') == 2
+        assert registry.digits('EURJPY') == 3
+        assert registry.point('EURUSD') == pytest.approx(0.00001)
+        assert registry.to_pips('EURUSD', 0.0050) == pytest.approx(50)
+        assert registry.lot_value('EURUSD', 1.085) == pytest.approx(108500)
+    finally:
+        Manager.io.stop()
+
+
+def test_symbol_registry_remembers_unlisted_symbols(bot, monkeypatch):
+    calls = []
+
+    def symbol_info(symbol):
+        calls.append(symbol)
+        return None
+
+    error = [(bot.mt5.RES_E_NOT_FOUND, 'Symbol not found')]
+    monkeypatch.setattr(bot.mt5, 'symbol_info', symbol_info)
+    monkeypatch.setattr(bot.mt5, 'last_error', lambda: error[0])
+
+    class Manager:
+        connected = True
+        io = bot.MT5IOWorker()
+
+    outcomes = []
+    Manager.io.observer = lambda ok, latency: outcomes.append(ok)
+    registry = bot.SymbolMetadataRegistry(Manager())
+    try:
+        assert registry.load(['ZZZUSD']) == 0
+        # رمز لا يدرجه الوسيط: القيم الافتراضية بدون طلب تحديث جديد في كل استدعاء - ولا يحتسب فشلاً في الاتصال
+        for _ in range(5):
+            assert registry.get('ZZZUSD')['source'] == 'default'
+        Manager.io.call(lambda: None)
+        assert calls == ['ZZZUSD']
+        assert outcomes == [True, True]
+
+        monkeypatch.setattr(bot, 'SYMBOL_METADATA_MISSING_TTL', -1)
+        registry.get('ZZZUSD')
+        Manager.io.call(lambda: None)
+        assert calls == ['ZZZUSD', 'ZZZUSD']
+
+        # فشل القراءة بخطأ اتصال لا يسجل الرمز كغير مدرج
+        error[0] = (-10004, 'No IPC connection')
+        registry.invalidate()
+        assert registry.load(['EURUSD']) == 0
+        assert 'EURUSD' not in registry._missing
+        assert outcomes[-1] is False
+    finally:
+        Manager.io.stop()
+
+
+def test_bar_store_short_history_fetches_only_new_bars(bot, monkeypatch):
+    from types import SimpleNamespace
+
+    history = np.zeros(30, dtype=bot.RATES_DTYPE)
+    history['time'] = int(time.time()) // 60 * 60 - np.arange(30)[::-1] * 60
+    history['close'] = 1.1
+    requested = []
+
+    def copy_rates_from_pos(symbol, timeframe, start_pos, count):
+        requested.append(count)
+        return history[-count:].copy()
+
+    monkeypatch.setattr(bot.mt5, 'copy_rates_from_pos', copy_rates_from_pos)
+    manager = SimpleNamespace(connected=True, io=bot.MT5IOWorker(), archive=SimpleNamespace(record_bars=lambda *a: None))
+    store = bot.BarStore(manager, capacity=500, min_refresh=0)
+    try:
+        assert len(store.get_bars('EURUSD', bot.mt5.TIMEFRAME_M1, 100)) == 30
+        # رمز بتاريخ أقصر من المطلوب: الاستدعاءات التالية تجلب الشموع الأحدث فقط وليس السعة كاملة
+        for _ in range(3):
+            assert len(store.get_bars('EURUSD', bot.mt5.TIMEFRAME_M1, 100)) == 30
+        assert requested[0] == 500
+        assert all(count <= 3 for count in requested[1:]) and len(requested) == 4
+    finally:
+        manager.io.stop()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+اختبار البديل المحلي لـ MetaTrader5 (البيانات الاصطناعية والمسجلة وحقن الأعطال)
+"""
+
+import csv
+import threading
+import time
+
+import pytest
+
+import mt5_offline
+
+
+@pytest.fixture
+def mt5(monkeypatch):
+    """حالة مستقلة لكل اختبار (البوت المحمل في اختبارات أخرى يشارك نفس الوحدة)"""
+    monkeypatch.setattr(mt5_offline, '_backend', mt5_offline.OfflineBackend(data_dir='', seed=7))
+    assert mt5_offline.initialize()
+    return mt5_offline
+
+
+def test_synthetic_data_is_deterministic_and_fresh(mt5):
+    rates = mt5.copy_rates_from_pos('EURUSD', mt5.TIMEFRAME_M15, 0, 100)
+    assert len(rates) == 100 and rates.dtype.names[0] == 'time'
+    assert (rates['high'] >= rates['low']).all()
+    assert (rates['time'][1:] - rates['time'][:-1] == 900).all()
+    assert time.time() - rates['time'][-1] < 900
+
+    tick = mt5.symbol_info_tick('EURUSD')
+    assert tick.ask > tick.bid > 0 and time.time() - tick.time < 2
+    assert mt5.symbol_info('USDJPY').digits == 3
+    assert mt5.symbol_info('UNKNOWN') is None
+
+    # نفس البذرة = نفس المسار
+    again = mt5.copy_rates_from_pos('EURUSD', mt5.TIMEFRAME_M15, 0, 100)
+    assert (again['close'][:-1] == rates['close'][:-1]).all()
+
+
+def test_recorded_bars_are_replayed(mt5, tmp_path):
+    start = 1_700_000_000 // 60 * 60
+    with open(tmp_path / 'TEST_M1.csv', 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['time', 'open', 'high', 'low', 'close', 'tick_volume', 'spread', 'real_volume'])
+        for i in range(2000):
+            writer.writerow([start + i * 60, 1 + i, 1.5 + i, 0.5 + i, 1 + i, 10, 5, 0])
+    mt5.configure(data_dir=str(tmp_path))
+    assert mt5.initialize()
+
+    # فقط الشموع حتى مؤشر الإعادة مكشوفة
+    rates = mt5.copy_rates_from_pos('TEST', mt5.TIMEFRAME_M1, 0, 5000)
+    assert len(rates) == mt5.OFFLINE_REPLAY_WARMUP
+    assert rates['close'][-1] == mt5.OFFLINE_REPLAY_WARMUP
+    assert time.time() - rates['time'][-1] < 120
+    assert mt5.symbol_info_tick('TEST').last == rates['close'][-1]
+
+    m5 = mt5.copy_rates_from_pos('TEST', mt5.TIMEFRAME_M5, 0, 3)
+    assert (m5['time'] % 300 == 0).all()
+    assert m5['tick_volume'][0] == 50
+
+
+def test_failure_injection_and_outage(mt5):
+    mt5.configure(failure_rate=1.0)
+    assert mt5.account_info() is None
+    assert mt5.last_error()[0] == mt5.RES_E_FAIL
+    mt5.configure(failure_rate=0)
+    assert mt5.account_info() is not None
+
+    # أثناء الانقطاع تفشل الاستدعاءات والتهيئة حتى انتهائه
+    mt5.disconnect()
+    assert mt5.symbol_info_tick('EURUSD') is None
+    assert not mt5.initialize()
+    mt5.reconnect()
+    assert mt5.initialize()
+    assert mt5.symbol_info_tick('EURUSD') is not None
+
+
+def test_concurrent_calls_are_counted_exactly(mt5):
+    mt5.configure(failure_rate=0.5, jitter=0.0001)
+    before = mt5.stats()
+    results = []
+
+    def worker():
+        results.extend(mt5.symbol_info_tick('EURUSD') for _ in range(200))
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # كل استدعاء يحتسب مرة واحدة وكل فشل محقون يطابق نتيجة None
+    stats = mt5.stats()
+    assert stats['calls'] - before['calls'] == 1600
+    assert stats['failures'] - before['failures'] == sum(tick is None for tick in results)
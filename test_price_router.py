@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+اختبار موجه مصادر الأسعار وقواطع الدائرة وكاش الأسعار ودمج الطلبات وكاش التحليلات ومحدد معدل Gemini
+"""
+
+import threading
+import time
+
+
+def test_breaker_fallback_and_recovery(bot, monkeypatch):
+    monkeypatch.setattr(bot, 'ROUTER_OPEN_COOLDOWN', 0)
+    state = {'mt5_up': True, 'mt5_calls': 0}
+
+    def fetch_mt5(symbols):
+        state['mt5_calls'] += 1
+        if not state['mt5_up']:
+            raise ConnectionError("down")
+        return {symbol: {'symbol': symbol, 'last': 1.0, 'source': 'MetaTrader5 (مصدر أساسي)'} for symbol in symbols}
+
+    def fetch_yahoo(symbols):
+        return {symbol: {'symbol': symbol, 'last': 2.0, 'source': 'Yahoo Finance (مصدر بديل)'} for symbol in symbols}
+
+    mt5_source = bot.PriceSource('mt5', fetch_mt5, probe=lambda: state['mt5_up'], rank=0)
+    yahoo_source = bot.PriceSource('yahoo', fetch_yahoo, rank=1)
+    router = bot.PriceSourceRouter([yahoo_source, mt5_source])
+    router.stop()  # الفحص يدوي في هذا الاختبار
+
+    # بنفس زمن الاستجابة تقريباً يفضل المصدر الأعلى جودة
+    assert router.fetch(['EURUSD'])['EURUSD']['source'].startswith('MetaTrader5')
+
+    # الإخفاقات المتتالية تفتح القاطع ثم يتوقف استدعاء MT5
+    state['mt5_up'] = False
+    for _ in range(bot.ROUTER_FAILURE_THRESHOLD):
+        assert router.fetch(['EURUSD'])['EURUSD']['source'].startswith('Yahoo')
+    assert mt5_source.state == bot.PriceSource.OPEN
+    calls = state['mt5_calls']
+    router.fetch(['EURUSD'])
+    assert state['mt5_calls'] == calls
+
+    # الفحص نصف المفتوح يعيد المصدر بعد تعافيه
+    assert not mt5_source.run_probe()
+    state['mt5_up'] = True
+    assert mt5_source.run_probe()
+    assert router.fetch(['EURUSD'])['EURUSD']['source'].startswith('MetaTrader5')
+
+
+def test_last_known_good_keeps_source(bot):
+    up = {'value': True}
+
+    def fetch(symbols):
+        if not up['value']:
+            raise ConnectionError("down")
+        return {symbol: {'symbol': symbol, 'last': 1.0, 'source': 'MetaTrader5 (مصدر أساسي)'} for symbol in symbols}
+
+    router = bot.PriceSourceRouter([bot.PriceSource('mt5', fetch)])
+    router.stop()
+    router.fetch(['EURUSD'])
+    up['value'] = False
+
+    data = router.fetch(['EURUSD', 'GBPUSD'])
+    assert list(data) == ['EURUSD']
+    assert data['EURUSD']['last_known_good']
+    assert data['EURUSD']['source'] == 'MetaTrader5 (مصدر أساسي)'
+
+
+def test_price_cache_stale_while_revalidate(bot):
+    cache = bot.PriceCache(ttl=0.05, max_size=2, max_stale=60)
+    refreshed = threading.Event()
+    calls = []
+
+    def refresh(symbol):
+        calls.append(symbol)
+        refreshed.set()
+        return {'symbol': symbol, 'last': 2.0}
+
+    cache.set('EURUSD', {'symbol': 'EURUSD', 'last': 1.0})
+    assert cache.get('EURUSD')['last'] == 1.0
+    time.sleep(0.06)
+
+    # القيمة المنتهية تعاد فوراً ويجري تحديث واحد في الخلفية
+    assert cache.get('EURUSD') is None
+    assert cache.get_or_revalidate('EURUSD', refresh)['last'] == 1.0
+    assert refreshed.wait(1)
+    for _ in range(100):
+        if cache.get('EURUSD'):
+            break
+        time.sleep(0.01)
+    assert cache.get('EURUSD')['last'] == 2.0
+    assert calls == ['EURUSD']
+
+    # الحجم محدود - يخرج الأقدم استخداماً وليس الأقدم كتابة
+    cache.set_many({'GBPUSD': {}, 'XAUUSD': {}})
+    assert len(cache) == 2 and cache.age('EURUSD') is None
+    cache.get('GBPUSD')
+    cache.set('USDJPY', {})
+    assert cache.age('GBPUSD') is not None and cache.age('XAUUSD') is None
+
+
+def test_price_cache_refreshes_on_bounded_workers(bot):
+    cache = bot.PriceCache(ttl=0.5, max_size=100, max_stale=60, refresh_workers=2)
+    release = threading.Event()
+    threads = set()
+
+    def refresh(symbol):
+        threads.add(threading.current_thread().name)
+        release.wait(1)
+        return {'symbol': symbol}
+
+    symbols = [f"SYM{i}" for i in range(20)]
+    cache.set_many({symbol: {} for symbol in symbols})
+    time.sleep(0.51)
+    before = threading.active_count()
+    for symbol in symbols:
+        cache.get_or_revalidate(symbol, refresh)
+    # عشرون رمزاً قديماً لا تنشئ عشرين خيطاً
+    assert threading.active_count() - before <= 2
+    release.set()
+    for _ in range(100):
+        if all(cache.get(symbol) for symbol in symbols):
+            break
+        time.sleep(0.01)
+    assert all(cache.get(symbol) for symbol in symbols)
+    assert len(threads) <= 2
+
+
+def test_live_prices_reads_all_ticks_in_one_mt5_request(bot, monkeypatch):
+    from types import SimpleNamespace
+
+    assert bot.mt5.initialize()
+    cache = bot.PriceCache(ttl=60, max_size=10, max_stale=60)
+    monkeypatch.setattr(bot, 'price_cache', cache)
+    manager = bot.MT5Manager.__new__(bot.MT5Manager)
+    manager.connected = True
+    manager.io = bot.MT5IOWorker()
+    manager.health = bot.MT5HealthMonitor()
+    manager.archive = SimpleNamespace(record_tick=lambda symbol, tick: None)
+    manager.price_router = SimpleNamespace(fetch=manager._fetch_mt5_prices)
+    streamed = bot.StreamedTick(time.time(), 2000.0, 2000.5, 2000.0, 1.0)
+    manager.tick_stream = SimpleNamespace(latest_tick=lambda symbol: streamed if symbol == 'XAUUSD' else None)
+    jobs = []
+    call = manager.io.call
+
+    def counting_call(fn, *args, **kwargs):
+        jobs.append(args)
+        return call(fn, *args, **kwargs)
+
+    monkeypatch.setattr(manager.io, 'call', counting_call)
+
+    try:
+        # رموز المراقبة بطلب MT5 واحد: البث أولاً، الرموز غير الصالحة والمكررة تتجاوز، والنتائج تحفظ في الكاش
+        prices = manager.get_live_prices(['EURUSD', 'GBPUSD', 'EURUSD', 'XAUUSD', 'null', ''])
+        assert set(prices) == {'EURUSD', 'GBPUSD', 'XAUUSD'}
+        assert prices['XAUUSD']['bid'] == 2000.0
+        assert jobs == [(['EURUSD', 'GBPUSD'],)]
+        assert cache.get('EURUSD')['bid'] == prices['EURUSD']['bid']
+
+        # الدورة التالية من الكاش بدون أي طلب MT5
+        assert set(manager.get_live_prices(['EURUSD', 'GBPUSD'])) == {'EURUSD', 'GBPUSD'}
+        assert len(jobs) == 1
+    finally:
+        manager.io.stop()
+
+
+def test_live_prices_batch_serves_stale_and_revalidates(bot, monkeypatch):
+    from types import SimpleNamespace
+
+    cache = bot.PriceCache(ttl=0.05, max_size=10, max_stale=60, refresh_workers=2)
+    monkeypatch.setattr(bot, 'price_cache', cache)
+    manager = bot.MT5Manager.__new__(bot.MT5Manager)
+    manager.tick_stream = SimpleNamespace(latest_tick=lambda symbol: None)
+    refreshed, fetched = [], []
+
+    def refresh(symbol):
+        refreshed.append(symbol)
+        return {'symbol': symbol, 'last': 2.0}
+
+    def fetch(symbols):
+        fetched.append(list(symbols))
+        return {symbol: {'symbol': symbol, 'last': 3.0} for symbol in symbols}
+
+    manager._revalidate_price = refresh
+    manager._fetch_and_cache_prices = fetch
+    cache.set_many({'EURUSD': {'symbol': 'EURUSD', 'last': 1.0}, 'GBPUSD': {'symbol': 'GBPUSD', 'last': 1.0}})
+    time.sleep(0.06)
+
+    # مسار الدفعة يعيد القيم القديمة فوراً ويحدثها في الخلفية - الجلب المتزامن للرموز غير المخزنة فقط
+    prices = manager.get_live_prices(['EURUSD', 'GBPUSD', 'XAUUSD'])
+    assert {symbol: data['last'] for symbol, data in prices.items()} == {'EURUSD': 1.0, 'GBPUSD': 1.0, 'XAUUSD': 3.0}
+    assert fetched == [['XAUUSD']]
+    for _ in range(100):
+        if cache.get('EURUSD') and cache.get('GBPUSD'):
+            break
+        time.sleep(0.01)
+    assert sorted(refreshed) == ['EURUSD', 'GBPUSD']
+    assert cache.get('EURUSD')['last'] == 2.0
+
+
+def test_single_flight_coalesces_concurrent_requests(bot):
+    flight = bot.SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def fetch(symbols):
+        calls.append(list(symbols))
+        started.set()
+        release.wait(1)
+        return {symbol: {'symbol': symbol, 'last': 1.0} for symbol in symbols}
+
+    results = {}
+    leader = threading.Thread(target=lambda: results.update(leader=flight.do_many(['EURUSD', 'GBPUSD'], fetch)))
+    leader.start()
+    assert started.wait(1)
+
+    # طلب متزامن لنفس الرمز ينضم للجلب الجاري بدلاً من رفضه
+    follower = threading.Thread(target=lambda: results.update(follower=flight.do('EURUSD', lambda s: None)))
+    follower.start()
+    time.sleep(0.05)
+    release.set()
+    leader.join(1)
+    follower.join(1)
+
+    assert calls == [['EURUSD', 'GBPUSD']]
+    assert results['follower']['last'] == 1.0
+    assert set(results['leader']) == {'EURUSD', 'GBPUSD'}
+    assert flight.coalesced == 1
+
+
+def test_analysis_cache_keys_and_invalidation(bot, monkeypatch):
+    cache = bot.AnalysisCache(ttl=60, max_move_pct=0.5)
+    technical = {'bar_time': 1_700_000_000, 'indicators': {
+        'rsi': 52.1, 'macd': {'macd': 0.0002, 'histogram': 0.0001}, 'overall_trend': 'صاعد'}}
+    analysis = {'action': 'BUY', 'confidence': 82, 'source': 'Gemini AI'}
+
+    cache.put('EURUSD', technical, 'scalping', 1.0850, analysis)
+    assert cache.get('EURUSD', technical, 'scalping', 1.0851) is analysis
+
+    # تغير صغير داخل نفس منطقة RSI لا يغير البصمة - عبور المنطقة أو نمط آخر يغيرها
+    nudged = {**technical, 'indicators': {**technical['indicators'], 'rsi': 53.4}}
+    assert cache.get('EURUSD', nudged, 'scalping', 1.0851) is analysis
+    crossed = {**technical, 'indicators': {**technical['indicators'], 'rsi': 56.0}}
+    assert cache.get('EURUSD', crossed, 'scalping', 1.0851) is None
+    assert cache.get('EURUSD', technical, 'longterm', 1.0851) is None
+    assert cache.get('EURUSD', {**technical, 'bar_time': 1_700_000_900}, 'scalping', 1.0851) is None
+
+    # حركة سعر كبيرة تلغي تحليلات الرمز
+    assert cache.get('EURUSD', technical, 'scalping', 1.0910) is None
+    assert cache.stats()['invalidations'] == 1
+    cache.put('EURUSD', technical, 'scalping', 1.0910, analysis)
+
+    # التحليل الاحتياطي لا يحفظ - وانتهاء المدة يلغي المحفوظ
+    cache.put('GBPUSD', technical, 'scalping', 1.27, {'source': 'Fallback Analysis'})
+    assert cache.get('GBPUSD', technical, 'scalping', 1.27) is None
+    monkeypatch.setattr(cache, 'ttl', -1)
+    assert cache.get('EURUSD', technical, 'scalping', 1.0910) is None
+
+
+def test_change_gate_passes_only_material_changes(bot):
+    gate = bot.MaterialChangeGate(enabled=True)
+
+    def technical(rsi=55.0, histogram=0.0001, volume_ratio=1.0, bar_time=1_700_000_000):
+        return {'bar_time': bar_time, 'indicators': {
+            'rsi': rsi, 'macd': {'macd': 0.0003, 'histogram': histogram}, 'volume_ratio': volume_ratio,
+            'bollinger': {'upper': 1.0900, 'lower': 1.0800}, 'support': 1.0700, 'resistance': 1.1000}}
+
+    assert gate.check('EURUSD', technical(), 1.0850, [1]) == (True, 'first_analysis')
+    gate.record('EURUSD', technical(), 1.0850, [1])
+
+    assert gate.check('EURUSD', technical(rsi=58.0), 1.0851, [1]) == (False, 'same_bar')
+    assert gate.check('EURUSD', technical(bar_time=1_700_000_900), 1.0852, [1]) == (False, 'below_thresholds')
+    assert gate.check('EURUSD', technical(rsi=71.0), 1.0851, [1]) == (True, 'rsi_zone')
+    assert gate.check('EURUSD', technical(histogram=-0.0001), 1.0851, [1]) == (True, 'macd_flip')
+    assert gate.check('EURUSD', technical(), 1.0910, [1]) == (True, 'band_break')
+    assert gate.check('EURUSD', technical(volume_ratio=2.0), 1.0851, [1]) == (True, 'volume_spike')
+    assert gate.check('EURUSD', technical(), 1.0851, [1, 2]) == (True, 'new_subscribers')
+
+    stats = gate.stats()
+    assert stats['skipped'] == {'same_bar': 1, 'below_thresholds': 1}
+    assert stats['passed_total'] == 6
+
+
+def test_change_gate_tracks_each_trading_mode(bot):
+    gate = bot.MaterialChangeGate(enabled=True)
+    technical = {'bar_time': 1_700_000_000, 'indicators': {
+        'rsi': 55.0, 'macd': {'macd': 0.0003, 'histogram': 0.0001}, 'volume_ratio': 1.0,
+        'bollinger': {'upper': 1.0900, 'lower': 1.0800}, 'support': 1.0700, 'resistance': 1.1000}}
+
+    # تحليل نمط ناجح لا يخفي نمطاً آخر فشل تحليله أو تخطته الميزانية
+    gate.record('EURUSD', technical, 1.0850, [1], 'scalping')
+    assert gate.check('EURUSD', technical, 1.0851, [1], 'scalping') == (False, 'same_bar')
+    assert gate.check('EURUSD', technical, 1.0851, [2], 'swing') == (True, 'first_analysis')
+    assert gate.stats()['last_skips'] == {'EURUSD/scalping': 'same_bar'}
+
+    gate.reset('EURUSD')
+    assert gate.check('EURUSD', technical, 1.0851, [1], 'scalping') == (True, 'first_analysis')
+
+
+def test_token_bucket_limits_requests_and_tokens(bot):
+    limiter = bot.TokenBucketLimiter(requests_per_minute=2, tokens_per_minute=1000)
+
+    assert limiter.acquire(400, timeout=0)
+    assert limiter.acquire(400, timeout=0)
+    # الدلو فارغ من الطلبات - الانتظار أطول من المهلة يرفض فوراً
+    assert not limiter.acquire(10, timeout=0.1)
+    assert limiter.stats()['rejected'] == 1
+
+    # الاستهلاك الفعلي الأقل من التقدير يعيد التوكنات للدلو
+    limiter.settle(400, 100)
+    assert limiter.stats()['tokens_available'] >= 500
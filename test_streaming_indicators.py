@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+اختبار تطابق محرك المؤشرات المتدرج مع حسابات مكتبة ta
+"""
+
+import types
+
+import numpy as np
+import pandas as pd
+import pytest
+
+ta = pytest.importorskip("ta")
+
+
+def make_bars(bot, count=120, seed=7):
+    """توليد شموع عشوائية واقعية بنوع RATES_DTYPE"""
+    rng = np.random.default_rng(seed)
+    close = 1.1 + np.cumsum(rng.normal(0, 1e-3, count))
+    open_ = np.r_[close[0], close[:-1]]
+    bars = np.zeros(count, dtype=bot.RATES_DTYPE)
+    bars['time'] = 1_700_000_100 // 900 * 900 + np.arange(count) * 900
+    bars['open'] = open_
+    bars['high'] = np.maximum(open_, close) + rng.random(count) * 5e-4
+    bars['low'] = np.minimum(open_, close) - rng.random(count) * 5e-4
+    bars['close'] = close
+    bars['tick_volume'] = rng.integers(100, 1000, count)
+    return bars
+
+
+def ta_reference(df):
+    """القيم الخام كما كانت تحسب سابقاً بمكتبة ta"""
+    close, high, low = df['close'], df['high'], df['low']
+    return {
+        'ma_10': ta.trend.sma_indicator(close, window=10),
+        'ma_20': ta.trend.sma_indicator(close, window=20),
+        'ma_50': ta.trend.sma_indicator(close, window=50),
+        'rsi': ta.momentum.rsi(close, window=14),
+        'macd': ta.trend.macd(close),
+        'macd_signal': ta.trend.macd_signal(close),
+        'macd_histogram': ta.trend.macd_diff(close),
+        'stoch_k': ta.momentum.stoch(high, low, close),
+        'stoch_d': ta.momentum.stoch_signal(high, low, close),
+        'bb_upper': ta.volatility.bollinger_hband(close),
+        'bb_middle': ta.volatility.bollinger_mavg(close),
+        'bb_lower': ta.volatility.bollinger_lband(close),
+        'avg_volume': df['tick_volume'].astype(float).rolling(window=20).mean(),
+        'resistance': high.rolling(window=20).max(),
+        'support': low.rolling(window=20).min(),
+    }
+
+
+def test_streaming_matches_ta_on_every_bar(bot):
+    bars = make_bars(bot)
+    reference = ta_reference(bot.rates_to_dataframe(bars))
+    state = bot.StreamingIndicatorState()
+
+    for i, bar in enumerate(bars):
+        values = state.update(bar, closed=True)
+        for name, series in reference.items():
+            expected = series.iloc[i]
+            if pd.isna(expected):
+                assert pd.isna(values[name]), (name, i)
+            else:
+                assert values[name] == pytest.approx(expected, rel=1e-9, abs=1e-12), (name, i)
+
+
+def test_forming_bar_does_not_change_state(bot):
+    bars = make_bars(bot)
+    engine = bot.StreamingIndicatorEngine()
+
+    first = engine.update_from_bars('EURUSD', 15, bars[:100])
+    again = engine.update_from_bars('EURUSD', 15, bars[:100])
+    reference = ta_reference(bot.rates_to_dataframe(bars[:100]))
+
+    for name, series in reference.items():
+        assert first[name] == pytest.approx(series.iloc[-1], rel=1e-9)
+        assert again[name] == pytest.approx(first[name], rel=1e-12)
+
+    # شمعة جديدة تغلق: يتم تثبيت الشمعة السابقة فقط ثم حساب الجارية
+    advanced = engine.update_from_bars('EURUSD', 15, bars[1:101])
+    reference = ta_reference(bot.rates_to_dataframe(bars[:101]))
+    for name, series in reference.items():
+        assert advanced[name] == pytest.approx(series.iloc[-1], rel=1e-9)
+
+
+def test_build_indicators_matches_previous_output(bot):
+    bars = make_bars(bot, count=100)
+    df = bot.rates_to_dataframe(bars)
+    reference = ta_reference(df)
+    values = bot.StreamingIndicatorEngine().update_from_bars('EURUSD', 15, bars)
+    indicators = bot.MT5Manager._build_indicators(values)
+
+    assert indicators['ma_50'] == pytest.approx(reference['ma_50'].iloc[-1], rel=1e-9)
+    assert indicators['rsi'] == pytest.approx(reference['rsi'].iloc[-1], rel=1e-9)
+    assert indicators['macd']['histogram'] == pytest.approx(reference['macd_histogram'].iloc[-1], rel=1e-9)
+    assert indicators['stochastic']['d'] == pytest.approx(reference['stoch_d'].iloc[-1], rel=1e-9)
+    assert indicators['bollinger']['lower'] == pytest.approx(reference['bb_lower'].iloc[-1], rel=1e-9)
+    assert indicators['current_price'] == df['close'].iloc[-1]
+    expected_change = (df['close'].iloc[-1] - df['close'].iloc[-2]) / df['close'].iloc[-2] * 100
+    assert indicators['price_change_pct'] == pytest.approx(expected_change)
+
+
+def test_vectorized_batch_matches_ta(bot):
+    symbols_bars = [make_bars(bot, count=100, seed=seed) for seed in range(5)]
+    stacked = np.stack(symbols_bars)
+    matrix = bot.compute_indicator_matrix(
+        stacked['close'], stacked['high'], stacked['low'], stacked['tick_volume'].astype(float)
+    )
+
+    for row, bars in enumerate(symbols_bars):
+        reference = ta_reference(bot.rates_to_dataframe(bars))
+        for name, series in reference.items():
+            assert matrix[name][row] == pytest.approx(series.iloc[-1], rel=1e-9), (name, row)
+
+
+def test_indicator_cache_per_bar(bot):
+    cache = bot.IndicatorCache(max_size=2)
+    assert cache.get('EURUSD', 15, 100) is None
+    cache.put('EURUSD', 15, 100, {'v': 1})
+    assert cache.get('EURUSD', 15, 100) == {'v': 1}
+
+    # شمعة جديدة تلغي نتيجة الشمعة السابقة لنفس الرمز
+    cache.put('EURUSD', 15, 200, {'v': 2})
+    assert cache.get('EURUSD', 15, 100) is None
+
+    # إخراج الأقدم استخداماً عند تجاوز الحجم
+    cache.put('GBPUSD', 15, 200, {'v': 3})
+    cache.get('EURUSD', 15, 200)
+    cache.put('XAUUSD', 15, 200, {'v': 4})
+    assert cache.get('GBPUSD', 15, 200) is None
+    assert cache.get('EURUSD', 15, 200) == {'v': 2}
+
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['size']) == (3, 3, 2)
+
+
+def fake_manager(bot, windows):
+    """مدير MT5 بشموع من القاموس windows ونفس مسارات الحساب الحقيقية (بدون اتصال أو خيوط)"""
+    manager = bot.MT5Manager.__new__(bot.MT5Manager)
+    manager.connected = True
+    manager.bar_cache = types.SimpleNamespace(get_bars=lambda symbol, timeframe, count: windows[symbol])
+    manager.indicator_cache = bot.IndicatorCache()
+    manager.indicator_engine = bot.StreamingIndicatorEngine()
+    return manager
+
+
+def test_cached_state_with_forming_bar_matches_ta(bot):
+    bars = make_bars(bot, count=100)
+    windows = {'EURUSD': bars.copy()}
+    manager = fake_manager(bot, windows)
+
+    first = manager.calculate_technical_indicators('EURUSD')
+    first['indicators']['rsi'] = -1
+
+    # نفس الشمعة المغلقة مع تيك جديد: الحالة المثبتة من الكاش والشمعة الجارية فوقها كما في iloc[-1]
+    windows['EURUSD'][-1]['close'] += 0.01
+    windows['EURUSD'][-1]['high'] = max(windows['EURUSD'][-1]['high'], windows['EURUSD'][-1]['close'])
+    windows['EURUSD'][-1]['tick_volume'] += 500
+    second = manager.calculate_technical_indicators('EURUSD')
+    reference = ta_reference(bot.rates_to_dataframe(windows['EURUSD']))
+
+    assert manager.indicator_cache.stats()['hits'] == 1
+    assert second['bar_time'] == int(bars['time'][-2])
+    indicators = second['indicators']
+    assert indicators['rsi'] == pytest.approx(reference['rsi'].iloc[-1], rel=1e-9)
+    assert indicators['ma_20'] == pytest.approx(reference['ma_20'].iloc[-1], rel=1e-9)
+    assert indicators['macd']['macd'] == pytest.approx(reference['macd'].iloc[-1], rel=1e-9)
+    assert indicators['bollinger']['upper'] == pytest.approx(reference['bb_upper'].iloc[-1], rel=1e-9)
+    assert indicators['stochastic']['k'] == pytest.approx(reference['stoch_k'].iloc[-1], rel=1e-9)
+    assert indicators['current_price'] == pytest.approx(bars['close'][-1] + 0.01)
+    assert indicators['current_volume'] == bars['tick_volume'][-1] + 500
+
+
+def test_new_closed_bar_updates_engine_incrementally(bot):
+    history = make_bars(bot, count=101)
+    windows = {'EURUSD': history[:100]}
+    manager = fake_manager(bot, windows)
+    manager.calculate_technical_indicators('EURUSD')
+    state = manager.indicator_engine.state('EURUSD', bot.mt5.TIMEFRAME_M15)
+
+    # شمعة مغلقة جديدة: المحرك يثبت شمعة واحدة فقط على نفس الحالة ولا يعيد البناء
+    windows['EURUSD'] = history[1:101]
+    result = manager.calculate_technical_indicators('EURUSD')
+    reference = ta_reference(bot.rates_to_dataframe(history))
+
+    assert manager.indicator_engine.state('EURUSD', bot.mt5.TIMEFRAME_M15) is state
+    assert state.last_time == int(history['time'][-2])
+    assert result['indicators']['rsi'] == pytest.approx(reference['rsi'].iloc[-1], rel=1e-9)
+    assert result['indicators']['macd']['macd'] == pytest.approx(reference['macd'].iloc[-1], rel=1e-9)
+
+
+def test_batch_and_single_paths_agree(bot):
+    history = {symbol: make_bars(bot, count=110, seed=seed) for seed, symbol in enumerate(('EURUSD', 'GBPUSD'))}
+    windows = {symbol: bars[:100] for symbol, bars in history.items()}
+    batch = fake_manager(bot, windows)
+    single = fake_manager(bot, windows)
+
+    # EURUSD له حالة متدرجة في مسار الدفعة (تحليل يدوي سابق) ثم تتقدم النافذة 5 شموع
+    batch.calculate_technical_indicators('EURUSD')
+    single.calculate_technical_indicators('EURUSD')
+    for symbol, bars in history.items():
+        windows[symbol] = bars[5:105]
+
+    results = batch.calculate_technical_indicators_batch(['EURUSD', 'GBPUSD'])
+    for symbol in ('EURUSD', 'GBPUSD'):
+        expected = single.calculate_technical_indicators(symbol)['indicators']
+        got = results[symbol]['indicators']
+        assert got['rsi'] == pytest.approx(expected['rsi'], rel=1e-9), symbol
+        assert got['macd']['macd'] == pytest.approx(expected['macd']['macd'], rel=1e-9), symbol
+        assert got['current_price'] == expected['current_price']
+
+
+def test_aggregate_bars_matches_resample(bot):
+    rng = np.random.default_rng(3)
+    count = 600
+    close = 1.1 + np.cumsum(rng.normal(0, 1e-4, count))
+    m1 = np.zeros(count, dtype=bot.RATES_DTYPE)
+    m1['time'] = 1_700_000_040 + np.arange(count) * 60
+    m1['open'] = np.r_[close[0], close[:-1]]
+    m1['high'] = np.maximum(m1['open'], close) + rng.random(count) * 1e-4
+    m1['low'] = np.minimum(m1['open'], close) - rng.random(count) * 1e-4
+    m1['close'] = close
+    m1['tick_volume'] = rng.integers(1, 100, count)
+
+    for seconds in (300, 900, 3600):
+        derived = bot.rates_to_dataframe(bot.aggregate_bars(m1, seconds))
+        expected = bot.rates_to_dataframe(m1).resample(f'{seconds}s').agg({
+            'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last', 'tick_volume': 'sum'
+        })
+        pd.testing.assert_frame_equal(
+            derived[expected.columns], expected, check_dtype=False, check_freq=False
+        )
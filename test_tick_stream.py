@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+اختبار حلقات التيكات وخيط بث التيكات على البديل المحلي لـ MetaTrader5
+"""
+
+import time
+from types import SimpleNamespace
+
+
+def make_tick(bot, msc, bid=1.1, ask=1.1002):
+    return bot.mt5.Tick(msc // 1000, bid, ask, bid, 1, msc, 6, 1.0)
+
+
+def fake_manager(bot):
+    """مدير بخيط MT5 حقيقي ومراقب صحة وأرشيف يسجل التيكات فقط"""
+    archived = []
+    return SimpleNamespace(connected=True, io=bot.MT5IOWorker(), health=bot.MT5HealthMonitor(),
+                           archive=SimpleNamespace(record_tick=lambda symbol, tick: archived.append(symbol),
+                                                   archived=archived))
+
+
+def test_ring_buffer_wraps_around_in_order(bot):
+    buffer = bot.TickRingBuffer(capacity=4)
+    assert buffer.latest() is None and len(buffer.snapshot()) == 0
+
+    for i in range(10):
+        buffer.append(make_tick(bot, 1_700_000_000_000 + i * 100), received=float(i))
+
+    # بعد الدوران: آخر 4 تيكات فقط وبترتيب زمني رغم أن بداية المصفوفة في منتصفها
+    assert len(buffer) == 4
+    snapshot = buffer.snapshot()
+    assert list(snapshot['time_msc']) == [1_700_000_000_000 + i * 100 for i in range(6, 10)]
+    assert list(buffer.snapshot(2)['received']) == [8.0, 9.0]
+    assert buffer.latest()['time_msc'] == 1_700_000_000_900
+
+    buffer.touch(42.0)
+    assert buffer.latest()['received'] == 42.0 and len(buffer) == 4
+
+
+def test_collector_dedups_by_time_msc(bot, monkeypatch):
+    ticks = {'EURUSD': make_tick(bot, 1_700_000_000_000)}
+    monkeypatch.setattr(bot.mt5, 'symbol_info_tick', lambda symbol: ticks.get(symbol))
+    manager = fake_manager(bot)
+    collector = bot.TickStreamCollector(manager, capacity=8)
+    collector.subscribe(['EURUSD'])
+    try:
+        collector._collect_once()
+        collector._collect_once()
+        # نفس التيك (نفس time_msc والسعر) يجدد وقت الاستلام فقط ولا يضاف مرة أخرى
+        assert len(collector.buffers['EURUSD']) == 1
+        assert manager.archive.archived == ['EURUSD']
+
+        ticks['EURUSD'] = make_tick(bot, 1_700_000_000_250)
+        collector._collect_once()
+        assert len(collector.buffers['EURUSD']) == 2
+        assert collector.buffers['EURUSD'].latest()['time_msc'] == 1_700_000_000_250
+    finally:
+        manager.io.stop()
+
+
+def test_collector_subscribe_and_stop_on_offline_backend(bot):
+    assert bot.mt5.initialize()
+    manager = fake_manager(bot)
+    collector = bot.TickStreamCollector(manager, interval=0.02, capacity=16)
+    collector.subscribe(['EURUSD', 'GBPUSD'])
+    collector.subscribe(['EURUSD', 'XAUUSD'])
+    assert collector.symbols() == ('EURUSD', 'GBPUSD', 'XAUUSD')
+    try:
+        collector.start()
+        for _ in range(100):
+            if all(len(collector.buffers[symbol]) for symbol in collector.symbols()):
+                break
+            time.sleep(0.01)
+        assert all(len(collector.buffers[symbol]) for symbol in collector.symbols())
+        assert collector.latest_tick('EURUSD').bid > 0
+        assert manager.health.last_tick_time is not None
+
+        collector.stop()
+        assert not collector.is_running()
+        # بعد الإيقاف لا تحديث للحلقات - آخر تيك يصبح قديماً ويعود المستدعون للجلب المباشر
+        received = collector.buffers['EURUSD'].latest()['received']
+        time.sleep(0.06)
+        assert collector.buffers['EURUSD'].latest()['received'] == received
+        assert collector.latest_tick('EURUSD', max_age=0.05) is None
+    finally:
+        collector.stop()
+        manager.io.stop()
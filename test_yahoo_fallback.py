@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+اختبار مصدر Yahoo Finance البديل مقابل خادم HTTP محلي
+"""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+PRICES = {'EURUSD=X': 1.0850, 'GBPUSD=X': 1.2710, 'GC=F': 2350.5}
+
+
+@pytest.fixture
+def spark_server():
+    """خادم محلي يحاكي نقطة spark ويسجل الطلبات"""
+    requests_seen = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            symbols = parse_qs(url.query)['symbols'][0].split(',')
+            requests_seen.append((url.path, symbols))
+            result = [{
+                'symbol': symbol,
+                'response': [{
+                    'timestamp': [1_700_000_000, 1_700_000_060],
+                    'indicators': {'quote': [{'close': [PRICES[symbol] - 0.001, PRICES[symbol]]}]}
+                }]
+            } for symbol in symbols if symbol in PRICES]
+            body = json.dumps({'spark': {'result': result, 'error': None}}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}", requests_seen
+    server.shutdown()
+    server.server_close()
+
+
+def test_missing_symbols_fetched_in_one_request(bot, spark_server):
+    base_url, requests_seen = spark_server
+    mapping = {'EURUSD': 'EURUSD=X', 'GBPUSD': 'GBPUSD=X', 'XAUUSD': 'GC=F'}
+    provider = bot.YahooFallbackProvider(mapping.get, base_url=base_url, refresh_interval=60)
+    try:
+        prices = provider.get_prices(['EURUSD', 'GBPUSD', 'XAUUSD', 'UNKNOWN'])
+        assert set(prices) == {'EURUSD', 'GBPUSD', 'XAUUSD'}
+        assert prices['XAUUSD']['last'] == pytest.approx(2350.5)
+        assert prices['EURUSD']['source'] == 'Yahoo Finance (مصدر بديل)'
+        assert requests_seen == [('/v7/finance/spark', ['EURUSD=X', 'GBPUSD=X', 'GC=F'])]
+
+        # ضمن مدة الصلاحية: من الكاش بدون طلبات جديدة
+        assert provider.get_price('GBPUSD')['last'] == pytest.approx(1.2710)
+        assert len(requests_seen) == 1
+    finally:
+        provider.stop()